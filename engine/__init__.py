@@ -0,0 +1,15 @@
+from .archive import JobArchive
+from .array import LocalArrayScheduler, get_task_directory
+from .database import CampaignDatabase
+from .monitor import OutputMonitor
+from .pipeline import Pipeline
+from .process import Cancellation, CancelledError, Process
+from .results import SharedResults
+from .retry import RetryManager, RetryPolicy
+from .scratch import ScratchManager
+from .scheduler import LocalScheduler, Resources, Task
+from .staging import Stager
+from .store import JobStore
+from .timing import TimingHistory
+from .tuning import AutoTuner, get_template_hash
+from .watch import CompletionWatcher
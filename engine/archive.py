@@ -0,0 +1,121 @@
+"""Module for packing finished job directories into a single archive.
+
+A campaign of many thousands of jobs leaves as many directories behind,
+each holding an input, an output and the program's leftovers.  Packing the
+inputs and outputs into one zip archive, whose central directory allows any
+member to be read without extracting the others, frees all of those inodes.
+"""
+import os
+import shutil
+import zipfile
+
+ARCHIVE_NAME = "jobs.zip"
+
+
+class JobArchive(object):
+    """A zip archive holding the files of finished job directories.
+
+    Members are named by their path relative to `root_path`, so that the
+    file 'root/disp3/output.dat' is stored as 'disp3/output.dat' and can be
+    read through the path 'root/jobs.zip/disp3/output.dat' by
+    `parse.read_file`.
+
+    Attributes:
+        archive_path (str): The path of the archive.
+        root_path (str): The directory the member names are relative to, by
+            default the one holding the archive.
+        compression (int): The zipfile compression method.
+    """
+
+    def __init__(self, archive_path, root_path=None,
+                 compression=zipfile.ZIP_DEFLATED):
+        self.archive_path = os.path.abspath(archive_path)
+        self.root_path = os.path.abspath(
+            os.path.dirname(self.archive_path) if root_path is None
+            else root_path)
+        self.compression = compression
+
+    def get_member(self, path):
+        """Return the archive member name of a file path.
+        """
+        relative_path = os.path.relpath(os.path.abspath(path),
+                                        self.root_path)
+        if relative_path.startswith(os.pardir):
+            raise ValueError("'{:s}' is outside of '{:s}'."
+                             .format(path, self.root_path))
+        return relative_path.replace(os.sep, "/")
+
+    def get_path(self, path):
+        """Return the path through which a packed file can be read.
+        """
+        return os.path.join(self.archive_path, self.get_member(path))
+
+    def get_names(self):
+        """Return the names of the archive's members.
+        """
+        if not os.path.exists(self.archive_path):
+            return []
+        with zipfile.ZipFile(self.archive_path) as archive:
+            return archive.namelist()
+
+    def pack(self, job_dir_paths, file_names=None, remove=True):
+        """Pack the files of job directories into the archive.
+
+        New members are appended to the archive in place, so that packing
+        jobs as they finish costs time in proportion to the new files only.
+        Only if a member has to be replaced is the archive rewritten to a
+        temporary file, keeping the other members, and moved into place.
+        Either way, the archive is synced before the job directories are
+        removed, so no packed file is ever lost.  An append interrupted by a
+        crash can leave the archive without its central directory, which
+        tools such as `zip -FF` rebuild.
+
+        Args:
+            job_dir_paths: The job directories.
+            file_names: The names of the files to keep from each directory,
+                such as the input and output names.  By default, every
+                regular file is kept.
+            remove: Whether to remove the job directories once packed.  Job
+                directories that are links, e.g. into a JobStore, are
+                unlinked, leaving their targets alone.
+        """
+        files = {}
+        for job_dir_path in job_dir_paths:
+            if file_names is None:
+                names = sorted(os.listdir(job_dir_path))
+            else:
+                names = file_names
+            for name in names:
+                path = os.path.join(job_dir_path, name)
+                if os.path.isfile(path) and not os.path.islink(path):
+                    files[self.get_member(path)] = path
+        if files.keys() & set(self.get_names()):
+            self._rewrite(files)
+        else:
+            with zipfile.ZipFile(self.archive_path, 'a',
+                                 self.compression) as target:
+                for member, path in sorted(files.items()):
+                    target.write(path, member)
+            with open(self.archive_path, 'rb') as archive_file:
+                os.fsync(archive_file.fileno())
+        if remove:
+            for job_dir_path in job_dir_paths:
+                if os.path.islink(job_dir_path):
+                    os.remove(job_dir_path)
+                else:
+                    shutil.rmtree(job_dir_path, ignore_errors=True)
+
+    def _rewrite(self, files):
+        """Rewrite the archive with the given files replacing its members.
+        """
+        temporary_path = self.archive_path + ".tmp"
+        with zipfile.ZipFile(temporary_path, 'w', self.compression) as target:
+            with zipfile.ZipFile(self.archive_path) as source:
+                for info in source.infolist():
+                    if info.filename not in files:
+                        target.writestr(info, source.read(info))
+            for member, path in sorted(files.items()):
+                target.write(path, member)
+            target.fp.flush()
+            os.fsync(target.fp.fileno())
+        os.replace(temporary_path, self.archive_path)
@@ -0,0 +1,196 @@
+"""Module for array-job submission of many job directories.
+
+An array job runs one task per job directory.  The directories are listed in
+a task map file, whose line for each task gives its task ID (starting from 1,
+as for SGE and SLURM array jobs) followed by the directory path, relative to
+the task map file.
+"""
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+
+from .process import get_picklable_error
+
+TASK_MAP_NAME = "tasks.dat"
+TASK_ID_VARIABLES = ("PSIDER_TASK_ID", "SGE_TASK_ID", "SLURM_ARRAY_TASK_ID",
+                     "PBS_ARRAYID", "LSB_JOBINDEX")
+
+
+def write_task_map(task_map_path, job_dir_paths):
+    """Write a task map file.
+
+    Args:
+        task_map_path: The path of the task map file.
+        job_dir_paths: The job directories, in task order.
+    """
+    base_path = os.path.dirname(os.path.abspath(task_map_path))
+    with open(task_map_path, 'w') as task_map_file:
+        for task_id, job_dir_path in enumerate(job_dir_paths, start=1):
+            relative_path = os.path.relpath(os.path.abspath(job_dir_path),
+                                            base_path)
+            task_map_file.write("{:d} {:s}\n".format(task_id, relative_path))
+
+
+def read_task_map(task_map_path):
+    """Read a task map file.
+
+    Returns:
+        dict: Maps task IDs to absolute job directory paths.
+    """
+    base_path = os.path.dirname(os.path.abspath(task_map_path))
+    task_map = {}
+    with open(task_map_path) as task_map_file:
+        for line in task_map_file:
+            if line.strip():
+                task_id, job_dir_path = line.strip().split(None, 1)
+                task_map[int(task_id)] = os.path.join(base_path, job_dir_path)
+    return task_map
+
+
+def get_task_id(environ=None):
+    """Read the array task ID set by the scheduler.
+
+    Args:
+        environ: The environment to read, by default `os.environ`.
+
+    Returns:
+        int: The task ID.
+    """
+    if environ is None:
+        environ = os.environ
+    for variable in TASK_ID_VARIABLES:
+        if environ.get(variable, "").isdigit():
+            return int(environ[variable])
+    raise ValueError("No array task ID found in the environment.  Expected "
+                     "one of {:s}.".format(", ".join(TASK_ID_VARIABLES)))
+
+
+def get_task_directory(task_map_path, task_id=None):
+    """Look up the job directory of an array task.
+
+    Args:
+        task_map_path: The path of the task map file.
+        task_id: The task ID.  By default, it is read from the environment.
+
+    Returns:
+        str: The absolute path of the job directory.
+    """
+    if task_id is None:
+        task_id = get_task_id()
+    return read_task_map(task_map_path)[int(task_id)]
+
+
+class LocalArrayScheduler(object):
+    """A local stand-in for a cluster array-job scheduler.
+
+    An instance can be used as the submit function of a batch submission.
+    When called from the directory holding the task map, it runs
+    `task_function` once in every job directory, spread over a pool of worker
+    processes.  Each task sees its ID in the environment variable
+    PSIDER_TASK_ID, just as it would see SGE_TASK_ID on a cluster.
+
+    Attributes:
+        task_function: A callable executed in each job directory.
+        processes (int): The number of worker processes.
+        task_map_name (str): The name of the task map file.
+    """
+
+    def __init__(self, task_function, processes=None,
+                 task_map_name=TASK_MAP_NAME):
+        self.task_function = task_function
+        self.processes = (len(os.sched_getaffinity(0)) if processes is None
+                          else int(processes))
+        self.task_map_name = task_map_name
+        if not callable(self.task_function):
+            raise ValueError("This class requires a callable task function.")
+
+    def __call__(self):
+        """Run every task in the task map of the current directory.
+
+        Each worker gets its tasks one at a time through its own pipe.  A
+        worker that dies in the middle of a task, e.g. because it was killed,
+        fails that task and is replaced, so that the remaining tasks still
+        run.
+
+        Returns:
+            dict: Maps each task ID to the return value of `task_function`,
+                or to the exception it raised.
+        """
+        task_map = read_task_map(self.task_map_name)
+        # Workers are forked so that `task_function` need not be picklable;
+        # only task IDs and results pass through the pipes.
+        context = multiprocessing.get_context("fork")
+        task_ids = iter(sorted(task_map))
+        running = {}
+        results = {}
+
+        def start():
+            connection, child_connection = context.Pipe()
+            worker = context.Process(target=self._work,
+                                     args=(task_map, child_connection))
+            worker.start()
+            child_connection.close()
+            return connection, worker
+
+        def dispatch(connection, worker):
+            task_id = next(task_ids, None)
+            while True:
+                try:
+                    connection.send(task_id)
+                    break
+                except OSError:
+                    # The worker died after sending its last result.
+                    if task_id is None:
+                        break
+                    connection.close()
+                    worker.join()
+                    connection, worker = start()
+            if task_id is None:
+                connection.close()
+                worker.join()
+            else:
+                running[connection] = (worker, task_id)
+
+        for worker in range(max(1, min(self.processes, len(task_map)))):
+            dispatch(*start())
+        while running:
+            sentinels = {worker.sentinel: connection for connection, (
+                worker, task_id) in running.items()}
+            for ready in multiprocessing.connection.wait(
+                    list(running) + list(sentinels)):
+                connection = sentinels.get(ready, ready)
+                if connection not in running:
+                    continue
+                worker, task_id = running.pop(connection)
+                try:
+                    results[task_id] = connection.recv()
+                except EOFError:
+                    worker.join()
+                    results[task_id] = RuntimeError(
+                        "The worker running task {:d} exited with code {:d}."
+                        .format(task_id, worker.exitcode))
+                    connection.close()
+                    connection, worker = start()
+                dispatch(connection, worker)
+        return results
+
+    def _work(self, task_map, connection):
+        for task_id in iter(connection.recv, None):
+            os.environ["PSIDER_TASK_ID"] = str(task_id)
+            os.chdir(task_map[task_id])
+            try:
+                result = self.task_function()
+                pickle.dumps(result)
+            except BaseException as error:
+                result = get_picklable_error(error)
+            connection.send(result)
+
+
+if __name__ == "__main__":
+    # Print the job directory of the current array task, e.g.
+    #   cd $(python -m psider.engine.array tasks.dat)
+    import sys
+    args = sys.argv[1:]
+    print(get_task_directory(args[0] if args else TASK_MAP_NAME,
+                             args[1] if len(args) > 1 else None))
@@ -0,0 +1,164 @@
+"""Module for writing many small files quickly, e.g. the inputs of a campaign.
+
+On network file systems, creating a directory or a file costs a round trip
+to the metadata server, which dwarfs the cost of writing a small input.  The
+directory tree is therefore created up front, each directory once, and the
+files are written by a small pool of threads so that their round trips
+overlap.  How hard each file is pushed to stable storage is set by a
+durability policy:
+
+    'none': leave it to the operating system, which is the fastest.
+    'file': fsync each file after writing it.
+    'directory': also fsync the directory holding it, so that the file
+        survives a crash under its name.
+    'batch': fsync each file and each directory holding one, all at once
+        after the last file is written.
+"""
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+DURABILITY_POLICIES = ("none", "file", "directory", "batch")
+
+# The files written under the 'batch' policy and not yet synced.
+_unsynced_paths = []
+_unsynced_lock = threading.Lock()
+
+
+def check_durability(durability):
+    """Raise a ValueError for an unknown durability policy.
+    """
+    if durability not in DURABILITY_POLICIES:
+        raise ValueError("'durability' must be one of {:s}."
+                         .format(", ".join(DURABILITY_POLICIES)))
+
+
+def make_directories(dir_paths):
+    """Create directories and their parents, each one only once.
+
+    Args:
+        dir_paths: The directories to create.  Existing ones are skipped.
+    """
+    needed = set()
+    for dir_path in dir_paths:
+        dir_path = os.path.abspath(dir_path)
+        while dir_path not in needed and not os.path.isdir(dir_path):
+            needed.add(dir_path)
+            dir_path = os.path.dirname(dir_path)
+    # Sorting puts every directory after its parents.
+    for dir_path in sorted(needed):
+        try:
+            os.mkdir(dir_path)
+        except FileExistsError:
+            pass
+
+
+def write_file(path, contents, durability="none"):
+    """Write a text file with the given durability policy.
+
+    Under the 'batch' policy, nothing is synced here.  The path is kept
+    until `sync_batch` is called, which `run_bulk` does once all files are
+    written.
+    """
+    with open(path, 'w') as text_file:
+        text_file.write(contents)
+        if durability in ("file", "directory"):
+            text_file.flush()
+            os.fsync(text_file.fileno())
+    if durability == "directory":
+        _fsync_path(os.path.dirname(os.path.abspath(path)))
+    elif durability == "batch":
+        with _unsynced_lock:
+            _unsynced_paths.append(os.path.abspath(path))
+
+
+def sync_batch():
+    """Fsync the files written under the 'batch' policy, then their
+    directories, each directory only once.
+    """
+    with _unsynced_lock:
+        paths = list(_unsynced_paths)
+        del _unsynced_paths[:]
+    for path in paths:
+        _fsync_path(path)
+    for dir_path in sorted(set(os.path.dirname(path) for path in paths)):
+        _fsync_path(dir_path)
+
+
+def _fsync_path(path):
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def run_bulk(function, items, workers=4, durability="none"):
+    """Call a function on many items through a pool of threads.
+
+    Args:
+        function: A callable taking an item, which writes files.
+        items: The items.
+        workers: The number of threads.
+        durability: Under 'batch', the files written by the calls, and their
+            directories, are synced once all the calls have returned.
+
+    Returns:
+        list: The return value of each call, in order.  The first exception
+            raised by a call is re-raised once all calls have finished.
+    """
+    check_durability(durability)
+    items = list(items)
+    if workers <= 1:
+        results = [function(item) for item in items]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = [executor.submit(function, item) for item in items]
+            concurrent.futures.wait(futures)
+        results = [future.result() for future in futures]
+    if durability == "batch":
+        sync_batch()
+    return results
+
+
+def measure_throughput(root_path, count=1000, workers=4, durability="none",
+                       size=2000):
+    """Measure how many files per second are created in bulk.
+
+    Each file is written to its own directory under `root_path`, as the
+    inputs of a campaign are.  The directories are removed afterwards.
+
+    Returns:
+        float: The number of files written per second, directory creation
+            included.
+    """
+    base_path = tempfile.mkdtemp(dir=root_path)
+    contents = "x" * (size - 1) + "\n"
+    dir_paths = [os.path.join(base_path, str(index // 1000), str(index))
+                 for index in range(count)]
+    try:
+        start_time = time.time()
+        make_directories(dir_paths)
+        run_bulk(lambda dir_path: write_file(
+            os.path.join(dir_path, "input.dat"), contents, durability),
+            dir_paths, workers, durability)
+        return count / (time.time() - start_time)
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # Print the bulk write throughput of a directory, e.g.
+    #   python -m psider.engine.bulk /scratch/campaign 2000
+    import sys
+    args = sys.argv[1:]
+    root_path = args[0] if args else os.getcwd()
+    count = int(args[1]) if len(args) > 1 else 1000
+    for durability in DURABILITY_POLICIES:
+        for workers in (1, 4, 16):
+            print("{:10s} {:3d} threads {:10.1f} files/s".format(
+                durability, workers,
+                measure_throughput(root_path, count, workers, durability)))
@@ -0,0 +1,224 @@
+"""Module for keeping the state of a campaign's jobs in a database.
+
+Walking hundreds of thousands of job directories to find out how far a
+campaign has got is slow on any file system, and slower still on a shared
+one.  A CampaignDatabase records the state of every job in a single SQLite
+file instead, so that progress reports and restarts are a query away.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+STATES = ("pending", "sown", "running", "finished", "done", "failed")
+COLUMNS = ("directory", "job_key", "sow_time", "start_time", "end_time",
+           "result", "error")
+DATABASE_NAME = "campaign.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_index INTEGER PRIMARY KEY,
+    directory TEXT NOT NULL,
+    job_key TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    sow_time REAL,
+    start_time REAL,
+    end_time REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+
+
+class CampaignDatabase(object):
+    """An SQLite database of the jobs of a campaign.
+
+    The database runs in write-ahead-log mode, so that progress can be
+    queried while the campaign writes to it.  Updates are queued and written
+    in a single transaction once `batch_size` of them have accumulated, or
+    when `flush` is called; every query flushes first.  The object may be
+    shared between threads.
+
+    Each job is a row keyed by its displacement number, holding its
+    directory, a hash of what it computes, its state, the number of times
+    it was started, the times it was sown, started and finished, its result
+    as JSON and its last error.  The states are 'pending', 'sown',
+    'running', 'finished' once it has run but isn't reaped yet, 'done' once
+    reaped and 'failed'.
+
+    Attributes:
+        path (str): The path of the database file.
+        batch_size (int): The number of updates written per transaction.
+    """
+
+    def __init__(self, path, batch_size=100):
+        self.path = os.path.abspath(path)
+        self.batch_size = int(batch_size)
+        self._connection = sqlite3.connect(self.path, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        columns = [row[1] for row in self._connection.execute(
+            "PRAGMA table_info(jobs)")]
+        if "job_key" not in columns:
+            self._connection.execute(
+                "ALTER TABLE jobs ADD COLUMN job_key TEXT")
+        self._updates = []
+        self._lock = threading.RLock()
+
+    def add_jobs(self, job_dir_paths, job_keys=None):
+        """Add a pending job for each directory, keeping matching ones.
+
+        A job already in the database is kept, with its state and result,
+        only if its directory and key match.  Otherwise it was a different
+        job, e.g. at another geometry, and it is reset to pending.  Jobs
+        beyond the given ones are removed.
+
+        Args:
+            job_dir_paths: The job directories, by displacement number.
+            job_keys: Hashes identifying what each job computes, or None.
+        """
+        job_dir_paths = list(job_dir_paths)
+        if job_keys is None:
+            job_keys = [None] * len(job_dir_paths)
+        rows = list(zip(range(len(job_dir_paths)), job_dir_paths, job_keys))
+        with self._lock:
+            self._flush()
+            self._execute_many(
+                ("UPDATE jobs SET state = 'pending', attempts = 0, "
+                 "sow_time = NULL, start_time = NULL, end_time = NULL, "
+                 "result = NULL, error = NULL WHERE job_index = ? AND "
+                 "NOT (directory = ? AND job_key IS ?)", rows),
+                ("INSERT INTO jobs (job_index, directory, job_key) "
+                 "VALUES (?, ?, ?) ON CONFLICT (job_index) DO UPDATE "
+                 "SET directory = excluded.directory, "
+                 "job_key = excluded.job_key", rows),
+                ("DELETE FROM jobs WHERE job_index >= ?", [(len(rows),)]))
+
+    def record(self, index, state, attempt=False, **values):
+        """Queue an update of a job.
+
+        Args:
+            index: The displacement number of the job.
+            state: The new state of the job.
+            attempt: Whether to count a new attempt at running the job.
+            **values: New values of the other columns.  The result may be
+                any value that converts to JSON, including numpy arrays.
+        """
+        if state not in STATES:
+            raise ValueError("'state' must be one of {:s}."
+                             .format(", ".join(STATES)))
+        for column in values:
+            if column not in COLUMNS:
+                raise ValueError("Unknown column '{:s}'.".format(column))
+        if 'result' in values:
+            values['result'] = json.dumps(_to_json(values['result']))
+        with self._lock:
+            self._updates.append((index, state, attempt, values))
+            if len(self._updates) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        """Write the queued updates.
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._updates:
+            return
+        updates, self._updates = self._updates, []
+        self._connection.execute("BEGIN")
+        try:
+            for index, state, attempt, values in updates:
+                columns = sorted(values)
+                self._connection.execute(
+                    "UPDATE jobs SET state = ?, attempts = attempts + ?{:s} "
+                    "WHERE job_index = ?".format("".join(
+                        ", {:s} = ?".format(column) for column in columns)),
+                    [state, int(attempt)] +
+                    [values[column] for column in columns] + [index])
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def _execute_many(self, *statements):
+        """Execute (statement, rows) pairs in a single transaction.
+        """
+        self._connection.execute("BEGIN")
+        try:
+            for statement, rows in statements:
+                self._connection.executemany(statement, rows)
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def _query(self, statement, parameters=()):
+        with self._lock:
+            self._flush()
+            return self._connection.execute(statement, parameters).fetchall()
+
+    def count_states(self):
+        """Return the number of jobs in each state.
+
+        Returns:
+            dict: Maps every state to its number of jobs.
+        """
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self._query(
+            "SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+        return counts
+
+    def get_indices(self, state):
+        """Return the displacement numbers of the jobs in a state.
+        """
+        return [index for index, in self._query(
+            "SELECT job_index FROM jobs WHERE state = ? ORDER BY job_index",
+            (state,))]
+
+    def get_job(self, index):
+        """Return the row of a job as a dictionary, or None.
+        """
+        rows = self._query(
+            "SELECT job_index, directory, job_key, state, attempts, "
+            "sow_time, start_time, end_time, result, error FROM jobs "
+            "WHERE job_index = ?", (index,))
+        if not rows:
+            return None
+        names = (("index", "directory", "job_key", "state", "attempts") +
+                 COLUMNS[2:])
+        job = dict(zip(names, rows[0]))
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+        return job
+
+    def get_results(self):
+        """Return the results of the finished jobs.
+
+        Returns:
+            dict: Maps the displacement number of each finished job to its
+                result, as decoded from JSON.
+        """
+        return {index: json.loads(result) for index, result in self._query(
+            "SELECT job_index, result FROM jobs "
+            "WHERE state = 'done' AND result IS NOT NULL")}
+
+    def close(self):
+        """Write the queued updates and close the database.
+        """
+        with self._lock:
+            self._flush()
+            self._connection.close()
+
+
+def _to_json(value):
+    """Convert numpy arrays and scalars to plain Python values.
+    """
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return value
@@ -0,0 +1,71 @@
+"""Module for watching the outputs of running jobs for fatal errors.
+"""
+import os
+import re
+
+from .retry import FAILURE_PATTERNS, join_patterns
+
+FATAL_PATTERN = join_patterns(FAILURE_PATTERNS + (
+    ('scf_divergence', r"(?i:SCF.{0,40}diverg)"),
+    ('fatal_error', r"(?i:fatal error)")))
+
+
+class OutputMonitor(object):
+    """Tails job outputs incrementally, looking for fatal errors.
+
+    Each check reads only the bytes appended since the previous check of the
+    same file.  The last, incomplete line is held back until it is finished,
+    so a match is never split between two reads.  A file that shrinks is
+    assumed to have been rewritten and is read again from the start.
+
+    Attributes:
+        fatal_pattern (str): A regex matching a fatal error in an output.
+        output_name (str): The name of the output file in each job directory.
+        interval (float): The time between checks of a running job, in
+            seconds.
+    """
+
+    def __init__(self, fatal_pattern=FATAL_PATTERN, output_name="output.dat",
+                 interval=1.):
+        self.fatal_pattern = re.compile(fatal_pattern, re.MULTILINE)
+        self.output_name = output_name
+        self.interval = interval
+        self._positions = {}
+
+    def check(self, path):
+        """Check what has been appended to an output since the last check.
+
+        Args:
+            path: The path of the output file, or of the job directory
+                holding it.
+
+        Returns:
+            str: The line holding the fatal error, or None if there is none.
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, self.output_name)
+        offset, remainder = self._positions.get(path, (0, ""))
+        try:
+            with open(path, 'rb') as output_file:
+                if os.fstat(output_file.fileno()).st_size < offset:
+                    offset, remainder = 0, ""
+                output_file.seek(offset)
+                chunk = output_file.read()
+        except (IOError, OSError):
+            return None
+        offset += len(chunk)
+        text = remainder + chunk.decode(errors='replace')
+        end = text.rfind("\n") + 1
+        self._positions[path] = (offset, text[end:])
+        match = self.fatal_pattern.search(text, 0, end)
+        if match is None:
+            return None
+        start = text.rfind("\n", 0, match.start()) + 1
+        return text[start:text.find("\n", match.end())].strip()
+
+    def forget(self, path):
+        """Drop the stored position of an output.
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, self.output_name)
+        self._positions.pop(path, None)
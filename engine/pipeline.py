@@ -0,0 +1,166 @@
+"""Module for running jobs through concurrent, pipelined stages.
+"""
+import queue
+import threading
+
+_DONE = object()
+
+
+class _Failed(object):
+
+    def __init__(self, error):
+        self.error = error
+
+
+class Pipeline(object):
+    """Chains stages, such as sow, run and reap, through bounded queues.
+
+    Every stage runs in its own pool of threads, so that inputs are written
+    and outputs parsed while other jobs are running.  The items are drawn
+    from their iterable only as space frees up in the first queue, and each
+    queue holds at most `buffer_size` items, so memory stays flat however
+    many items there are.  If the consumer stops early, e.g. because it
+    raised, the optional `cancel` callable is called before waiting for the
+    threads, so that they aren't left to run their items to the end.
+
+    Attributes:
+        stages (list): The stage callables.  The first is called with each
+            item and every later one with the return value of the one before.
+        workers (list): The number of threads of each stage.
+        buffer_size (int): The capacity of each queue.
+        cancel: A callable stopping the items in progress, or None.
+    """
+
+    def __init__(self, stages, workers=None, buffer_size=None, cancel=None):
+        """Initialize this Pipeline object.
+
+        Args:
+            stages: A sequence of callables.
+            workers: The number of threads of each stage, by default one.
+            buffer_size: The capacity of each queue, by default twice the
+                largest number of workers.
+            cancel: An optional callable taking no arguments, which makes
+                the stages in progress return soon, e.g. by killing the
+                programs they run.
+        """
+        self.stages = list(stages)
+        self.workers = ([1] * len(self.stages) if workers is None
+                        else [int(count) for count in workers])
+        if len(self.workers) != len(self.stages):
+            raise ValueError("Expected one number of workers per stage.")
+        self.buffer_size = (2 * max(self.workers) if buffer_size is None
+                            else int(buffer_size))
+        self.cancel = cancel
+
+    def run(self, items):
+        """Run every item through the stages.
+
+        Returns:
+            list: The result for each item, in order.
+        """
+        results = {}
+        for index, result in self.iter_run(items):
+            results[index] = result
+        return [results[index] for index in range(len(results))]
+
+    def iter_run(self, items):
+        """Run items through the stages, yielding results as they finish.
+
+        Args:
+            items: An iterable of items, consumed lazily.
+
+        Yields:
+            tuple: The index of each item and the return value of the last
+                stage, or the exception raised by the stage that failed.
+        """
+        stop = threading.Event()
+        errors = []
+        queues = [queue.Queue(self.buffer_size)
+                  for stage in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed,
+                                    args=(items, queues[0], errors, stop))]
+        # The last worker of each stage to finish passes the end on to every
+        # worker of the next stage, or to the consumer.
+        ends = self.workers[1:] + [1]
+        for position, stage in enumerate(self.stages):
+            remaining = [self.workers[position]]
+            lock = threading.Lock()
+            for worker in range(self.workers[position]):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[position], queues[position + 1],
+                          ends[position], remaining, lock, stop)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        finished = False
+        try:
+            while True:
+                entry = queues[-1].get()
+                if entry is _DONE:
+                    finished = True
+                    break
+                index, value = entry
+                yield index, (value.error if isinstance(value, _Failed)
+                              else value)
+        finally:
+            stop.set()
+            if not finished and self.cancel is not None:
+                self.cancel()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+    def _feed(self, items, output_queue, errors, stop):
+        try:
+            for entry in enumerate(items):
+                if not _put(output_queue, entry, stop):
+                    return
+        except Exception as error:
+            errors.append(error)
+        finally:
+            for worker in range(self.workers[0]):
+                _put(output_queue, _DONE, stop)
+
+    def _work(self, stage, input_queue, output_queue, ends, remaining, lock,
+              stop):
+        while True:
+            entry = _get(input_queue, stop)
+            if entry is None:
+                return
+            if entry is _DONE:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    for end in range(ends):
+                        _put(output_queue, _DONE, stop)
+                return
+            index, value = entry
+            if not isinstance(value, _Failed):
+                try:
+                    value = stage(value)
+                except Exception as error:
+                    value = _Failed(error)
+            if not _put(output_queue, (index, value), stop):
+                return
+
+
+def _put(target_queue, entry, stop):
+    while not stop.is_set():
+        try:
+            target_queue.put(entry, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(source_queue, stop):
+    while not stop.is_set():
+        try:
+            return source_queue.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
@@ -0,0 +1,199 @@
+"""Module for running callables in child processes.
+"""
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import signal
+import time
+
+
+class Process(object):
+    """A callable running in a forked child process.
+
+    The child starts a new session, so that it leads a process group holding
+    every program it launches, and `kill` reclaims all of them.  It then
+    changes into the requested directory, updates its environment and CPU
+    affinity, and calls the function.  Its return value is sent back
+    through a pipe.  If it raises an exception, the result is that
+    exception, or a RuntimeError describing it if it can't be pickled; a
+    return value that can't be pickled also gives a RuntimeError.
+
+    Attributes:
+        function: The callable.
+        directory (str): The working directory of the child, or None.
+        environ (dict): Environment variables set in the child.
+        cpus: The CPU indices the child is pinned to, or None.
+        pid (int): The process ID of the child.
+        result: The return value of `function`, once finished.
+        start_time (float): When the child was started.
+        elapsed (float): The wall time of the child, once finished.
+    """
+
+    def __init__(self, function, directory=None, environ=None, cpus=None):
+        """Initialize this Process object, starting the child.
+
+        Args:
+            function: A callable taking no arguments.
+            directory: The working directory of the child.
+            environ: A dictionary of environment variables to set.
+            cpus: A sequence of CPU indices to pin the child to.
+        """
+        self.function = function
+        self.directory = directory
+        self.environ = {} if environ is None else dict(environ)
+        self.cpus = None if cpus is None else sorted(cpus)
+        self.result = None
+        self.elapsed = None
+        self._finished = False
+        self.start_time = time.time()
+        # The child is forked so that `function` need not be picklable.
+        context = multiprocessing.get_context("fork")
+        self.connection, sender = context.Pipe(duplex=False)
+        self._process = context.Process(target=self._run, args=(sender,))
+        self._process.start()
+        sender.close()
+        self.pid = self._process.pid
+
+    def _run(self, sender):
+        self.connection.close()
+        try:
+            os.setsid()
+            if self.directory is not None:
+                os.chdir(self.directory)
+            os.environ.update(self.environ)
+            if self.cpus is not None:
+                os.sched_setaffinity(0, self.cpus)
+            result = self.function()
+            pickle.dumps(result)
+        except BaseException as error:
+            result = get_picklable_error(error)
+        sender.send(result)
+        sender.close()
+
+    def poll(self):
+        """Check whether the child has finished, without blocking.
+
+        Returns:
+            bool: Whether the result is available.
+        """
+        if not self._finished and self.connection.poll():
+            self._collect()
+        return self._finished
+
+    def wait(self, timeout=None):
+        """Wait for the child to finish.
+
+        Args:
+            timeout: The longest time to wait, in seconds, or None to wait
+                indefinitely.
+
+        Returns:
+            bool: Whether the result is available.
+        """
+        if not self._finished and self.connection.poll(timeout):
+            self._collect()
+        return self._finished
+
+    def kill(self):
+        """Kill the process group of the child, unless it has finished.
+        """
+        if self._finished:
+            return
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+            return
+        except (ProcessLookupError, PermissionError):
+            pass
+        # The child hasn't started its own session yet, so it hasn't
+        # launched anything either, and killing it alone is enough.
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _collect(self):
+        try:
+            self.result = self.connection.recv()
+        except EOFError:
+            self._process.join()
+            self.result = RuntimeError("Process exited with code {:d}."
+                                       .format(self._process.exitcode))
+        self.elapsed = time.time() - self.start_time
+        self._process.join()
+        self.connection.close()
+        self._finished = True
+
+
+def get_picklable_error(error):
+    """Return an exception, or a RuntimeError if it can't be pickled.
+
+    This lets a child process send the exception it raised to its parent,
+    which can then re-raise it with its original type.
+    """
+    try:
+        pickle.loads(pickle.dumps(error))
+    except Exception:
+        return RuntimeError(repr(error))
+    return error
+
+
+class CancelledError(RuntimeError):
+    pass
+
+
+class Cancellation(object):
+    """A flag for cancelling a whole campaign.
+
+    Submitters and schedulers sharing a Cancellation object register their
+    running processes with it.  Calling `cancel`, for instance from another
+    thread or a signal handler, kills all of them and stops anything new from
+    starting.
+
+    Attributes:
+        cancelled (bool): Whether `cancel` has been called.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._processes = set()
+
+    def cancel(self):
+        self.cancelled = True
+        for process in list(self._processes):
+            process.kill()
+
+    def check(self):
+        """Raise a CancelledError if the campaign has been cancelled.
+        """
+        if self.cancelled:
+            raise CancelledError("The campaign was cancelled.")
+
+    def register(self, process):
+        self._processes.add(process)
+        if self.cancelled:
+            process.kill()
+
+    def unregister(self, process):
+        self._processes.discard(process)
+
+
+def wait_any(processes, timeout=None):
+    """Wait until at least one of several processes finishes.
+
+    Args:
+        processes: A sequence of Process objects.
+        timeout: The longest time to wait, in seconds, or None to wait
+            indefinitely.
+
+    Returns:
+        list: The processes that have finished, which is empty only if the
+            timeout expired.
+    """
+    finished = [process for process in processes if process.poll()]
+    if finished:
+        return finished
+    connections = {process.connection: process for process in processes}
+    ready = multiprocessing.connection.wait(list(connections), timeout)
+    return [connections[connection] for connection in ready
+            if connections[connection].poll()]
@@ -0,0 +1,157 @@
+"""Module for collecting results from worker processes in shared memory.
+
+Worker processes that parse their own outputs write each result straight
+into a NumPy array in shared memory, indexed by displacement number, and
+mark it complete, so that no result is pickled back to the parent.
+"""
+import os
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedResults(object):
+    """A shared-memory array of results with a completion map.
+
+    The segment holds one completion flag per result followed by the
+    results themselves, as 64-bit floats.  The flags take a byte each, so
+    that processes finishing at the same time never write to the same byte.
+    A result is written before its flag is set, so a set flag always marks a
+    whole result.
+
+    Forked worker processes inherit the mapping and may write to it
+    directly; other processes can attach to it by name.  The segment
+    belongs to the process that created it.  It stays in place after an
+    exception, so that the results written so far can still be inspected,
+    but only while that process runs: it is destroyed by `unlink`, or else
+    once this object is garbage collected or the process exits.
+
+    Attributes:
+        count (int): The number of results.
+        value_shape (tuple): The shape of each result, e.g. () for energies
+            and (atoms, 3) for gradients.
+        name (str): The name of the shared memory segment.
+        values (numpy.ndarray): The results, of shape
+            (count,) + value_shape.
+        completed (numpy.ndarray): The completion flag of each result.
+    """
+
+    def __init__(self, count, value_shape=(), name=None):
+        """Create a shared results array, or take over a stale one.
+
+        Args:
+            count: The number of results.
+            value_shape: The shape of each result.
+            name: The name of the segment, by default a random one.  If a
+                segment of that name and size exists, it is reused with its
+                contents.
+        """
+        self.count = int(count)
+        self.value_shape = tuple(value_shape)
+        size = _get_size(self.count, self.value_shape)
+        try:
+            self._memory = shared_memory.SharedMemory(name, True, size)
+        except FileExistsError:
+            self._memory = shared_memory.SharedMemory(name)
+            if self._memory.size < size:
+                self._memory.close()
+                self._memory.unlink()
+                self._memory = shared_memory.SharedMemory(name, True, size)
+        self._map()
+        self._finalizer = weakref.finalize(self, _destroy, self._memory,
+                                           os.getpid())
+
+    @classmethod
+    def attach(cls, name, count, value_shape=()):
+        """Attach to an existing shared results array by name.
+        """
+        shared_results = cls.__new__(cls)
+        shared_results.count = int(count)
+        shared_results.value_shape = tuple(value_shape)
+        shared_results._memory = shared_memory.SharedMemory(name)
+        shared_results._map()
+        shared_results._finalizer = None
+        return shared_results
+
+    def _map(self):
+        self.name = self._memory.name
+        self.completed = np.ndarray((self.count,), np.uint8,
+                                    self._memory.buf)
+        self.values = np.ndarray((self.count,) + self.value_shape,
+                                 np.float64, self._memory.buf,
+                                 offset=_get_offset(self.count))
+
+    def set(self, index, value):
+        """Write a result and mark it complete.
+        """
+        value = np.asarray(value, dtype=np.float64)
+        if value.shape != self.value_shape:
+            raise ValueError("Expected a result of shape {!r}, got {!r}."
+                             .format(self.value_shape, value.shape))
+        self.values[index] = value
+        self.completed[index] = 1
+
+    def get(self, index):
+        """Return a copy of a result, or None if it isn't complete.
+        """
+        if not self.completed[index]:
+            return None
+        if self.value_shape == ():
+            return float(self.values[index])
+        return self.values[index].copy()
+
+    def get_completed(self):
+        """Return the indices of the completed results.
+        """
+        return np.flatnonzero(self.completed).tolist()
+
+    def is_complete(self):
+        return bool(self.completed.all())
+
+    def clear(self):
+        """Mark every result incomplete.
+        """
+        self.completed[:] = 0
+
+    def close(self):
+        """Detach from the segment, leaving it in place until the creating
+        process exits.
+        """
+        del self.completed, self.values
+        self._memory.close()
+
+    def unlink(self):
+        """Detach from the segment and destroy it.
+        """
+        self.close()
+        if self._finalizer is None:
+            self._memory.unlink()
+        else:
+            self._finalizer()
+
+
+def _destroy(memory, pid):
+    """Destroy a segment unless it is already gone.
+
+    Forked children inherit the finalizer, but only the creating process
+    destroys the segment.  The mapping is left to the garbage collector,
+    since arrays viewing it may still exist.
+    """
+    if os.getpid() != pid:
+        return
+    try:
+        memory.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _get_offset(count):
+    """Return the offset of the results, aligned to 64 bytes.
+    """
+    return (count + 63) // 64 * 64
+
+
+def _get_size(count, value_shape):
+    return max(_get_offset(count) +
+               8 * count * int(np.prod(value_shape, dtype=int)), 1)
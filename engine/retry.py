@@ -0,0 +1,196 @@
+"""Module for classifying failed jobs and deciding whether to rerun them.
+"""
+import re
+
+FAILURE_PATTERNS = (
+    ('scf_convergence', r"Could not converge SCF|SCF did not converge|"
+                        r"SCFConvergenceError|SCF NOT CONVERGED"),
+    ('out_of_memory', r"(?i:out of memory|std::bad_alloc|MemoryError|"
+                      r"not enough memory|insufficient memory)"),
+    ('scratch_full', r"(?i:no space left on device|disk quota exceeded|"
+                     r"free scratch space)"),
+    ('timeout', r"(?i:exceeded its wall-time limit|due to time limit|"
+                r"time limit exceeded)"),
+    ('node_crash', r"(?i:segmentation fault|bus error|killed by signal|"
+                   r"lost communication|node failure)"),
+)
+ACTIONS = ("rerun", "relocate", "modify", "backoff", "give_up")
+
+
+def classify_failure(output_str, patterns=FAILURE_PATTERNS, message=""):
+    """Classify a failed job from its output and its error message.
+
+    The message tells apart failures that leave no telling output, such as
+    jobs that were never started for lack of scratch space or that were
+    killed at their wall-time limit.
+
+    Args:
+        output_str: The contents of the output file, or None if there is
+            none.
+        patterns: A sequence of (failure class, regex) pairs, tried in order.
+        message: The error message of the failure.
+
+    Returns:
+        str: The first failure class whose pattern matches the output, or
+            else the message, 'node_crash' if there is no output, and
+            'unknown' otherwise.
+    """
+    for text in (output_str, message):
+        if not text:
+            continue
+        for failure_class, pattern in patterns:
+            if re.search(pattern, text):
+                return failure_class
+    if not output_str:
+        return 'node_crash'
+    return 'unknown'
+
+
+def join_patterns(patterns):
+    """Combine the regexes of (failure class, regex) pairs into one.
+    """
+    return "|".join("(?:{:s})".format(pattern)
+                    for failure_class, pattern in patterns)
+
+
+def double_memory(match):
+    """Double the amount in a match of `engine.scheduler.MEMORY_PATTERN`.
+
+    Meant as the replacement of a RetryPolicy substitution.
+    """
+    amount = float(match.group(1)) * 2
+    return match.group(0).replace(match.group(1), "{:g}".format(amount), 1)
+
+
+class RetryPolicy(object):
+    """What to do about one class of failure.
+
+    Attributes:
+        action (str): 'rerun' to run the job again as it is, 'relocate' to
+            run it again on other cores than the ones it failed on,
+            'modify' to run it again after applying `substitutions` to its
+            input, 'backoff' to run it again after a growing delay, or
+            'give_up'.  Relocation needs an engine.LocalScheduler to pick
+            the cores; otherwise it is the same as 'rerun'.
+        max_attempts (int): The most times a job is run in total.
+        delay (float): The delay before the first rerun with 'backoff', in
+            seconds.
+        backoff (float): The factor by which the delay grows on each rerun.
+        substitutions: A sequence of (regex, replacement) pairs applied to
+            the input with `re.sub` for 'modify'.  The replacement may be a
+            string or a callable taking the match.
+    """
+
+    def __init__(self, action="rerun", max_attempts=3, delay=10.,
+                 backoff=2., substitutions=()):
+        if action not in ACTIONS:
+            raise ValueError("'action' must be one of {:s}."
+                             .format(", ".join(ACTIONS)))
+        self.action = action
+        self.max_attempts = int(max_attempts)
+        self.delay = delay
+        self.backoff = backoff
+        self.substitutions = tuple(substitutions)
+
+    def get_delay(self, attempts):
+        """Return the delay before the next run, after `attempts` runs.
+        """
+        if self.action != "backoff":
+            return 0.
+        return self.delay * self.backoff ** (attempts - 1)
+
+    def modify(self, input_str):
+        """Apply the substitutions to an input file.
+        """
+        if self.action != "modify":
+            return input_str
+        for pattern, replacement in self.substitutions:
+            input_str = re.sub(pattern, replacement, input_str,
+                               flags=re.MULTILINE | re.IGNORECASE)
+        return input_str
+
+
+DEFAULT_POLICIES = {
+    'scf_convergence': RetryPolicy(
+        "modify", 2, substitutions=[(
+            r"^(?=[ \t]*(?:energy|gradient|hessian|optimize|frequency)\()",
+            "set maxiter 200\nset damping_percentage 20\n")]),
+    'out_of_memory': RetryPolicy(
+        "modify", 2, substitutions=[(
+            r"^[ \t]*memory[ \t]+(\d+(?:\.\d*)?)", double_memory)]),
+    'scratch_full': RetryPolicy("backoff", 3, delay=60.),
+    'node_crash': RetryPolicy("relocate", 3),
+    'timeout': RetryPolicy("relocate", 2),
+    'unknown': RetryPolicy("give_up"),
+}
+
+
+class Failure(object):
+    """The record of a failed job.
+
+    Attributes:
+        key: The identifier of the job, e.g. its displacement number.
+        failure_class (str): The class of the last failure.
+        attempts (int): The number of times the job has run.
+        message (str): The error message of the last failure.
+    """
+
+    def __init__(self, key, failure_class, attempts, message):
+        self.key = key
+        self.failure_class = failure_class
+        self.attempts = attempts
+        self.message = message
+
+    def __repr__(self):
+        return "Failure({!r}, {!r}, {!r}, {!r})".format(
+            self.key, self.failure_class, self.attempts, self.message)
+
+
+class RetryManager(object):
+    """Records failed jobs and decides which ones to rerun.
+
+    Attributes:
+        policies (dict): Maps failure classes to RetryPolicy objects.
+            Classes without a policy are given up on.
+        patterns: The (failure class, regex) pairs used for classification.
+        attempts (dict): Maps each job key to the number of times it has run.
+        failures (dict): Maps the key of every job that is currently failed
+            to its Failure object.
+        history (list): Every Failure object ever recorded, in order.
+    """
+
+    def __init__(self, policies=None, patterns=FAILURE_PATTERNS):
+        self.policies = dict(DEFAULT_POLICIES if policies is None
+                             else policies)
+        self.patterns = patterns
+        self.attempts = {}
+        self.failures = {}
+        self.history = []
+
+    def record_failure(self, key, output_str, message=""):
+        """Record a failed run of a job and decide whether to rerun it.
+
+        Args:
+            key: The identifier of the job.
+            output_str: The contents of its output file, or None.
+            message: The error message.
+
+        Returns:
+            RetryPolicy: The policy to rerun the job with, or None to give up.
+        """
+        attempts = self.attempts.get(key, 0) + 1
+        self.attempts[key] = attempts
+        failure_class = classify_failure(output_str, self.patterns,
+                                         str(message))
+        failure = Failure(key, failure_class, attempts, str(message))
+        self.failures[key] = failure
+        self.history.append(failure)
+        policy = self.policies.get(failure_class)
+        if (policy is None or policy.action == "give_up" or
+                attempts >= policy.max_attempts):
+            return None
+        return policy
+
+    def record_success(self, key):
+        self.attempts[key] = self.attempts.get(key, 0) + 1
+        self.failures.pop(key, None)
@@ -0,0 +1,556 @@
+"""Module for running many jobs concurrently on the local node.
+"""
+import os
+import re
+import shutil
+import statistics
+import time
+
+from .process import Process, wait_any
+
+MEMORY_PATTERN = r"^[ \t]*memory[ \t]+(\d+(?:\.\d*)?)[ \t]*([kmgt]i?b|b)?\b"
+MEMORY_UNITS = {'b': 1, 'kb': 1e3, 'mb': 1e6, 'gb': 1e9, 'tb': 1e12,
+                'kib': 2 ** 10, 'mib': 2 ** 20, 'gib': 2 ** 30, 'tib': 2 ** 40}
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS",
+                    "OPENBLAS_NUM_THREADS")
+
+
+def parse_memory(input_str, pattern=MEMORY_PATTERN):
+    """Find the memory requested by a job input file.
+
+    The default pattern matches Psi4's `memory 270 mb` line.
+
+    Args:
+        input_str: The contents of the input file.
+        pattern: A regex whose first group matches the amount and whose
+            optional second group matches the unit.
+
+    Returns:
+        int: The memory in bytes, or None if it isn't given.
+    """
+    match = re.search(pattern, input_str, re.IGNORECASE | re.MULTILINE)
+    if match is None:
+        return None
+    groups = match.groups() + (None,)
+    unit = (groups[1] or 'b').lower()
+    if unit not in MEMORY_UNITS:
+        raise ValueError("Unrecognized memory unit '{:s}'.".format(unit))
+    return int(float(groups[0]) * MEMORY_UNITS[unit])
+
+
+class Resources(object):
+    """The cores and memory needed by a job, or available on a node.
+
+    Attributes:
+        cores (int): The number of cores, or None to use the scheduler's
+            default.
+        memory (int): The memory in bytes.
+    """
+
+    @classmethod
+    def from_input(cls, input_str, cores=None, pattern=MEMORY_PATTERN):
+        """Read the resources requested by a job input file.
+
+        Args:
+            input_str: The contents of the input file.
+            cores: The number of cores for the job.
+            pattern: The regex passed on to `parse_memory`.
+        """
+        memory = parse_memory(input_str, pattern)
+        return cls(cores, 0 if memory is None else memory)
+
+    @classmethod
+    def from_node(cls):
+        """Find the cores and memory available to this process.
+        """
+        return cls(len(os.sched_getaffinity(0)), _get_available_memory())
+
+    def __init__(self, cores=None, memory=0):
+        self.cores = None if cores is None else int(cores)
+        self.memory = int(memory)
+
+    def __repr__(self):
+        return "Resources(cores={!r}, memory={!r})".format(self.cores,
+                                                           self.memory)
+
+
+class Task(object):
+    """A callable to be run in a job directory.
+
+    Attributes:
+        function: A callable taking no arguments.
+        job_dir_path (str): The directory the function runs in.
+        resources: A Resources object with the needs of the task.
+        key (str): The template hash of the job, under which its wall time is
+            recorded, or None.
+        kind (str): The kind of job, such as 'reference', distinguishing
+            jobs with the same template that take different times.
+        scratch: An engine.ScratchManager object providing the task's
+            scratch directory, or None to use the scheduler's.
+    """
+
+    def __init__(self, function, job_dir_path, resources=None, key=None,
+                 kind="job", scratch=None):
+        self.function = function
+        self.job_dir_path = os.path.abspath(job_dir_path)
+        self.resources = Resources() if resources is None else resources
+        self.key = key
+        self.kind = kind
+        self.scratch = scratch
+        if not callable(self.function):
+            raise ValueError("This class requires a callable task function.")
+
+
+class LocalScheduler(object):
+    """Packs tasks onto the cores and memory of the local node.
+
+    A task starts as soon as enough cores and memory are free for it.  Tasks
+    are considered in order, but a later task that fits is started ahead of
+    an earlier one that doesn't.  Each task runs in its own process, pinned
+    to its own cores, with the thread-count variables of the common OpenMP
+    and BLAS runtimes set to its number of cores, so that concurrent jobs
+    never compete for a core.
+
+    With a timing history, tasks are considered longest expected wall time
+    first, which keeps long jobs from starting last and leaving most of the
+    node idle while they finish.  Tasks of unknown duration go first, and
+    the wall time of every successful task is added to the history.
+
+    With a straggler factor, a task still running after that multiple of
+    the median wall time of the finished tasks of its kind is duplicated, if
+    no tasks are waiting and its resources are free.  The duplicate runs in
+    a fresh copy of the job directory, made from the files present when the
+    task started.  The first copy to finish without raising wins and the
+    other is killed.  If the duplicate wins, its files are copied back into
+    the original job directory.
+
+    A task running past the wall-time limit is killed, along with every
+    program it started, and its result is a RuntimeError.  Cancelling the
+    scheduler's Cancellation object kills all running tasks and raises a
+    CancelledError.  With an output monitor, the outputs of running tasks are
+    checked at the monitor's interval, and a task is killed as soon as a
+    fatal error appears, with a RuntimeError as its result.
+
+    With a scratch manager, each task gets its own scratch directory, and
+    is only started while the scratch file system has enough free space.
+
+    The CPUs each task last ran on are kept, so that a task rerun after a
+    failure that may be due to its cores can be told to `avoid` them.
+
+    Attributes:
+        resources: A Resources object with the node's cores and memory.
+        cpus (list): The CPU indices that tasks are pinned to.
+        cores_per_task (int): The number of cores given to tasks that don't
+            request a number.
+        pin (bool): Whether to set the CPU affinity of each task.
+        history: An engine.TimingHistory object, or None.
+        straggler_factor (float): The multiple of the median wall time after
+            which a task is duplicated, or None.
+        min_completed (int): The number of finished tasks of a kind needed
+            before any are duplicated.
+        timeout (float): The wall-time limit of each task, in seconds, or
+            None.
+        cancellation: An engine.Cancellation object, or None.
+        monitor: An engine.OutputMonitor object, or None.
+        scratch: An engine.ScratchManager object, or None.
+        placements (dict): Maps each job directory to the CPUs its task last
+            ran on.
+        avoided (dict): Maps job directories to the sets of CPUs their tasks
+            avoid.
+    """
+
+    def __init__(self, resources=None, cores_per_task=1, pin=True,
+                 thread_variables=THREAD_VARIABLES, history=None,
+                 straggler_factor=None, min_completed=3, timeout=None,
+                 cancellation=None, monitor=None, scratch=None):
+        """Initialize this LocalScheduler object.
+
+        Args:
+            resources: A Resources object limiting the cores and memory to
+                use.  By default, everything available to this process.
+            cores_per_task: The default number of cores per task.
+            pin: Whether to set the CPU affinity of each task.
+            thread_variables: The environment variables set to the number of
+                cores of each task.
+            history: An engine.TimingHistory object used to order the tasks.
+            straggler_factor: The multiple of the median wall time after
+                which a task is duplicated.  None disables duplication.
+            min_completed: The number of finished tasks of a kind needed
+                before any are duplicated.
+            timeout: The wall-time limit of each task, in seconds.
+            cancellation: An engine.Cancellation object for cancelling the
+                tasks.
+            monitor: An engine.OutputMonitor object checking the outputs of
+                running tasks for fatal errors.
+            scratch: An engine.ScratchManager object providing scratch
+                directories for tasks that don't have their own.
+        """
+        node = Resources.from_node()
+        if resources is None:
+            resources = node
+        cores = node.cores if resources.cores is None else resources.cores
+        self.cpus = sorted(os.sched_getaffinity(0))[:cores]
+        if len(self.cpus) < cores:
+            # More cores were requested than are available, so tasks share.
+            pin = False
+            self.cpus = list(range(cores))
+        self.resources = Resources(cores, resources.memory or node.memory)
+        self.cores_per_task = int(cores_per_task)
+        self.pin = pin
+        self.thread_variables = tuple(thread_variables)
+        self.history = history
+        self.straggler_factor = straggler_factor
+        self.min_completed = int(min_completed)
+        self.timeout = timeout
+        self.cancellation = cancellation
+        self.monitor = monitor
+        self.scratch = scratch
+        self.placements = {}
+        self.avoided = {}
+
+    def get_cores(self, task):
+        """Return the number of cores given to a task.
+        """
+        if task.resources.cores is None:
+            return min(self.cores_per_task, self.resources.cores)
+        return task.resources.cores
+
+    def avoid(self, job_dir_path):
+        """Make the task of a job directory avoid the CPUs it last ran on.
+
+        The task then waits for other CPUs, unless there are too few of
+        them on the node, in which case any CPUs will do.
+
+        Returns:
+            bool: Whether the task had run, so that there were CPUs to avoid.
+        """
+        job_dir_path = os.path.abspath(job_dir_path)
+        if job_dir_path not in self.placements:
+            return False
+        self.avoided.setdefault(job_dir_path, set()).update(
+            self.placements[job_dir_path])
+        return True
+
+    def run(self, tasks):
+        """Run tasks, blocking until all of them finish.
+
+        Args:
+            tasks: A sequence of Task objects.
+
+        Returns:
+            list: The return value of each task's function, in order, or a
+                RuntimeError if it failed.
+        """
+        tasks = list(tasks)
+        results = [None] * len(tasks)
+        for index, result in self.iter_run(tasks):
+            results[index] = result
+        return results
+
+    def iter_run(self, tasks):
+        """Run tasks, yielding each result as soon as its task finishes.
+
+        Args:
+            tasks: A sequence of Task objects.
+
+        Yields:
+            tuple: The index of the task and its result.
+        """
+        tasks = list(tasks)
+        for task in tasks:
+            if (self.get_cores(task) > self.resources.cores or
+                    task.resources.memory > self.resources.memory):
+                raise ValueError("{!r} exceeds the node's {!r}."
+                                 .format(task.resources, self.resources))
+        pending = self.get_order(tasks)
+        free = {'cpus': list(self.cpus), 'memory': self.resources.memory}
+        # Maps each running process to its task index, its CPUs and, for a
+        # duplicate, its job directory.
+        running = {}
+        inputs = {}
+        wall_times = {}
+        timed_out = set()
+        doomed = {}
+        try:
+            while pending or running:
+                if self.cancellation is not None:
+                    self.cancellation.check()
+                for index in list(pending):
+                    started = self._launch(tasks[index], free)
+                    if started is not None:
+                        process, cpus, inputs[index] = started
+                        running[process] = (index, cpus, None)
+                        pending.remove(index)
+                if pending and not running:
+                    raise RuntimeError(self._get_blocker(tasks[pending[0]],
+                                                         free))
+                timeout = None
+                if not pending and self.straggler_factor is not None:
+                    timeout = self._speculate(tasks, running, free, inputs,
+                                              wall_times)
+                timeout = _get_minimum(timeout,
+                                       self._enforce_limit(running, timed_out))
+                if self.monitor is not None:
+                    timeout = _get_minimum(timeout, self.monitor.interval)
+                finished = wait_any(list(running), timeout)
+                if self.monitor is not None:
+                    self._check_outputs(tasks, running, doomed)
+                for process in finished:
+                    if process not in running:
+                        continue
+                    index, cpus, copy_path = running.pop(process)
+                    self._release(tasks[index], cpus, free)
+                    if self.cancellation is not None:
+                        self.cancellation.unregister(process)
+                    if process in timed_out:
+                        process.result = RuntimeError(
+                            "The job in {:s} exceeded its wall-time limit of "
+                            "{:g} s.".format(tasks[index].job_dir_path,
+                                             self.timeout))
+                    if process in doomed:
+                        process.result = RuntimeError(
+                            "The job in {:s} failed with a fatal error: {:s}"
+                            .format(tasks[index].job_dir_path,
+                                    doomed[process]))
+                    if self.monitor is not None:
+                        self.monitor.forget(copy_path or
+                                            tasks[index].job_dir_path)
+                    failed = isinstance(process.result, BaseException)
+                    others = [other for other in running
+                              if running[other][0] == index]
+                    if failed and others:
+                        self._discard_copy(tasks[index], copy_path)
+                        continue
+                    for other in others:
+                        other.kill()
+                        other.wait()
+                        other_index, other_cpus, other_path = running.pop(
+                            other)
+                        self._release(tasks[index], other_cpus, free)
+                        if self.cancellation is not None:
+                            self.cancellation.unregister(other)
+                        self._discard_copy(tasks[index], other_path)
+                    if copy_path is not None:
+                        if not failed:
+                            _copy_files(copy_path, tasks[index].job_dir_path)
+                        self._discard_copy(tasks[index], copy_path)
+                    if not failed:
+                        wall_times.setdefault(tasks[index].kind, []).append(
+                            process.elapsed)
+                    self._record(tasks[index], process)
+                    yield index, process.result
+        finally:
+            for process in running:
+                process.kill()
+                process.wait()
+                if self.cancellation is not None:
+                    self.cancellation.unregister(process)
+                self._discard_copy(tasks[running[process][0]],
+                                   running[process][2])
+            if self.history is not None:
+                self.history.save()
+
+    def get_order(self, tasks):
+        """Order tasks by decreasing expected wall time.
+
+        Args:
+            tasks: A sequence of Task objects.
+
+        Returns:
+            list: The task indices, in the order they should be started.
+        """
+        if self.history is None:
+            return list(range(len(tasks)))
+        expected = [self.history.get_expected(task.key, task.kind)
+                    for task in tasks]
+        return sorted(range(len(tasks)), key=lambda index: (
+            -float("inf") if expected[index] is None else -expected[index]))
+
+    def _record(self, task, process):
+        if (self.history is not None and task.key is not None and
+                not isinstance(process.result, BaseException)):
+            self.history.record(task.key, task.kind, process.elapsed)
+
+    def _launch(self, task, free, job_dir_path=None):
+        """Start a task if its resources are free.
+
+        Returns:
+            tuple: The Process object, its CPUs and, if stragglers are
+                duplicated, the names of the files in the job directory
+                before the start.  None if the resources aren't free.
+        """
+        if self._get_blocker(task, free) is not None:
+            return None
+        cores = self.get_cores(task)
+        scratch = self.scratch if task.scratch is None else task.scratch
+        cpus = self._get_usable_cpus(task, free)[:cores]
+        free['cpus'] = [cpu for cpu in free['cpus'] if cpu not in cpus]
+        free['memory'] -= task.resources.memory
+        environ = {variable: str(cores) for variable in self.thread_variables}
+        if job_dir_path is None:
+            job_dir_path = task.job_dir_path
+            self.placements[job_dir_path] = cpus
+        if scratch is not None:
+            environ.update(scratch.allocate(job_dir_path))
+        names = None
+        if self.straggler_factor is not None:
+            names = os.listdir(job_dir_path)
+        process = Process(task.function, job_dir_path, environ,
+                          cpus if self.pin else None)
+        if self.cancellation is not None:
+            self.cancellation.register(process)
+        return process, cpus, names
+
+    def _get_usable_cpus(self, task, free):
+        """Return the free CPUs a task may run on.
+        """
+        avoided = self.avoided.get(task.job_dir_path, ())
+        if len(set(self.cpus) - set(avoided)) < self.get_cores(task):
+            return free['cpus']
+        return [cpu for cpu in free['cpus'] if cpu not in avoided]
+
+    def _get_blocker(self, task, free):
+        """Describe what keeps a task from starting.
+
+        Returns:
+            str: The resource the task is waiting for, or None if it can
+                start.
+        """
+        cores = self.get_cores(task)
+        usable = len(self._get_usable_cpus(task, free))
+        if cores > usable:
+            return ("The job in {:s} needs {:d} cores, but only {:d} are "
+                    "free.".format(task.job_dir_path, cores, usable))
+        if task.resources.memory > free['memory']:
+            return ("The job in {:s} needs {:d} bytes of memory, but only "
+                    "{:d} are free.".format(task.job_dir_path,
+                                            task.resources.memory,
+                                            free['memory']))
+        scratch = self.scratch if task.scratch is None else task.scratch
+        if scratch is not None and not scratch.has_space():
+            return ("The job in {:s} needs {:d} bytes of free scratch space "
+                    "in {:s}.".format(task.job_dir_path, scratch.min_free,
+                                      scratch.root_path))
+        return None
+
+    def _discard_copy(self, task, copy_path):
+        """Remove the job directory of a duplicate, and its scratch.
+        """
+        if copy_path is None:
+            return
+        _remove_copy(copy_path)
+        scratch = self.scratch if task.scratch is None else task.scratch
+        if scratch is not None:
+            scratch.release(copy_path)
+
+    def _release(self, task, cpus, free):
+        free['cpus'] = sorted(free['cpus'] + cpus)
+        free['memory'] += task.resources.memory
+
+    def _check_outputs(self, tasks, running, doomed):
+        """Kill running tasks whose outputs show a fatal error.
+        """
+        for process, (index, cpus, copy_path) in running.items():
+            if process in doomed or process.poll():
+                continue
+            match = self.monitor.check(copy_path or tasks[index].job_dir_path)
+            if match is not None:
+                process.kill()
+                doomed[process] = match
+
+    def _enforce_limit(self, running, timed_out):
+        """Kill tasks past the wall-time limit.
+
+        Returns:
+            float: The time until the next task reaches the limit, or None.
+        """
+        if self.timeout is None:
+            return None
+        now = time.time()
+        timeout = None
+        for process in running:
+            remaining = process.start_time + self.timeout - now
+            if remaining <= 0.:
+                process.kill()
+                timed_out.add(process)
+            elif process not in timed_out:
+                timeout = _get_minimum(timeout, remaining)
+        return timeout
+
+    def _speculate(self, tasks, running, free, inputs, wall_times):
+        """Duplicate straggling tasks.
+
+        Returns:
+            float: The time until the next task becomes a straggler, or None.
+        """
+        now = time.time()
+        duplicated = set(index for index, cpus, copy_path
+                         in running.values() if copy_path is not None)
+        timeout = None
+        for process, (index, cpus, copy_path) in list(running.items()):
+            times = wall_times.get(tasks[index].kind, [])
+            if (copy_path is not None or index in duplicated or
+                    len(times) < self.min_completed):
+                continue
+            limit = self.straggler_factor * statistics.median(times)
+            remaining = process.start_time + limit - now
+            if remaining > 0.:
+                timeout = _get_minimum(timeout, remaining)
+                continue
+            if (self.get_cores(tasks[index]) > len(free['cpus']) or
+                    tasks[index].resources.memory > free['memory']):
+                continue
+            job_dir_path = tasks[index].job_dir_path
+            copy_path = job_dir_path.rstrip(os.sep) + ".duplicate"
+            _remove_copy(copy_path)
+            _copy_files(job_dir_path, copy_path, inputs[index])
+            started = self._launch(tasks[index], free, copy_path)
+            if started is None:
+                _remove_copy(copy_path)
+                continue
+            running[started[0]] = (index, started[1], copy_path)
+        return timeout
+
+
+def _get_minimum(first, second):
+    """Return the smaller of two timeouts, where None means no timeout.
+    """
+    if first is None or second is None:
+        return second if first is None else first
+    return min(first, second)
+
+
+def _copy_files(source_path, target_path, names=None):
+    """Copy the files of one directory into another, creating it if needed.
+
+    Returns:
+        str: The target path.
+    """
+    if not os.path.exists(target_path):
+        os.makedirs(target_path)
+    for name in os.listdir(source_path) if names is None else names:
+        path = os.path.join(source_path, name)
+        if os.path.isdir(path):
+            shutil.copytree(path, os.path.join(target_path, name),
+                            dirs_exist_ok=True)
+        elif os.path.exists(path):
+            shutil.copy2(path, target_path)
+    return target_path
+
+
+def _remove_copy(copy_path):
+    if copy_path is not None:
+        shutil.rmtree(copy_path, ignore_errors=True)
+
+
+def _get_available_memory():
+    """Return the memory available for new processes, in bytes.
+    """
+    try:
+        with open("/proc/meminfo") as meminfo_file:
+            for line in meminfo_file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
@@ -0,0 +1,76 @@
+"""Module for per-job scratch directories on fast local storage.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+SCRATCH_VARIABLES = ("PSI_SCRATCH", "TMPDIR", "TMP", "TEMP")
+
+
+class ScratchManager(object):
+    """Allocates a scratch directory for each job on a local file system.
+
+    Each job directory is given its own scratch directory under `root_path`,
+    named after the job directory, and exported to the program through the
+    environment variables in `variables`.  A job is only admitted if at least
+    `min_free` bytes are free on the scratch file system.
+
+    Attributes:
+        root_path (str): The directory holding the scratch directories, e.g.
+            on a tmpfs or local NVMe drive.
+        variables (tuple): The environment variables set to the scratch
+            directory of each job.
+        min_free (int): The free space, in bytes, needed to start a job.
+    """
+
+    def __init__(self, root_path=None, variables=SCRATCH_VARIABLES,
+                 min_free=0):
+        """Initialize this ScratchManager object.
+
+        Args:
+            root_path: The directory holding the scratch directories.  By
+                default, $PSIDER_SCRATCH or the system's temporary directory.
+            variables: The environment variables to export.
+            min_free: The free space, in bytes, needed to start a job.
+        """
+        if root_path is None:
+            root_path = os.environ.get("PSIDER_SCRATCH",
+                                       tempfile.gettempdir())
+        self.root_path = os.path.abspath(root_path)
+        self.variables = tuple(variables)
+        self.min_free = int(min_free)
+
+    def get_path(self, job_dir_path):
+        """Return the scratch directory of a job directory.
+        """
+        job_dir_path = os.path.abspath(job_dir_path)
+        digest = hashlib.sha1(job_dir_path.encode()).hexdigest()[:12]
+        return os.path.join(self.root_path, "psider-{:s}-{:s}".format(
+            os.path.basename(job_dir_path), digest))
+
+    def has_space(self):
+        """Check whether there is enough free space to start another job.
+        """
+        if not os.path.exists(self.root_path):
+            os.makedirs(self.root_path)
+        return shutil.disk_usage(self.root_path).free >= self.min_free
+
+    def allocate(self, job_dir_path):
+        """Create an empty scratch directory for a job.
+
+        Args:
+            job_dir_path: The job directory.
+
+        Returns:
+            dict: The environment variables pointing the job at it.
+        """
+        scratch_path = self.get_path(job_dir_path)
+        self.release(job_dir_path)
+        os.makedirs(scratch_path)
+        return {variable: scratch_path for variable in self.variables}
+
+    def release(self, job_dir_path):
+        """Delete the scratch directory of a job, if there is one.
+        """
+        shutil.rmtree(self.get_path(job_dir_path), ignore_errors=True)
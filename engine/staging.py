@@ -0,0 +1,161 @@
+"""Module for staging auxiliary job files into many job directories.
+
+Instead of copying each auxiliary file (basis sets, restart files, ECP
+libraries) into every job directory, a Stager keeps a single read-only copy
+of each file per campaign, identified by its checksum, and places it in the
+job directories as a hard link, a symbolic link, a copy-on-write clone or,
+as a last resort, a plain copy.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+
+STRATEGIES = ("hardlink", "symlink", "reflink", "copy")
+STAGING_DIR_NAME = "staged"
+MANIFEST_NAME = "manifest.json"
+# The FICLONE ioctl request from <linux/fs.h>.
+FICLONE = 0x40049409
+
+
+def get_checksum(path, chunk_size=2 ** 20):
+    """Return the SHA-256 hex digest of a file's contents.
+    """
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as data_file:
+        for chunk in iter(lambda: data_file.read(chunk_size), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class Stager(object):
+    """Shares one staged copy of each auxiliary file between job directories.
+
+    Staged files live in `staging_dir_path`, under their checksum, and are
+    made read-only so that no job can change them for the others.  The
+    manifest file in the staging directory maps each checksum to its staged
+    path, so files already staged, in this or an earlier run, are not copied
+    again.  Checksums of source files are cached by size and modification
+    time, so each source is read only once however many jobs use it.
+
+    If a link can't be made, e.g. across file systems or when the file
+    system doesn't support cloning, the file is copied instead.
+
+    Attributes:
+        staging_dir_path (str): The directory holding the staged files.
+        strategy (str): 'hardlink', 'symlink', 'reflink' or 'copy'.
+        manifest (dict): Maps checksums to staged file paths, relative to
+            the staging directory.
+    """
+
+    def __init__(self, staging_dir_path, strategy="hardlink"):
+        if strategy not in STRATEGIES:
+            raise ValueError("'strategy' must be one of {:s}."
+                             .format(", ".join(STRATEGIES)))
+        self.staging_dir_path = os.path.abspath(staging_dir_path)
+        self.strategy = strategy
+        self.manifest_path = os.path.join(self.staging_dir_path,
+                                          MANIFEST_NAME)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+        self._checksums = {}
+        self._lock = threading.Lock()
+
+    def get_checksum(self, file_path):
+        """Return the checksum of a source file, reading it only if changed.
+        """
+        file_path = os.path.abspath(file_path)
+        status = os.stat(file_path)
+        signature = (status.st_size, status.st_mtime_ns)
+        cached = self._checksums.get(file_path)
+        if cached is None or cached[0] != signature:
+            cached = (signature, get_checksum(file_path))
+            self._checksums[file_path] = cached
+        return cached[1]
+
+    def stage(self, file_path):
+        """Make sure a file is staged.
+
+        Args:
+            file_path: The path of the source file.
+
+        Returns:
+            str: The absolute path of the staged copy.
+        """
+        checksum = self.get_checksum(file_path)
+        with self._lock:
+            if checksum in self.manifest:
+                staged_path = os.path.join(self.staging_dir_path,
+                                           self.manifest[checksum])
+                if os.path.exists(staged_path):
+                    return staged_path
+            relative_path = os.path.join(checksum,
+                                         os.path.basename(file_path))
+            staged_path = os.path.join(self.staging_dir_path, relative_path)
+            if not os.path.exists(os.path.dirname(staged_path)):
+                os.makedirs(os.path.dirname(staged_path))
+            shutil.copy2(file_path, staged_path)
+            os.chmod(staged_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            self.manifest[checksum] = relative_path
+            self._write_manifest()
+            return staged_path
+
+    def _write_manifest(self):
+        temporary_path = self.manifest_path + ".tmp"
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=1, sort_keys=True)
+        os.replace(temporary_path, self.manifest_path)
+
+    def place(self, file_path, job_dir_path):
+        """Place a staged file into a job directory under its own name.
+
+        Args:
+            file_path: The path of the source file.
+            job_dir_path: The job directory.
+
+        Returns:
+            str: The path of the file in the job directory.
+        """
+        staged_path = self.stage(file_path)
+        target_path = os.path.join(job_dir_path, os.path.basename(file_path))
+        if os.path.lexists(target_path):
+            linked = {"hardlink": False, "symlink": True}.get(self.strategy)
+            if (linked is not None and
+                    os.path.islink(target_path) == linked and
+                    os.path.exists(target_path) and
+                    os.path.samefile(target_path, staged_path)):
+                return target_path
+            os.remove(target_path)
+        try:
+            if self.strategy == "hardlink":
+                os.link(staged_path, target_path)
+            elif self.strategy == "symlink":
+                os.symlink(staged_path, target_path)
+            elif self.strategy == "reflink":
+                _clone(staged_path, target_path)
+            else:
+                _copy(staged_path, target_path)
+        except OSError:
+            if os.path.lexists(target_path):
+                os.remove(target_path)
+            _copy(staged_path, target_path)
+        return target_path
+
+
+def _clone(source_path, target_path):
+    """Make a copy-on-write clone of a file, on file systems supporting it.
+    """
+    with open(source_path, 'rb') as source_file:
+        with open(target_path, 'wb') as target_file:
+            fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+
+
+def _copy(source_path, target_path):
+    """Copy a staged file, leaving the copy writable.
+    """
+    shutil.copyfile(source_path, target_path)
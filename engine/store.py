@@ -0,0 +1,130 @@
+"""Module for content-addressed job directories shared between campaigns.
+
+A job is identified by its rendered input and the checksums of its
+auxiliary files.  Identical jobs, whichever campaign they come from, are run
+in the same store directory, so a finished one is never computed again.
+"""
+import fcntl
+import hashlib
+import os
+
+from .staging import get_checksum
+
+CLAIM_NAME = ".claim"
+
+
+class JobStore(object):
+    """Names job directories by the hash of what they compute.
+
+    Each campaign keeps its own job directory names, which become symbolic
+    links to directories in the store named by the hash of the job.  A job
+    whose store directory already holds a successful output can then be
+    reaped without being run.  Running a job requires a claim on its store
+    directory, so that campaigns sharing the store at the same time never
+    run the same job twice at once.
+
+    Attributes:
+        store_path (str): The directory holding the job directories, which
+            are spread over subdirectories named by the first two characters
+            of their hashes.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = os.path.abspath(store_path)
+        self._checksums = {}
+
+    def get_checksum(self, file_path):
+        """Return the checksum of a file, reading it only if changed.
+        """
+        file_path = os.path.abspath(file_path)
+        status = os.stat(file_path)
+        signature = (status.st_size, status.st_mtime_ns)
+        cached = self._checksums.get(file_path)
+        if cached is None or cached[0] != signature:
+            cached = (signature, get_checksum(file_path))
+            self._checksums[file_path] = cached
+        return cached[1]
+
+    def get_key(self, input_str, file_paths=()):
+        """Return the hash identifying a job.
+
+        Args:
+            input_str: The rendered input file.
+            file_paths: The paths of the auxiliary job files.  Their names
+                and contents count, but not where they are read from.
+
+        Returns:
+            str: A SHA-256 hex digest.
+        """
+        key = hashlib.sha256(input_str.encode())
+        for name, checksum in sorted((os.path.basename(file_path),
+                                      self.get_checksum(file_path))
+                                     for file_path in file_paths):
+            key.update("\0{:s}\0{:s}".format(name, checksum).encode())
+        return key.hexdigest()
+
+    def get_path(self, key):
+        """Return the store directory of a job.
+        """
+        return os.path.join(self.store_path, key[:2], key)
+
+    def link(self, job_dir_path, key):
+        """Point a job directory at the store directory of a job.
+
+        Args:
+            job_dir_path: The job directory, which must not exist or already
+                be a symbolic link.
+            key: The hash of the job.
+
+        Returns:
+            str: The store directory.
+        """
+        store_dir_path = self.get_path(key)
+        if not os.path.exists(store_dir_path):
+            os.makedirs(store_dir_path, exist_ok=True)
+        if os.path.islink(job_dir_path):
+            if os.readlink(job_dir_path) == store_dir_path:
+                return store_dir_path
+            os.remove(job_dir_path)
+        elif os.path.exists(job_dir_path):
+            raise RuntimeError("The job directory {:s} exists outside of the "
+                               "store.".format(job_dir_path))
+        parent_path = os.path.dirname(os.path.abspath(job_dir_path))
+        if not os.path.exists(parent_path):
+            os.makedirs(parent_path)
+        os.symlink(store_dir_path, job_dir_path)
+        return store_dir_path
+
+    def claim(self, job_dir_path, block=False):
+        """Claim the store directory of a job, to run the job in it.
+
+        The claim is an exclusive lock on the file '.claim' in the store
+        directory.  It is held until `release` is called, or until the
+        process holding it exits, so a crashed campaign never leaves a stale
+        claim behind.
+
+        Args:
+            job_dir_path: The job directory, which links into the store.
+            block: Whether to wait until the current holder, if any,
+                releases the claim.
+
+        Returns:
+            The claim, to be passed to `release`, or None if another holder
+            has it.
+        """
+        claim_path = os.path.join(os.path.realpath(job_dir_path), CLAIM_NAME)
+        claim_file = open(claim_path, 'a')
+        try:
+            fcntl.flock(claim_file,
+                        fcntl.LOCK_EX if block
+                        else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            claim_file.close()
+            return None
+        return claim_file
+
+    def release(self, claim):
+        """Release a claim returned by `claim`.
+        """
+        fcntl.flock(claim, fcntl.LOCK_UN)
+        claim.close()
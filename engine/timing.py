@@ -0,0 +1,54 @@
+"""Module for remembering how long jobs take.
+"""
+import json
+import os
+
+HISTORY_PATH = os.path.join(os.path.expanduser("~"), ".psider",
+                            "timings.json")
+
+
+class TimingHistory(object):
+    """Running averages of job wall times, by template hash and job kind.
+
+    The history is stored as a JSON file mapping each template hash to a
+    dictionary, which maps each job kind to its number of recorded runs and
+    their mean wall time in seconds.
+
+    Attributes:
+        path (str): The path of the JSON file.
+        data (dict): The history, as stored in the file.
+    """
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        self.data = {}
+        if os.path.exists(path):
+            with open(path) as history_file:
+                self.data = json.load(history_file)
+
+    def record(self, key, kind, seconds):
+        """Add the wall time of a job to the history.
+
+        Args:
+            key: The template hash of the job.
+            kind: The kind of job, e.g. 'reference'.
+            seconds: The wall time.
+        """
+        count, mean = self.data.setdefault(key, {}).get(kind, (0, 0.))
+        self.data[key][kind] = (count + 1,
+                                mean + (seconds - mean) / (count + 1))
+
+    def get_expected(self, key, kind):
+        """Return the mean wall time of a kind of job, or None if unknown.
+        """
+        count, mean = self.data.get(key, {}).get(kind, (0, None))
+        return mean
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, 'w') as history_file:
+            json.dump(self.data, history_file, indent=1, sort_keys=True)
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,171 @@
+"""Module for tuning the number of threads per job.
+
+Running many single-threaded jobs side by side is usually faster than running
+one job on every core, but not always: large basis sets favor fewer jobs with
+more threads each.  An AutoTuner finds the best split by running a sample of a
+campaign's own jobs under each candidate split, and remembers the choice for
+later campaigns with the same input template.
+"""
+import hashlib
+import json
+import os
+import time
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".psider", "tuning.json")
+
+
+def get_template_hash(input_template):
+    """Identify an input template by a hash of its contents.
+
+    Args:
+        input_template: An InputTemplate object, or its template string.
+
+    Returns:
+        str: A hex digest.
+    """
+    return hashlib.sha256(str(input_template).encode()).hexdigest()
+
+
+def get_splits(cores):
+    """List the ways of dividing a number of cores between concurrent jobs.
+
+    Args:
+        cores: The number of cores.
+
+    Returns:
+        list: (concurrent jobs, threads per job) pairs using every core.
+    """
+    return [(cores // threads, threads) for threads in range(1, cores + 1)
+            if cores % threads == 0]
+
+
+class AutoTuner(object):
+    """Runs tasks through a LocalScheduler with a tuned number of threads.
+
+    The first time a template is seen, the tasks are started in calibration
+    rounds, one per candidate split, each running `waves` full waves of
+    concurrent tasks.  The split with the highest throughput, in tasks per
+    second, is stored in the cache under the template hash and used for the
+    remaining tasks and for every later run with the same template.  The
+    results of the calibration tasks are kept, so no work is wasted.
+
+    An AutoTuner can stand in for a LocalScheduler, for instance as the
+    `scheduler` of a DisplacementRoutine.  Tasks requesting a specific number
+    of cores keep it.
+
+    Attributes:
+        scheduler: The LocalScheduler object running the tasks.
+        key (str): The template hash under which the choice is stored.
+        cache_path (str): The path of the JSON file holding the choices.
+        waves (int): The number of waves of tasks run for each split.
+        throughputs (dict): The measured tasks per second of each number of
+            threads per job, after a calibration.
+    """
+
+    def __init__(self, scheduler, key, cache_path=CACHE_PATH, waves=1):
+        self.scheduler = scheduler
+        self.key = key
+        self.cache_path = cache_path
+        self.waves = int(waves)
+        self.throughputs = {}
+
+    def get_cores_per_task(self):
+        """Look up the stored number of threads per job.
+
+        Returns:
+            int: The number of threads, or None if this template hasn't been
+                tuned for this node's number of cores.
+        """
+        entry = self._read_cache().get(self.key, {})
+        return entry.get(str(self.scheduler.resources.cores))
+
+    def set_cores_per_task(self, cores_per_task):
+        """Store the number of threads per job for this template.
+        """
+        cache = self._read_cache()
+        cache.setdefault(self.key, {})[
+            str(self.scheduler.resources.cores)] = int(cores_per_task)
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        temporary_path = self.cache_path + ".tmp"
+        with open(temporary_path, 'w') as cache_file:
+            json.dump(cache, cache_file, indent=1, sort_keys=True)
+        os.replace(temporary_path, self.cache_path)
+
+    def _read_cache(self):
+        if not os.path.exists(self.cache_path):
+            return {}
+        with open(self.cache_path) as cache_file:
+            return json.load(cache_file)
+
+    def avoid(self, job_dir_path):
+        """Make the task of a job directory avoid the CPUs it last ran on.
+
+        See LocalScheduler.avoid.
+        """
+        return self.scheduler.avoid(job_dir_path)
+
+    def run(self, tasks):
+        """Run tasks, blocking until all of them finish.
+
+        Args:
+            tasks: A sequence of Task objects.
+
+        Returns:
+            list: The return value of each task's function, in order.
+        """
+        tasks = list(tasks)
+        results = [None] * len(tasks)
+        for index, result in self.iter_run(tasks):
+            results[index] = result
+        return results
+
+    def iter_run(self, tasks):
+        """Run tasks, yielding each result as soon as its task finishes.
+
+        Args:
+            tasks: A sequence of Task objects.
+
+        Yields:
+            tuple: The index of the task and its result.
+        """
+        tasks = list(tasks)
+        indices = list(range(len(tasks)))
+        cores_per_task = self.get_cores_per_task()
+        if cores_per_task is None:
+            splits = get_splits(self.scheduler.resources.cores)
+            needed = sum(jobs for jobs, threads in splits) * self.waves
+            if len(splits) > 1 and needed < len(tasks):
+                for threads, sample in self._calibrate(tasks, indices):
+                    yield sample
+                cores_per_task = max(self.throughputs,
+                                     key=self.throughputs.get)
+                self.set_cores_per_task(cores_per_task)
+                indices = indices[needed:]
+        default = self.scheduler.cores_per_task
+        if cores_per_task is not None:
+            self.scheduler.cores_per_task = cores_per_task
+        try:
+            for position, result in self.scheduler.iter_run(
+                    [tasks[index] for index in indices]):
+                yield indices[position], result
+        finally:
+            self.scheduler.cores_per_task = default
+
+    def _calibrate(self, tasks, indices):
+        default = self.scheduler.cores_per_task
+        start = 0
+        try:
+            for jobs, threads in get_splits(self.scheduler.resources.cores):
+                sample = indices[start:start + jobs * self.waves]
+                start += len(sample)
+                self.scheduler.cores_per_task = threads
+                begin = time.time()
+                for position, result in self.scheduler.iter_run(
+                        [tasks[index] for index in sample]):
+                    yield threads, (sample[position], result)
+                elapsed = max(time.time() - begin, 1e-9)
+                self.throughputs[threads] = len(sample) / elapsed
+        finally:
+            self.scheduler.cores_per_task = default
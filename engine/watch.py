@@ -0,0 +1,260 @@
+"""Module for detecting when job outputs are complete.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import re
+import select
+import struct
+import time
+
+# Constants from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class CompletionWatcher(object):
+    """Watches job outputs and reports each job as soon as it completes.
+
+    A job is complete once its output file has been written and matches the
+    success pattern, or the optional failure pattern.  Given a way to tell
+    whether a job's process has exited, a job that exits without such an
+    output is complete as well, and failed.  On Linux, the job directories
+    are watched with inotify, so an output is only read when a program
+    closes it after writing.  Elsewhere, or when inotify runs out of
+    watches, the outputs are polled with `os.stat`, backing off
+    exponentially while nothing changes.  Outputs written on other hosts of
+    a network file system raise no local inotify events, so the watched
+    outputs are also polled every `max_interval` seconds as a backstop.
+
+    Attributes:
+        output_paths (`list` of `str`s): The output files to watch.
+        success_pattern (str): A regex matching a successful output.
+        failure_pattern (str): A regex matching a failed output, or None.
+        callback: An optional callable, called with the index of each job in
+            `output_paths` as soon as it completes.
+        exited: An optional callable taking the index of a job and returning
+            whether its process has exited.
+        completed (set): The indices of the completed jobs.
+        failed (set): The indices of the jobs that exited without a complete
+            output.
+    """
+
+    def __init__(self, output_paths, success_pattern, callback=None,
+                 use_inotify=True, min_interval=0.1, max_interval=10.,
+                 failure_pattern=None, exited=None):
+        """Initialize this CompletionWatcher object.
+
+        Args:
+            output_paths: The output files to watch.
+            success_pattern: A regex matching a successful output.
+            callback: An optional callable taking a job index.
+            use_inotify: Whether to try inotify before falling back to
+                polling.
+            min_interval: The shortest time, in seconds, between polls.
+            max_interval: The longest time, in seconds, between polls.
+            failure_pattern: An optional regex matching a failed output, so
+                that failed jobs don't hold up the wait.
+            exited: An optional callable taking a job index and returning
+                whether the job's process has exited, so that jobs which
+                never write an output don't hold up the wait either.  It is
+                called at every poll, so it should be cheap.
+        """
+        self.output_paths = [os.path.abspath(path) for path in output_paths]
+        self.success_pattern = success_pattern
+        self.failure_pattern = failure_pattern
+        self.callback = callback
+        self.use_inotify = use_inotify
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.exited = exited
+        self.completed = set()
+        self.failed = set()
+        self._stats = {}
+
+    def wait(self, timeout=None):
+        """Block until every job completes, or until the timeout.
+
+        Args:
+            timeout: The longest time to wait, in seconds, or None to wait
+                indefinitely.
+
+        Returns:
+            bool: Whether every job completed.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        inotify = _Inotify() if self.use_inotify else None
+        try:
+            polled = self._watch(inotify)
+            # Outputs finished before their watches were added are found by
+            # this first check.
+            self._check(range(len(self.output_paths)))
+            self._check_exited()
+            interval = self.min_interval
+            backstop_time = time.time() + self.max_interval
+            while len(self.completed) < len(self.output_paths):
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0.:
+                        break
+                polled = [index for index in polled
+                          if index not in self.completed]
+                wait = (interval if polled or inotify is None or
+                        self.exited is not None else self.max_interval)
+                if remaining is not None:
+                    wait = min(wait, remaining)
+                changed = []
+                if inotify is not None and inotify.fd is not None:
+                    changed = self._read_events(inotify, wait)
+                    if time.time() >= backstop_time:
+                        changed.extend(self._get_changed(
+                            index for index in range(len(self.output_paths))
+                            if index not in self.completed))
+                        backstop_time = time.time() + self.max_interval
+                else:
+                    time.sleep(wait)
+                changed.extend(self._get_changed(polled))
+                if (polled or self.exited is not None) and not changed:
+                    interval = min(2. * interval, self.max_interval)
+                else:
+                    interval = self.min_interval
+                self._check(changed)
+                self._check_exited()
+        finally:
+            if inotify is not None:
+                inotify.close()
+        return len(self.completed) == len(self.output_paths)
+
+    def _watch(self, inotify):
+        """Add inotify watches, returning the jobs that must be polled.
+        """
+        self._indices = {}
+        for index, path in enumerate(self.output_paths):
+            key = (os.path.dirname(path), os.path.basename(path))
+            self._indices.setdefault(key, []).append(index)
+        if inotify is None or inotify.fd is None:
+            return list(range(len(self.output_paths)))
+        polled = []
+        self._directories = {}
+        for directory in sorted(set(key[0] for key in self._indices)):
+            descriptor = inotify.add_watch(directory,
+                                           IN_CLOSE_WRITE | IN_MOVED_TO)
+            if descriptor is None:
+                polled.extend(index for (dir_path, name), indices
+                              in self._indices.items()
+                              if dir_path == directory for index in indices)
+            else:
+                self._directories[descriptor] = directory
+        return polled
+
+    def _read_events(self, inotify, timeout):
+        changed = []
+        for descriptor, name in inotify.read_events(timeout):
+            directory = self._directories.get(descriptor)
+            changed.extend(self._indices.get((directory, name), []))
+        return changed
+
+    def _get_changed(self, indices):
+        changed = []
+        for index in indices:
+            try:
+                stat = os.stat(self.output_paths[index])
+            except OSError:
+                continue
+            signature = (stat.st_mtime, stat.st_size)
+            if self._stats.get(index) != signature:
+                self._stats[index] = signature
+                changed.append(index)
+        return changed
+
+    def _check(self, indices):
+        for index in sorted(set(indices) - self.completed):
+            try:
+                with open(self.output_paths[index]) as output_file:
+                    output_str = output_file.read()
+            except (IOError, OSError):
+                continue
+            if (re.search(self.success_pattern, output_str) or
+                    self.failure_pattern is not None and
+                    re.search(self.failure_pattern, output_str)):
+                self.completed.add(index)
+                if self.callback is not None:
+                    self.callback(index)
+
+    def _check_exited(self):
+        """Fail the jobs that have exited without a complete output.
+        """
+        if self.exited is None:
+            return
+        for index in range(len(self.output_paths)):
+            # The process is checked before its output, so that an output
+            # written just before it exited is never missed.
+            if index in self.completed or not self.exited(index):
+                continue
+            self._check([index])
+            if index not in self.completed:
+                self.failed.add(index)
+                self.completed.add(index)
+                if self.callback is not None:
+                    self.callback(index)
+
+
+class _Inotify(object):
+    """A minimal ctypes wrapper around the Linux inotify API.
+
+    `fd` is None if inotify is unavailable.
+    """
+
+    def __init__(self):
+        self.fd = None
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                     use_errno=True)
+            fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd >= 0:
+            self.fd = fd
+
+    def add_watch(self, path, mask):
+        """Watch a directory, returning the watch descriptor or None.
+        """
+        descriptor = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if descriptor < 0:
+            if ctypes.get_errno() not in (errno.ENOSPC, errno.ENOENT,
+                                          errno.EACCES):
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+            return None
+        return descriptor
+
+    def read_events(self, timeout):
+        """Wait for events, returning (watch descriptor, name) pairs.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        events = []
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        offset = 0
+        while offset < len(buffer):
+            descriptor, mask, cookie, length = _EVENT_HEADER.unpack_from(
+                buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((descriptor, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
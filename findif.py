@@ -0,0 +1,716 @@
+"""Module for finite-difference displacements and derivative assembly.
+"""
+import numpy as np
+
+from . import vibrations
+from .internals import InternalCoordinates
+from .util import physconst
+
+# Step multiples and weights of the central-difference first-derivative
+# formulas, keyed by the number of points.
+STENCILS = {
+    3: ((-1, -1. / 2.), (1, 1. / 2.)),
+    5: ((-2, 1. / 12.), (-1, -8. / 12.), (1, 8. / 12.), (2, -1. / 12.)),
+}
+
+
+class DisplacementSet(object):
+    """A set of geometries displaced from a reference molecule.
+
+    Each displacement is labeled by a tuple of `(direction, step)` pairs, with
+    the reference geometry labeled by the empty tuple.  The displaced
+    coordinates are `x0 + step_size * sum(step * directions[direction])`, in
+    bohr.  Labels are stored only once, so displacements requested by more
+    than one stencil are computed only once.
+
+    Attributes:
+        molecule: The reference Molecule object, in bohr.
+        directions (`np.ndarray`): An m x 3N array whose rows are the
+            Cartesian displacement vectors of the m displacement coordinates.
+        step_size (float): The size of a single step along a direction.
+        points (int): The number of points in the first-derivative stencil.
+        labels (`list` of `tuple`s): The displacement labels, indexed by
+            displacement number.
+    """
+
+    def __init__(self, molecule, directions, step_size=0.005, points=3):
+        """Initialize this DisplacementSet object.
+
+        Args:
+            molecule: A Molecule object defining the reference geometry.
+            directions: An m x 3N array of displacement vectors.
+            step_size: The finite-difference step size.
+            points: The number of stencil points, 3 or 5.
+        """
+        self.molecule = molecule.copy()
+        self.molecule.set_units("bohr")
+        self.directions = np.array(directions, dtype=float).reshape(
+            -1, 3 * self.molecule.natom)
+        self.step_size = float(step_size)
+        self.points = points
+        self.labels = []
+        self._indices = {}
+        if self.points not in STENCILS:
+            raise ValueError("'points' must be one of {:s}."
+                             .format(str(sorted(STENCILS))))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.get_molecule(index)
+
+    def add_displacement(self, label):
+        """Add a displacement to the set, unless it is already there.
+
+        Args:
+            label: An iterable of `(direction, step)` pairs.  Zero steps are
+                dropped and repeated directions are combined.
+
+        Returns:
+            int: The displacement number.
+        """
+        label = self.normalize_label(label)
+        if label not in self._indices:
+            self._indices[label] = len(self.labels)
+            self.labels.append(label)
+        return self._indices[label]
+
+    @staticmethod
+    def normalize_label(label):
+        steps = {}
+        for direction, step in label:
+            steps[int(direction)] = steps.get(int(direction), 0) + int(step)
+        return tuple(sorted((direction, step) for direction, step
+                            in steps.items() if step != 0))
+
+    def get_index(self, label):
+        """Return the displacement number of a label.
+        """
+        return self._indices[self.normalize_label(label)]
+
+    def get_coordinates(self, label):
+        """Return the displaced coordinates for a label.
+
+        Args:
+            label: A displacement label.
+
+        Returns:
+            np.ndarray: An natom x 3 array of coordinates, in bohr.
+        """
+        coordinates = self.molecule.coordinates.flatten()
+        for direction, step in self.normalize_label(label):
+            coordinates += self.step_size * step * self.directions[direction]
+        return coordinates.reshape(-1, 3)
+
+    def get_molecule(self, index):
+        """Return the Molecule object for a displacement number.
+        """
+        molecule = self.molecule.copy()
+        molecule.set_coordinates(self.get_coordinates(self.labels[index]),
+                                 "bohr")
+        return molecule
+
+    def get_molecules(self):
+        return list(self)
+
+    def add_stencil(self, direction):
+        """Add the displacements needed to differentiate along a direction.
+        """
+        for step, weight in STENCILS[self.points]:
+            self.add_displacement([(direction, step)])
+
+    def differentiate(self, values):
+        """Compute first derivatives along every direction.
+
+        Args:
+            values: A sequence of values, such as energies or gradient arrays,
+                indexed by displacement number.
+
+        Returns:
+            np.ndarray: An array of shape (m,) + value shape holding the
+                derivatives along `self.directions`.
+        """
+        values = [np.asarray(value, dtype=float) for value in values]
+        if len(values) != len(self):
+            raise ValueError("Expected {:d} values, got {:d}."
+                             .format(len(self), len(values)))
+        derivatives = []
+        for direction in range(len(self.directions)):
+            derivative = 0.
+            for step, weight in STENCILS[self.points]:
+                index = self.get_index([(direction, step)])
+                derivative = derivative + weight * values[index]
+            derivatives.append(derivative / self.step_size)
+        return np.array(derivatives)
+
+    def solve(self, derivatives):
+        """Recover a Cartesian derivative from directional derivatives.
+
+        Solves `directions . X = derivatives` in the least-squares sense, so
+        the result is exact when the directions span the space in which the
+        derivative can be nonzero.
+
+        Args:
+            derivatives: An array of shape (m,) + value shape.
+
+        Returns:
+            np.ndarray: A 3N x (value size) array.
+        """
+        derivatives = derivatives.reshape(len(self.directions), -1)
+        return np.linalg.lstsq(self.directions, derivatives, rcond=None)[0]
+
+
+class _SymmetricDisplacementSet(DisplacementSet):
+    """A DisplacementSet that displaces only symmetry-unique atoms.
+
+    Directions are chosen for one atom of each set of equivalent atoms, and
+    the derivatives for the remaining atoms are reconstructed by applying the
+    operations of the point group.  Subclasses choose the directions on each
+    unique atom and say how a value transforms under an operation.
+
+    Only the atoms of an active region are displaced, if one is given, and
+    only the symmetry operations mapping that region onto itself are used.
+    """
+
+    def __init__(self, molecule, step_size=0.005, points=3, point_group=None,
+                 atoms=None):
+        natom = molecule.natom
+        self.atoms = np.array(molecule.get_atom_indices(atoms), dtype=int)
+        self._orbits = {}
+        self._site_directions = {}
+        if point_group is not None:
+            point_group = point_group.get_subgroup(self.atoms)
+        self.point_group = point_group
+        if point_group is None:
+            directions = np.eye(3 * natom).reshape(natom, 3, 3 * natom)
+            directions = directions[self.atoms].reshape(-1, 3 * natom)
+        else:
+            directions = []
+            self._orbits = point_group.get_unique_atoms(self.atoms)
+            for atom in self._orbits:
+                site_ops = point_group.get_site_operations(atom)
+                self._site_directions[atom] = []
+                for vector in self._get_site_vectors(site_ops):
+                    direction = np.zeros((natom, 3))
+                    direction[atom] = vector
+                    self._site_directions[atom].append(len(directions))
+                    directions.append(direction.flatten())
+            directions = np.reshape(directions, (-1, 3 * natom))
+        DisplacementSet.__init__(self, molecule, directions, step_size, points)
+        for direction in range(len(self.directions)):
+            self.add_stencil(direction)
+
+    def _get_active_rows(self):
+        return (3 * self.atoms[:, None] + np.arange(3)[None, :]).ravel()
+
+    def _get_site_vectors(self, site_ops):
+        raise NotImplementedError
+
+    def _transform_value(self, value, index):
+        raise NotImplementedError
+
+    def solve(self, derivatives):
+        if self.point_group is None:
+            return DisplacementSet.solve(self, derivatives)
+        natom = self.molecule.natom
+        point_group = self.point_group
+        derivatives = derivatives.reshape(len(self.directions), -1)
+        ret = np.zeros((natom, 3, derivatives.shape[1]))
+        for atom, orbit in self._orbits.items():
+            # Each site operation R turns a computed derivative along v into
+            # the derivative along R.v, transformed as the values are.
+            images = []
+            columns = []
+            for index, atom_map in enumerate(point_group.atom_maps):
+                if atom_map[atom] != atom:
+                    continue
+                op = point_group.operations[index]
+                for direction in self._site_directions[atom]:
+                    vector = self.directions[direction].reshape(natom, 3)[atom]
+                    images.append(np.dot(op, vector))
+                    columns.append(self._transform_value(
+                        derivatives[direction], index))
+            if not images:
+                continue
+            block = np.tensordot(np.linalg.pinv(np.transpose(images)),
+                                 np.array(columns), axes=(0, 0))
+            for other in orbit:
+                index = [i for i, atom_map in enumerate(point_group.atom_maps)
+                         if atom_map[atom] == other][0]
+                op = point_group.operations[index]
+                transformed = np.array([self._transform_value(row, index)
+                                        for row in block])
+                ret[other] = np.tensordot(op, transformed, axes=(1, 0))
+        return ret.reshape(3 * natom, -1)
+
+
+class GradientDisplacements(_SymmetricDisplacementSet):
+    """Displacements for a central-difference gradient from energies.
+
+    With a point group, only the symmetry-unique atoms are displaced, and only
+    along the directions left invariant by their site symmetry, since the
+    gradient must be totally symmetric.
+    """
+
+    def __init__(self, molecule, step_size=0.005, points=3, point_group=None,
+                 atoms=None):
+        """Initialize this GradientDisplacements object.
+
+        Args:
+            molecule: A Molecule object defining the reference geometry.
+            step_size: The step size, in bohr.
+            points: The number of stencil points, 3 or 5.
+            point_group: An optional symmetry.PointGroup of `molecule`.  The
+                energies must then be computed without reorienting the
+                displaced geometries.
+            atoms: An optional active region, given as atom indices or as a
+                predicate (see Molecule.get_atom_indices).  Only these atoms
+                are displaced.
+        """
+        _SymmetricDisplacementSet.__init__(self, molecule, step_size, points,
+                                           point_group, atoms)
+
+    def _get_site_vectors(self, site_ops):
+        constraints = np.concatenate([op - np.eye(3) for op in site_ops])
+        u, s, vt = np.linalg.svd(constraints)
+        return vt[np.sum(s > 1e-8):]
+
+    def _transform_value(self, value, index):
+        return value
+
+    def assemble(self, energies):
+        """Assemble the gradient.
+
+        Args:
+            energies: The energies, indexed by displacement number.
+
+        Returns:
+            np.ndarray: An n x 3 gradient, in hartree/bohr, with one row for
+                each of the n atoms in `self.atoms`.  Without an active
+                region, that is every atom.
+        """
+        gradient = self.solve(self.differentiate(energies)).reshape(-1, 3)
+        return gradient[self.atoms]
+
+
+class HessianDisplacements(_SymmetricDisplacementSet):
+    """Displacements for a central-difference Hessian from gradients.
+
+    With a point group, only the symmetry-unique atoms are displaced, and only
+    along enough directions for their site symmetry to generate the rest.
+    """
+
+    def __init__(self, molecule, step_size=0.005, points=3, point_group=None,
+                 atoms=None):
+        """Initialize this HessianDisplacements object.
+
+        Args:
+            molecule: A Molecule object defining the reference geometry.
+            step_size: The step size, in bohr.
+            points: The number of stencil points, 3 or 5.
+            point_group: An optional symmetry.PointGroup of `molecule`.  The
+                gradients must then be computed without reorienting the
+                displaced geometries.
+            atoms: An optional active region, given as atom indices or as a
+                predicate (see Molecule.get_atom_indices).  Only these atoms
+                are displaced.
+        """
+        _SymmetricDisplacementSet.__init__(self, molecule, step_size, points,
+                                           point_group, atoms)
+
+    def _get_site_vectors(self, site_ops):
+        # Add Cartesian axes until the images of the chosen vectors span all
+        # three dimensions.  The loose rank tolerance rejects nearly
+        # degenerate images, which would amplify finite-difference noise.
+        vectors = []
+        images = np.zeros((0, 3))
+        for vector in np.eye(3):
+            new_images = np.concatenate(
+                [images, [np.dot(op, vector) for op in site_ops]])
+            if (np.linalg.matrix_rank(new_images, tol=0.1) >
+                    np.linalg.matrix_rank(images, tol=0.1)):
+                vectors.append(vector)
+                images = new_images
+            if np.linalg.matrix_rank(images, tol=0.1) == 3:
+                break
+        return vectors
+
+    def _transform_value(self, value, index):
+        op = self.point_group.operations[index]
+        atom_map = self.point_group.atom_maps[index]
+        value = np.asarray(value).reshape(-1, 3)
+        ret = np.empty_like(value)
+        ret[atom_map] = np.dot(value, op.T)
+        return ret.flatten()
+
+    def assemble(self, gradients):
+        """Assemble the Hessian.
+
+        Args:
+            gradients: The natom x 3 gradients, indexed by displacement number.
+
+        Returns:
+            np.ndarray: A 3n x 3n Hessian, in hartree/bohr^2, over the n atoms
+                in `self.atoms`.
+        """
+        rows = self._get_active_rows()
+        hessian = self.solve(self.differentiate(gradients))[rows][:, rows]
+        return (hessian + hessian.T) / 2.
+
+
+class NormalModeDisplacements(DisplacementSet):
+    """Displacements along mass-weighted normal coordinates.
+
+    The normal modes are taken from a Hessian that may come from a cheaper
+    level of theory than the energies or gradients computed at the displaced
+    geometries.  Translations and rotations are never displaced, and a subset
+    of the modes can be selected by index or by frequency.
+
+    Attributes:
+        frequencies (`np.ndarray`): The harmonic wavenumbers of the selected
+            modes in the input Hessian, in cm^-1.
+        modes (`np.ndarray`): The indices of the selected modes among the
+            3N - 6 (or 3N - 5) vibrations, in order of increasing frequency.
+    """
+
+    def __init__(self, molecule, hessian, step_size=0.005, points=3,
+                 modes=None, frequency_window=None):
+        """Initialize this NormalModeDisplacements object.
+
+        Args:
+            molecule: A Molecule object defining the reference geometry.
+            hessian: A 3N x 3N Cartesian Hessian, in hartree/bohr^2.
+            step_size: The step size, in amu^1/2 bohr.
+            points: The number of stencil points, 3 or 5.
+            modes: An optional sequence of mode indices to displace.
+            frequency_window: An optional (lowest, highest) pair of
+                wavenumbers, in cm^-1.  Only modes inside it are displaced.
+        """
+        analysis = vibrations.analyze(molecule, hessian)
+        frequencies = analysis.frequencies
+        directions = analysis.get_cartesian_displacements()
+        selected = np.arange(len(frequencies))
+        if modes is not None:
+            selected = selected[np.asarray(modes, dtype=int)]
+        if frequency_window is not None:
+            lowest, highest = frequency_window
+            selected = [mode for mode in selected
+                        if lowest <= frequencies[mode] <= highest]
+        self.modes = np.array(selected, dtype=int)
+        self.frequencies = frequencies[self.modes]
+        DisplacementSet.__init__(self, molecule, directions[self.modes],
+                                 step_size, points)
+        for direction in range(len(self.directions)):
+            self.add_stencil(direction)
+
+    def assemble_gradient(self, energies):
+        """Assemble the gradient along the selected normal coordinates.
+
+        Args:
+            energies: The energies, indexed by displacement number.
+
+        Returns:
+            np.ndarray: The first derivatives, in hartree/(amu^1/2 bohr).
+        """
+        return self.differentiate(energies)
+
+    def assemble_hessian(self, gradients):
+        """Assemble the Hessian block of the selected normal coordinates.
+
+        Args:
+            gradients: The natom x 3 Cartesian gradients, indexed by
+                displacement number.
+
+        Returns:
+            np.ndarray: A k x k Hessian, in hartree/(amu bohr^2).
+        """
+        derivatives = self.differentiate(gradients).reshape(
+            len(self.directions), -1)
+        hessian = np.dot(self.directions, derivatives.T)
+        return (hessian + hessian.T) / 2.
+
+    @staticmethod
+    def get_frequencies(hessian):
+        """Convert a normal-coordinate Hessian into harmonic wavenumbers.
+
+        Imaginary frequencies are returned as negative numbers.
+        """
+        values = np.linalg.eigvalsh(hessian)
+        return np.sign(values) * np.sqrt(abs(values)) * physconst.au2wavenumber
+
+
+class InternalCoordinateDisplacements(DisplacementSet):
+    """Displacements along delocalized internal coordinates.
+
+    The coordinates are the non-redundant combinations of a redundant set of
+    internal coordinates, so no displacement translates or rotates the
+    molecule.  Displaced geometries are found by iterative back-transformation
+    to Cartesian coordinates, and `directions` holds the linearized Cartesian
+    displacement of a unit step in each coordinate.
+
+    Attributes:
+        internals: The internals.InternalCoordinates object.
+        basis (`np.ndarray`): An n x k array whose columns define the
+            displaced delocalized coordinates.
+    """
+
+    def __init__(self, molecule, internals=None, step_size=0.005, points=3,
+                 coordinates=None):
+        """Initialize this InternalCoordinateDisplacements object.
+
+        Args:
+            molecule: A Molecule object defining the reference geometry.
+            internals: An optional internals.InternalCoordinates object.  By
+                default, one is built from the connectivity of `molecule`.
+            step_size: The step size, in bohr and radians.
+            points: The number of stencil points, 3 or 5.
+            coordinates: An optional sequence of indices selecting which
+                delocalized coordinates to displace.
+        """
+        if internals is None:
+            internals = InternalCoordinates.from_molecule(molecule)
+        reference = molecule.copy()
+        reference.set_units("bohr")
+        self.internals = internals
+        self.basis = internals.get_delocalized_coordinates(
+            reference.coordinates)
+        if coordinates is not None:
+            self.basis = self.basis[:, np.asarray(coordinates, dtype=int)]
+        b_matrix = np.dot(self.basis.T,
+                          internals.get_b_matrix(reference.coordinates))
+        directions = np.linalg.pinv(b_matrix).T
+        DisplacementSet.__init__(self, molecule, directions, step_size, points)
+        self._reference_values = np.dot(
+            self.basis.T, internals.get_values(reference.coordinates))
+        for direction in range(len(self.directions)):
+            self.add_stencil(direction)
+
+    def get_coordinates(self, label):
+        target = self._reference_values.copy()
+        for direction, step in self.normalize_label(label):
+            target[direction] += self.step_size * step
+        return self.internals.to_cartesian(self.molecule.coordinates, target,
+                                           self.basis)
+
+    def assemble_gradient(self, energies):
+        """Assemble the Cartesian gradient.
+
+        Args:
+            energies: The energies, indexed by displacement number.
+
+        Returns:
+            np.ndarray: An natom x 3 gradient, in hartree/bohr.
+        """
+        return self.solve(self.differentiate(energies)).reshape(-1, 3)
+
+    def assemble_hessian(self, gradients):
+        """Assemble the Cartesian Hessian.
+
+        Args:
+            gradients: The natom x 3 gradients, indexed by displacement number.
+
+        Returns:
+            np.ndarray: A 3N x 3N Hessian, in hartree/bohr^2, with the
+                rigid-body motions projected out.
+        """
+        hessian = self.solve(self.differentiate(gradients))
+        return (hessian + hessian.T) / 2.
+
+
+class IncrementalAssembler(object):
+    """Assembles derivatives piece by piece, as displaced results arrive.
+
+    The derivative along a direction is computed as soon as every
+    displacement of its stencil has a result.  Partial gradients and
+    Hessians come with a mask of their complete entries, so that later steps
+    can use the finished blocks before the whole campaign is done.  A
+    Cartesian entry is complete once every direction it depends on is.
+
+    Example:
+        assembler = IncrementalAssembler(routine.displacements)
+        for index, value in routine.iter_execute():
+            if assembler.add(index, value):
+                gradient, mask = assembler.get_gradient()
+
+    Until the results needed for an entry arrive, it is NaN and masked out,
+    even before the first result.
+
+    Attributes:
+        displacements: The DisplacementSet object.
+        value_shape (tuple): The shape of each result, or None if it isn't
+            known yet.
+        values (list): The result of each displacement, or None.
+        derivatives (list): The derivative along each direction, or None.
+    """
+
+    def __init__(self, displacements, value_shape=None):
+        """Initialize this IncrementalAssembler object.
+
+        Args:
+            displacements: A DisplacementSet object.
+            value_shape: The shape of each result, e.g. () for energies or
+                (natom, 3) for gradients.  By default, it is () for a
+                GradientDisplacements object and (natom, 3) for a
+                HessianDisplacements object.  Otherwise it is taken from the
+                first result, or from the first call of `get_gradient` or
+                `get_hessian`.
+        """
+        if value_shape is None:
+            if isinstance(displacements, GradientDisplacements):
+                value_shape = ()
+            elif isinstance(displacements, HessianDisplacements):
+                value_shape = (displacements.molecule.natom, 3)
+        self.displacements = displacements
+        self.value_shape = (None if value_shape is None
+                            else tuple(value_shape))
+        self.values = [None] * len(displacements)
+        self.derivatives = [None] * len(displacements.directions)
+        self._stencils = []
+        self._directions = {}
+        for direction in range(len(displacements.directions)):
+            stencil = [(displacements.get_index([(direction, step)]), weight)
+                       for step, weight in STENCILS[displacements.points]]
+            self._stencils.append(stencil)
+            for index, weight in stencil:
+                self._directions.setdefault(index, []).append(direction)
+        self._dependencies = None
+
+    def add(self, index, value):
+        """Add the result of a displacement.
+
+        Args:
+            index: The displacement number.
+            value: The energy or gradient at that displacement.
+
+        Returns:
+            list: The directions whose derivatives this result completed.
+        """
+        value = np.asarray(value, dtype=float)
+        if self.value_shape is None:
+            self.value_shape = value.shape
+        elif value.shape != self.value_shape:
+            raise ValueError("Expected a result of shape {!r}, got {!r}."
+                             .format(self.value_shape, value.shape))
+        self.values[index] = value
+        completed = []
+        for direction in self._directions.get(index, ()):
+            stencil = self._stencils[direction]
+            if any(self.values[other] is None for other, weight in stencil):
+                continue
+            derivative = 0.
+            for other, weight in stencil:
+                derivative = derivative + weight * self.values[other]
+            self.derivatives[direction] = (derivative /
+                                           self.displacements.step_size)
+            completed.append(direction)
+        return completed
+
+    def is_complete(self):
+        return all(derivative is not None for derivative in self.derivatives)
+
+    def get_derivatives(self):
+        """Return the derivatives along the directions computed so far.
+
+        Returns:
+            tuple: An array of shape (m,) + value shape, holding NaN where a
+                derivative is missing, and a boolean mask of shape (m,).
+        """
+        mask = np.array([derivative is not None
+                         for derivative in self.derivatives], dtype=bool)
+        shape = () if self.value_shape is None else self.value_shape
+        derivatives = np.full((len(self.derivatives),) + shape, np.nan)
+        for direction in np.flatnonzero(mask):
+            derivatives[direction] = self.derivatives[direction]
+        return derivatives, mask
+
+    def get_cartesian(self):
+        """Return the Cartesian derivative rows computed so far.
+
+        Returns:
+            tuple: A 3N x (value size) array, as from DisplacementSet.solve,
+                holding NaN in incomplete rows, and a boolean mask of the
+                complete rows.
+        """
+        derivatives, mask = self.get_derivatives()
+        derivatives = np.nan_to_num(
+            derivatives.reshape(len(self.derivatives), -1))
+        dependencies = self._get_dependencies(derivatives.shape[1])
+        row_mask = ~dependencies[:, ~mask].any(axis=1)
+        cartesian = self.displacements.solve(derivatives)
+        cartesian[~row_mask] = np.nan
+        return cartesian, row_mask
+
+    def get_gradient(self):
+        """Return the gradient assembled so far from energies.
+
+        Returns:
+            tuple: The gradient, shaped as by the displacement set's
+                gradient assembly and holding NaN where incomplete, and a
+                boolean mask of the same shape.
+        """
+        if self.value_shape is None:
+            self.value_shape = ()
+        if isinstance(self.displacements, NormalModeDisplacements):
+            return self.get_derivatives()
+        cartesian, row_mask = self.get_cartesian()
+        gradient = cartesian.reshape(-1, 3)
+        mask = row_mask.reshape(-1, 3)
+        if isinstance(self.displacements, _SymmetricDisplacementSet):
+            gradient = gradient[self.displacements.atoms]
+            mask = mask[self.displacements.atoms]
+        return gradient, mask
+
+    def get_hessian(self):
+        """Return the Hessian assembled so far from gradients.
+
+        An entry is complete as soon as its row or its column is, taking the
+        other from symmetry; entries whose row and column are both complete
+        are averaged, as in the full assembly.
+
+        Returns:
+            tuple: The Hessian, shaped as by the displacement set's Hessian
+                assembly and holding NaN where incomplete, and a boolean mask
+                of the same shape.
+        """
+        if self.value_shape is None:
+            self.value_shape = (self.displacements.molecule.natom, 3)
+        if isinstance(self.displacements, NormalModeDisplacements):
+            derivatives, row_mask = self.get_derivatives()
+            derivatives = derivatives.reshape(len(self.derivatives), -1)
+            hessian = np.dot(np.nan_to_num(derivatives),
+                             self.displacements.directions.T)
+        else:
+            hessian, row_mask = self.get_cartesian()
+            if isinstance(self.displacements, _SymmetricDisplacementSet):
+                rows = self.displacements._get_active_rows()
+                hessian = hessian[rows][:, rows]
+                row_mask = row_mask[rows]
+        both = np.outer(row_mask, row_mask)
+        hessian = np.where(row_mask[:, None], hessian, hessian.T)
+        hessian = np.where(both, (hessian + hessian.T) / 2., hessian)
+        mask = row_mask[:, None] | row_mask[None, :]
+        hessian[~mask] = np.nan
+        return hessian, mask
+
+    def _get_dependencies(self, size):
+        """Find which directions each Cartesian row depends on.
+
+        Since solving is linear, a row depends on a direction exactly when
+        a random derivative along that direction alone makes it nonzero.
+        """
+        if (self._dependencies is not None and
+                self._dependencies[0] == size):
+            return self._dependencies[1]
+        random_state = np.random.RandomState(0)
+        count = len(self.derivatives)
+        dependencies = []
+        for direction in range(count):
+            probe = np.zeros((count, size))
+            probe[direction] = random_state.standard_normal(size)
+            rows = abs(self.displacements.solve(probe)).max(axis=1)
+            dependencies.append(rows > 1e-10 * max(rows.max(), 1e-300))
+        dependencies = np.transpose(dependencies)
+        self._dependencies = (size, dependencies)
+        return dependencies
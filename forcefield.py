@@ -0,0 +1,239 @@
+"""Module for finite-difference anharmonic force fields.
+"""
+import itertools
+
+import numpy as np
+
+from .findif import NormalModeDisplacements
+
+
+class SparseForceConstants(object):
+    """Force constants of one order, stored once per set of indices.
+
+    Force constants are symmetric under permutation of their indices, so each
+    one is stored under its sorted index tuple and can be looked up in any
+    order.  Constants that were not computed, or fell below the threshold,
+    read as zero.
+
+    Attributes:
+        order (int): The number of indices.
+        data (dict): Maps sorted index tuples to values.
+    """
+
+    @classmethod
+    def from_estimates(cls, order, indices, values, threshold=0.):
+        """Build force constants by averaging repeated estimates.
+
+        Args:
+            order: The number of indices.
+            indices: An m x `order` array of index tuples, in any order.
+            values: The m estimates.
+            threshold: Averaged constants with a smaller magnitude are dropped.
+        """
+        indices = np.sort(np.reshape(indices, (-1, order)), axis=1)
+        keys, inverse = np.unique(indices, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        sums = np.bincount(inverse, weights=values, minlength=len(keys))
+        counts = np.bincount(inverse, minlength=len(keys))
+        averages = sums / counts
+        keep = abs(averages) > threshold
+        data = dict(zip(map(tuple, keys[keep].tolist()), averages[keep]))
+        return cls(order, data)
+
+    def __init__(self, order, data=None):
+        self.order = order
+        self.data = {}
+        if data is not None:
+            for indices, value in data.items():
+                self[indices] = value
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, indices):
+        return self.data.get(self._get_key(indices), 0.)
+
+    def __setitem__(self, indices, value):
+        self.data[self._get_key(indices)] = float(value)
+
+    def __contains__(self, indices):
+        return self._get_key(indices) in self.data
+
+    def _get_key(self, indices):
+        key = tuple(sorted(int(index) for index in indices))
+        if len(key) != self.order:
+            raise ValueError("Expected {:d} indices, got {:d}."
+                             .format(self.order, len(key)))
+        return key
+
+    def items(self):
+        return self.data.items()
+
+    def to_dense(self, size):
+        """Expand into a dense array.  Use only for small numbers of modes.
+
+        Args:
+            size: The number of modes.
+
+        Returns:
+            np.ndarray: An array of shape (size,) * order.
+        """
+        ret = np.zeros((size,) * self.order)
+        for key, value in self.data.items():
+            for permutation in set(itertools.permutations(key)):
+                ret[permutation] = value
+        return ret
+
+
+class ForceField(object):
+    """A quadratic, cubic and semi-quartic force field in normal coordinates.
+
+    All force constants are derivatives of the energy with respect to
+    mass-weighted normal coordinates, in hartree/(amu^1/2 bohr)^n.
+
+    Attributes:
+        frequencies (`np.ndarray`): The harmonic wavenumbers of the modes
+            defining the normal coordinates, in cm^-1.
+        quadratic (`np.ndarray`): A k x k array of quadratic constants.
+        cubic: A SparseForceConstants object of order 3 with all cubic
+            constants.
+        quartic: A SparseForceConstants object of order 4 with the
+            constants F_iijk, which include the F_iiii and F_iijj needed for
+            VPT2.
+    """
+
+    def __init__(self, frequencies, quadratic, cubic, quartic):
+        self.frequencies = np.asarray(frequencies)
+        self.quadratic = np.asarray(quadratic)
+        self.cubic = cubic
+        self.quartic = quartic
+
+
+class ForceFieldDisplacements(NormalModeDisplacements):
+    """Displacements for a semi-quartic force field in normal coordinates.
+
+    From Hessians, the force field needs the reference and a step in each
+    direction along every mode.  From gradients, it also needs double steps
+    along every mode and a step along every pair of modes.  Displacements
+    shared between stencils appear only once.
+    """
+
+    def __init__(self, molecule, hessian, derivative="hessian",
+                 step_size=0.05, modes=None, frequency_window=None,
+                 threshold=1e-12):
+        """Initialize this ForceFieldDisplacements object.
+
+        Args:
+            molecule: A Molecule object defining the reference geometry.
+            hessian: A 3N x 3N Cartesian Hessian, in hartree/bohr^2, defining
+                the normal coordinates.
+            derivative: The property computed at each displacement, either
+                'hessian' or 'gradient'.
+            step_size: The step size, in amu^1/2 bohr.
+            modes: An optional sequence of mode indices to include.
+            frequency_window: An optional (lowest, highest) pair of
+                wavenumbers, in cm^-1.  Only modes inside it are included.
+            threshold: Force constants with a smaller magnitude are not
+                stored.
+        """
+        if derivative not in ("hessian", "gradient"):
+            raise ValueError("'derivative' must be 'hessian' or 'gradient'.")
+        NormalModeDisplacements.__init__(self, molecule, hessian, step_size,
+                                         3, modes, frequency_window)
+        self.derivative = derivative
+        self.threshold = threshold
+        nmode = len(self.directions)
+        self.add_displacement([])
+        if derivative == "gradient":
+            for i in range(nmode):
+                self.add_displacement([(i, 2)])
+                self.add_displacement([(i, -2)])
+            for i, j in itertools.combinations(range(nmode), 2):
+                for si, sj in itertools.product((1, -1), repeat=2):
+                    self.add_displacement([(i, si), (j, sj)])
+
+    def assemble(self, values):
+        """Assemble the force field.
+
+        Args:
+            values: The Cartesian Hessians (3N x 3N) or gradients (natom x 3),
+                indexed by displacement number, in atomic units.
+
+        Returns:
+            ForceField: The force field of the selected modes.
+        """
+        if len(values) != len(self):
+            raise ValueError("Expected {:d} values, got {:d}."
+                             .format(len(self), len(values)))
+        directions = self.directions
+        if self.derivative == "hessian":
+            values = [np.linalg.multi_dot([directions, np.reshape(
+                value, (len(directions.T),) * 2), directions.T])
+                for value in values]
+            return self._assemble_from_hessians(values)
+        values = [np.dot(directions, np.ravel(value)) for value in values]
+        return self._assemble_from_gradients(values)
+
+    def _assemble_from_hessians(self, hessians):
+        nmode = len(self.directions)
+        h = self.step_size
+
+        def get(*label):
+            return hessians[self.get_index(label)]
+
+        quadratic = get()
+        plus = np.array([get((i, 1)) for i in range(nmode)])
+        minus = np.array([get((i, -1)) for i in range(nmode)])
+        # plus[i, j, k] - minus[i, j, k] estimates F_ijk, and the second
+        # difference estimates F_iijk.
+        cubic = (plus - minus) / (2. * h)
+        quartic = (plus - 2. * quadratic[None, :, :] + minus) / h ** 2
+        i, j, k = np.indices((nmode,) * 3).reshape(3, -1)
+        cubic = SparseForceConstants.from_estimates(
+            3, np.transpose([i, j, k]), cubic.ravel(), self.threshold)
+        quartic = SparseForceConstants.from_estimates(
+            4, np.transpose([i, i, j, k]), quartic.ravel(), self.threshold)
+        return ForceField(self.frequencies, (quadratic + quadratic.T) / 2.,
+                          cubic, quartic)
+
+    def _assemble_from_gradients(self, gradients):
+        nmode = len(self.directions)
+        h = self.step_size
+
+        def get(*label):
+            return gradients[self.get_index(label)]
+
+        quadratic = np.array([(get((i, 1)) - get((i, -1))) / (2. * h)
+                              for i in range(nmode)])
+        cubic_indices, cubic_values = [], []
+        quartic_indices, quartic_values = [], []
+        modes = np.arange(nmode)
+        for i in range(nmode):
+            # F_iik and F_iiik from steps along mode i alone.
+            cubic_indices.append(np.transpose([[i] * nmode, [i] * nmode,
+                                               modes]))
+            cubic_values.append((get((i, 1)) - 2. * get() + get((i, -1))) /
+                                h ** 2)
+            quartic_indices.append(np.transpose([[i] * nmode] * 3 + [modes]))
+            quartic_values.append((get((i, 2)) - 2. * get((i, 1)) +
+                                   2. * get((i, -1)) - get((i, -2))) /
+                                  (2. * h ** 3))
+        for i, j in itertools.permutations(range(nmode), 2):
+            # F_ijk and F_iijk from steps along modes i and j together.
+            pp, pm = get((i, 1), (j, 1)), get((i, 1), (j, -1))
+            mp, mm = get((i, -1), (j, 1)), get((i, -1), (j, -1))
+            cubic_indices.append(np.transpose([[i] * nmode, [j] * nmode,
+                                               modes]))
+            cubic_values.append((pp - pm - mp + mm) / (4. * h ** 2))
+            quartic_indices.append(np.transpose([[i] * nmode, [i] * nmode,
+                                                 [j] * nmode, modes]))
+            quartic_values.append((pp - 2. * get((j, 1)) + mp - pm +
+                                   2. * get((j, -1)) - mm) / (2. * h ** 3))
+        cubic = SparseForceConstants.from_estimates(
+            3, np.concatenate(cubic_indices), np.concatenate(cubic_values),
+            self.threshold)
+        quartic = SparseForceConstants.from_estimates(
+            4, np.concatenate(quartic_indices),
+            np.concatenate(quartic_values), self.threshold)
+        return ForceField(self.frequencies, (quadratic + quadratic.T) / 2.,
+                          cubic, quartic)
@@ -0,0 +1,257 @@
+"""Module for redundant internal coordinates.
+"""
+import itertools
+
+import numpy as np
+
+from .util import atomdata, physconst
+
+
+class InternalCoordinates(object):
+    """A redundant set of bond stretches, angle bends and torsions.
+
+    All quantities are in bohr and radians.  Every method that takes
+    coordinates works on an natom x 3 array, so the same object can be
+    evaluated at any displaced geometry.
+
+    Attributes:
+        bonds (`np.ndarray`): An n x 2 array of atom indices.
+        angles (`np.ndarray`): An n x 3 array of atom indices, with the apex
+            atom in the middle.
+        dihedrals (`np.ndarray`): An n x 4 array of atom indices.
+    """
+
+    @classmethod
+    def from_molecule(cls, molecule, scale=1.3, linear_angle=175.):
+        """Build internal coordinates from the connectivity of a molecule.
+
+        Two atoms are bonded if they are closer than `scale` times the sum of
+        their covalent radii.  Disconnected fragments are joined through their
+        closest pair of atoms.  Angles within `linear_angle` degrees are
+        dropped, along with any torsion built on them.
+
+        Args:
+            molecule: A Molecule object.
+            scale: The scale factor for the bonding criterion.
+            linear_angle: The angle, in degrees, above which a bend is treated
+                as linear.
+        """
+        molecule = molecule.copy()
+        molecule.set_units("bohr")
+        coordinates = molecule.coordinates
+        radii = np.array([atomdata.get_covalent_radius(label)
+                          for label in molecule.labels])
+        radii /= physconst.bohr2angstrom
+        distances = np.linalg.norm(coordinates[:, None] - coordinates[None],
+                                   axis=2)
+        bonded = distances < scale * (radii[:, None] + radii[None, :])
+        np.fill_diagonal(bonded, False)
+        _connect_fragments(bonded, distances)
+        bonds = np.transpose(np.nonzero(np.triu(bonded)))
+        neighbors = [np.nonzero(row)[0] for row in bonded]
+        angles = []
+        for apex in range(molecule.natom):
+            for a, c in itertools.combinations(neighbors[apex], 2):
+                angles.append((a, apex, c))
+        angles = np.reshape(angles, (-1, 3)).astype(int)
+        max_angle = np.radians(linear_angle)
+        angles = angles[_get_angles(coordinates, angles) < max_angle]
+        bent = set(tuple(angle) for angle in angles)
+        bent.update(tuple(angle[::-1]) for angle in angles)
+        dihedrals = []
+        for b, c in bonds:
+            for a in neighbors[b]:
+                for d in neighbors[c]:
+                    if (len(set((a, b, c, d))) == 4 and (a, b, c) in bent and
+                            (b, c, d) in bent):
+                        dihedrals.append((a, b, c, d))
+        dihedrals = np.reshape(dihedrals, (-1, 4)).astype(int)
+        return cls(bonds, angles, dihedrals)
+
+    def __init__(self, bonds=(), angles=(), dihedrals=()):
+        self.bonds = np.reshape(bonds, (-1, 2)).astype(int)
+        self.angles = np.reshape(angles, (-1, 3)).astype(int)
+        self.dihedrals = np.reshape(dihedrals, (-1, 4)).astype(int)
+
+    def __len__(self):
+        return len(self.bonds) + len(self.angles) + len(self.dihedrals)
+
+    def get_values(self, coordinates):
+        """Evaluate the internal coordinates.
+
+        Args:
+            coordinates: An natom x 3 array of Cartesian coordinates.
+
+        Returns:
+            np.ndarray: The bond lengths, angles and dihedrals, in that order.
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        bonds = np.linalg.norm(coordinates[self.bonds[:, 0]] -
+                               coordinates[self.bonds[:, 1]], axis=1)
+        return np.concatenate([bonds, _get_angles(coordinates, self.angles),
+                               _get_dihedrals(coordinates, self.dihedrals)])
+
+    def get_b_matrix(self, coordinates):
+        """Build the Wilson B matrix.
+
+        Args:
+            coordinates: An natom x 3 array of Cartesian coordinates.
+
+        Returns:
+            np.ndarray: An n x 3N array of first derivatives of the internal
+                coordinates with respect to the Cartesian coordinates.
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        natom = len(coordinates)
+        nbond, nangle = len(self.bonds), len(self.angles)
+        b_matrix = np.zeros((len(self), natom, 3))
+        # Bond stretches.
+        rows = np.arange(nbond)
+        u = coordinates[self.bonds[:, 0]] - coordinates[self.bonds[:, 1]]
+        u /= np.linalg.norm(u, axis=1)[:, None]
+        np.add.at(b_matrix, (rows, self.bonds[:, 0]), u)
+        np.add.at(b_matrix, (rows, self.bonds[:, 1]), -u)
+        # Angle bends.
+        rows = nbond + np.arange(nangle)
+        a, b, c = self.angles.T
+        u = coordinates[a] - coordinates[b]
+        v = coordinates[c] - coordinates[b]
+        lu = np.linalg.norm(u, axis=1)[:, None]
+        lv = np.linalg.norm(v, axis=1)[:, None]
+        u, v = u / lu, v / lv
+        cos = np.sum(u * v, axis=1)[:, None]
+        sin = np.sqrt(1. - cos ** 2)
+        da = (cos * u - v) / (lu * sin)
+        dc = (cos * v - u) / (lv * sin)
+        np.add.at(b_matrix, (rows, a), da)
+        np.add.at(b_matrix, (rows, c), dc)
+        np.add.at(b_matrix, (rows, b), -da - dc)
+        # Torsions.
+        rows = nbond + nangle + np.arange(len(self.dihedrals))
+        a, b, c, d = self.dihedrals.T
+        f = coordinates[a] - coordinates[b]
+        g = coordinates[b] - coordinates[c]
+        h = coordinates[d] - coordinates[c]
+        fg = np.cross(f, g)
+        hg = np.cross(h, g)
+        lg = np.linalg.norm(g, axis=1)[:, None]
+        fg2 = np.sum(fg ** 2, axis=1)[:, None]
+        hg2 = np.sum(hg ** 2, axis=1)[:, None]
+        f_dot_g = np.sum(f * g, axis=1)[:, None]
+        h_dot_g = np.sum(h * g, axis=1)[:, None]
+        da = -lg / fg2 * fg
+        dd = lg / hg2 * hg
+        cross = f_dot_g / (fg2 * lg) * fg - h_dot_g / (hg2 * lg) * hg
+        np.add.at(b_matrix, (rows, a), da)
+        np.add.at(b_matrix, (rows, b), -da + cross)
+        np.add.at(b_matrix, (rows, c), -dd - cross)
+        np.add.at(b_matrix, (rows, d), dd)
+        return b_matrix.reshape(len(self), 3 * natom)
+
+    def get_difference(self, values1, values2):
+        """Subtract two sets of values, wrapping torsions into [-pi, pi).
+        """
+        difference = np.asarray(values1) - np.asarray(values2)
+        start = len(self.bonds) + len(self.angles)
+        difference[start:] = ((difference[start:] + np.pi) % (2. * np.pi) -
+                              np.pi)
+        return difference
+
+    def get_delocalized_coordinates(self, coordinates, tol=1e-6):
+        """Find the non-redundant combinations of the internal coordinates.
+
+        Diagonalizes `G = B.B^T` and keeps the eigenvectors with nonzero
+        eigenvalues.  For a connected, nonlinear molecule there are 3N - 6 of
+        them, none of which moves the molecule rigidly.
+
+        Args:
+            coordinates: An natom x 3 array of Cartesian coordinates.
+            tol: The threshold for a nonzero eigenvalue.
+
+        Returns:
+            np.ndarray: An n x k array whose columns define the k delocalized
+                internal coordinates.
+        """
+        b_matrix = self.get_b_matrix(coordinates)
+        values, vectors = np.linalg.eigh(np.dot(b_matrix, b_matrix.T))
+        return vectors[:, values > tol]
+
+    def to_cartesian(self, coordinates, target, basis=None, tol=1e-10,
+                     max_iter=50):
+        """Back-transform internal-coordinate values to Cartesians.
+
+        Iterates `x += B^+ . (q_target - q(x))` from a starting geometry, where
+        `B^+` is the generalized inverse of the B matrix, until the change in
+        the Cartesian coordinates drops below `tol`.
+
+        Args:
+            coordinates: An natom x 3 array of starting coordinates.
+            target: The target values, either of all internal coordinates or,
+                if `basis` is given, of the delocalized coordinates
+                `basis^T . q`.
+            basis: An optional n x k array of delocalized coordinates.
+            tol: The convergence threshold for the Cartesian step.
+            max_iter: The maximum number of iterations.
+
+        Returns:
+            np.ndarray: An natom x 3 array of coordinates.
+        """
+        if basis is None:
+            basis = np.eye(len(self))
+        x = np.array(coordinates, dtype=float).flatten()
+        reference = self.get_values(coordinates)
+        for iteration in range(max_iter):
+            values = self.get_values(x.reshape(-1, 3))
+            # Measure the torsions relative to the start so that none of them
+            # jumps by 2 pi during the iterations.
+            values = reference + self.get_difference(values, reference)
+            b_matrix = np.dot(basis.T, self.get_b_matrix(x.reshape(-1, 3)))
+            residual = np.asarray(target) - np.dot(basis.T, values)
+            step = np.dot(np.linalg.pinv(b_matrix, rcond=1e-8), residual)
+            x += step
+            if np.max(abs(step)) < tol:
+                return x.reshape(-1, 3)
+        raise RuntimeError("Back-transformation to Cartesian coordinates did "
+                           "not converge.")
+
+
+def _get_angles(coordinates, angles):
+    u = coordinates[angles[:, 0]] - coordinates[angles[:, 1]]
+    v = coordinates[angles[:, 2]] - coordinates[angles[:, 1]]
+    cos = (np.sum(u * v, axis=1) /
+           (np.linalg.norm(u, axis=1) * np.linalg.norm(v, axis=1)))
+    return np.arccos(np.clip(cos, -1., 1.))
+
+
+def _get_dihedrals(coordinates, dihedrals):
+    f = coordinates[dihedrals[:, 0]] - coordinates[dihedrals[:, 1]]
+    g = coordinates[dihedrals[:, 1]] - coordinates[dihedrals[:, 2]]
+    h = coordinates[dihedrals[:, 3]] - coordinates[dihedrals[:, 2]]
+    fg = np.cross(f, g)
+    hg = np.cross(h, g)
+    lg = np.linalg.norm(g, axis=1)
+    sin = np.sum(np.cross(hg, fg) * g, axis=1) / lg
+    cos = np.sum(fg * hg, axis=1)
+    return np.arctan2(sin, cos)
+
+
+def _connect_fragments(bonded, distances):
+    """Add bonds between the closest atoms of disconnected fragments.
+    """
+    natom = len(bonded)
+    while True:
+        fragment = {0}
+        frontier = [0]
+        while frontier:
+            atom = frontier.pop()
+            for other in np.nonzero(bonded[atom])[0]:
+                if other not in fragment:
+                    fragment.add(other)
+                    frontier.append(other)
+        if len(fragment) == natom:
+            return
+        inside = sorted(fragment)
+        outside = sorted(set(range(natom)) - fragment)
+        block = distances[np.ix_(inside, outside)]
+        i, j = np.unravel_index(np.argmin(block), block.shape)
+        bonded[inside[i], outside[j]] = bonded[outside[j], inside[i]] = True
@@ -5,6 +5,7 @@ from psi4 import core
 import numpy as np
 
 from .parse import CoordinateString
+from .symmetry import find_point_group
 from .util import atomdata, physconst
 
 
@@ -79,6 +80,46 @@ class Molecule(object):
         self.units = units
         self.coordinates = coordinates
 
+    def get_atom_indices(self, selection=None):
+        """Select atoms by index or by a predicate.
+
+        Args:
+            selection: None for all atoms, a sequence of atom indices, or a
+                callable taking a label and an array of coordinates and
+                returning True for the atoms to select.
+
+        Returns:
+            list: The selected atom indices, in increasing order.
+        """
+        if selection is None:
+            return list(range(self.natom))
+        if callable(selection):
+            return [index for index, (label, xyz) in enumerate(self)
+                    if selection(label, xyz)]
+        indices = sorted(set(int(index) for index in selection))
+        if indices and not 0 <= indices[0] <= indices[-1] < self.natom:
+            raise ValueError("Atom indices must lie between 0 and {:d}."
+                             .format(self.natom - 1))
+        return indices
+
+    def get_center_of_mass(self):
+        """Return the center of mass, in the units of `self.coordinates`.
+        """
+        masses = np.array(self.masses)
+        return np.dot(masses, self.coordinates) / np.sum(masses)
+
+    def get_point_group(self, tol=1e-3):
+        """Determine the point group of this molecule.
+
+        Args:
+            tol: The largest displacement, in the units of `self.coordinates`,
+                for which two atoms are considered to coincide.
+
+        Returns:
+            symmetry.PointGroup: The symmetry operations of the molecule.
+        """
+        return find_point_group(self, tol)
+
     def make_psi4_molecule_object(self):
         core.efp_init()
         mol_psi4 = core.Molecule.create_molecule_from_string(str(self))
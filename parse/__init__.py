@@ -1,2 +1,4 @@
+from .files import compress_file, file_exists, read_file, search_last
 from .rehelper import CoordinateFinder, EnergyFinder, GradientFinder
-from .stringtypes import CoordinateString, EnergyString, GradientString
+from .stringtypes import (CoordinateString, EnergyString, GradientString,
+                          extract_energy_from_file)
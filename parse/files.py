@@ -0,0 +1,208 @@
+"""Module for reading output files, including files packed in archives.
+
+Files may also be compressed with gzip, bzip2 or xz.  A compressed file is
+recognized by its extension or, failing that, by its magic bytes, and a
+path without the extension also finds it, so that 'output.dat' is read from
+'output.dat.gz' once that has replaced it.
+"""
+import bz2
+import codecs
+import gzip
+import io
+import lzma
+import os
+import re
+import shutil
+import threading
+import zipfile
+
+ARCHIVE_EXTENSIONS = (".zip",)
+COMPRESSORS = (
+    ("gz", b"\x1f\x8b", gzip.open),
+    ("bz2", b"BZh", bz2.open),
+    ("xz", b"\xfd7zXZ\x00", lzma.open),
+)
+COMPRESSED_EXTENSIONS = tuple("." + name for name, magic, opener
+                              in COMPRESSORS)
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def split_archive_path(path):
+    """Split a path into an archive and the name of a member inside it.
+
+    A path such as 'jobs/campaign.zip/disp3/output.dat' refers to the member
+    'disp3/output.dat' of the archive 'jobs/campaign.zip'.
+
+    Returns:
+        tuple: The path of the archive and the member name, or the path
+            itself and None if no part of it is an archive.
+    """
+    head, tail = os.path.normpath(path), []
+    while head and head != os.path.dirname(head):
+        if (head.endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(head) and
+                tail):
+            return head, "/".join(reversed(tail))
+        head, name = os.path.split(head)
+        tail.append(name)
+    return path, None
+
+
+def get_archive(archive_path):
+    """Return an open archive, reusing it until the file changes.
+
+    The index of an archive is read only once, however many of its members
+    are read, so reading every output of a campaign stays linear.
+    """
+    archive_path = os.path.abspath(archive_path)
+    status = os.stat(archive_path)
+    signature = (status.st_size, status.st_mtime_ns)
+    with _archives_lock:
+        cached = _archives.get(archive_path)
+        if cached is None or cached[0] != signature:
+            if cached is not None:
+                cached[1].close()
+            cached = (signature, zipfile.ZipFile(archive_path))
+            _archives[archive_path] = cached
+        return cached[1]
+
+
+def _is_file(path):
+    if os.path.isfile(path):
+        return True
+    archive_path, member = split_archive_path(path)
+    if member is None:
+        return False
+    return member in get_archive(archive_path).NameToInfo
+
+
+def find_file(path):
+    """Return the path of a file or of its compressed version.
+
+    Returns:
+        str: The path itself if it exists, on disk or inside an archive,
+            else the first existing path with a compressed extension added,
+            else None.
+    """
+    for candidate in (path,) + tuple(path + extension for extension
+                                     in COMPRESSED_EXTENSIONS):
+        if _is_file(candidate):
+            return candidate
+    return None
+
+
+def file_exists(path):
+    """Check whether a file, or its compressed version, exists.
+    """
+    return find_file(path) is not None
+
+
+def open_file(path):
+    """Open a file for reading bytes, decompressing it on the fly.
+
+    Args:
+        path: The path of the file.  Members of an archive are given as the
+            path of the archive followed by their name inside it.
+
+    Returns:
+        A binary file object.
+    """
+    found_path = find_file(path)
+    if found_path is None:
+        raise IOError("No such file: '{:s}'".format(path))
+    archive_path, member = split_archive_path(found_path)
+    if member is None:
+        with open(found_path, 'rb') as data_file:
+            header = data_file.read(8)
+        source = found_path
+    else:
+        # Members are held in memory, compressed, to be decompressed as
+        # they are read.
+        data = get_archive(archive_path).read(member)
+        header = data[:8]
+        source = io.BytesIO(data)
+    for name, magic, opener in COMPRESSORS:
+        if found_path.endswith("." + name) or header.startswith(magic):
+            return opener(source, 'rb')
+    return open(source, 'rb') if member is None else source
+
+
+def read_file(path):
+    """Read a text file, on disk or inside an archive, compressed or not.
+
+    Args:
+        path: The path of the file.  Members of an archive are given as the
+            path of the archive followed by their name inside it.
+
+    Returns:
+        str: The contents of the file.
+    """
+    with open_file(path) as data_file:
+        return data_file.read().decode()
+
+
+def search_last(pattern, path, flags=0, window=2 ** 20,
+                chunk_size=2 ** 20):
+    """Find the last match of a regex in a file, streaming it.
+
+    The file is decompressed and searched chunk by chunk, so that no more
+    than about `window` plus `chunk_size` characters are held at once.  A
+    match near the end of the text read so far is only accepted once enough
+    text follows it to be sure it is complete.
+
+    Args:
+        pattern: The regex.
+        path: The path of the file, as for `read_file`.
+        flags: The regex flags.
+        window: An upper bound on the length of a match.
+        chunk_size: The number of bytes read at once.
+
+    Returns:
+        The last match object, whose positions are relative to the window
+        of text it was found in, or None if there is no match.
+    """
+    regex = re.compile(pattern, flags)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors='replace')
+    last, text, skip = None, "", 0
+    with open_file(path) as data_file:
+        while True:
+            chunk = data_file.read(chunk_size)
+            text += decoder.decode(chunk, final=not chunk)
+            limit = len(text) - window if chunk else len(text)
+            for match in regex.finditer(text):
+                if match.start() < skip:
+                    continue
+                if match.start() >= limit:
+                    break
+                last, skip = match, match.end()
+            if not chunk:
+                return last
+            # Keep whole lines, so that anchors still match as in the file.
+            cut = text.rfind("\n", 0, max(skip, limit, 0)) + 1
+            text, skip = text[cut:], max(skip - cut, 0)
+
+
+def compress_file(path, compression="gz"):
+    """Replace a file with a compressed copy.
+
+    Args:
+        path: The path of the file.
+        compression: 'gz', 'bz2' or 'xz', also used as the extension.
+
+    Returns:
+        str: The path of the compressed file.
+    """
+    openers = {name: opener for name, magic, opener in COMPRESSORS}
+    if compression not in openers:
+        raise ValueError("'compression' must be one of {:s}."
+                         .format(", ".join(sorted(openers))))
+    compressed_path = path + "." + compression
+    temporary_path = compressed_path + ".tmp"
+    with open(path, 'rb') as source_file:
+        with openers[compression](temporary_path, 'wb') as target_file:
+            shutil.copyfileobj(source_file, target_file)
+    os.replace(temporary_path, compressed_path)
+    os.remove(path)
+    return compressed_path
+
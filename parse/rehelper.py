@@ -19,6 +19,15 @@ def two_or_more(string):
     return r'(?:{:s}){{2,}}'.format(string)
 
 
+def substitute(placeholder, subpattern, string):
+    """Replace a placeholder with a subpattern, taken literally.
+
+    Unlike `re.sub` with a string replacement, this leaves the backslashes
+    of the subpattern, such as the '\\d' of `float_`, as they are.
+    """
+    return re.sub(placeholder, lambda match: subpattern, string)
+
+
 def get_last_match(pattern, string, flags=0):
     match = None
     for match in re.finditer(pattern, string, flags):
@@ -46,7 +55,7 @@ class UnitsFinder(object):
     def get_units_pattern(self):
         """Return capturing units line regex.
         """
-        return re.sub('@Units', capture(word), self.pattern)
+        return substitute('@Units', capture(word), self.pattern)
 
 
 class CoordinateLineFinder(object):
@@ -70,28 +79,28 @@ class CoordinateLineFinder(object):
     def get_pattern(self):
         """Return non-capturing coordinate line regex.
         """
-        ret = re.sub('@Atom', atomic_symbol, self.pattern)
-        ret = re.sub('@.Coord', float_, ret)
+        ret = substitute('@Atom', atomic_symbol, self.pattern)
+        ret = substitute('@.Coord', float_, ret)
         return ret
 
     def get_label_pattern(self):
         """Return coordinate line regex capturing the atom label.
         """
-        ret = re.sub('@Atom', capture(atomic_symbol), self.pattern)
-        ret = re.sub('@.Coord', float_, ret)
+        ret = substitute('@Atom', capture(atomic_symbol), self.pattern)
+        ret = substitute('@.Coord', float_, ret)
         return ret
 
     def get_coordinates_pattern(self):
         """Return coordinate line regex capturing coordinates.
         """
-        ret = re.sub('@Atom', atomic_symbol, self.pattern)
-        ret = re.sub('@.Coord', capture(float_), ret)
+        ret = substitute('@Atom', atomic_symbol, self.pattern)
+        ret = substitute('@.Coord', capture(float_), ret)
         return ret
 
     def get_coordinates_inverse_pattern(self):
         """Return coordinate line regex capturing everything but the coordinates.
         """
-        ret = re.sub('@Atom', atomic_symbol, self.pattern)
+        ret = substitute('@Atom', atomic_symbol, self.pattern)
         parts = re.sub('.Coord', '', ret).split('@')
         ret = float_.join(capture(part) for part in parts)
         return ret
@@ -152,7 +161,7 @@ class EnergyFinder(object):
     def get_energy_patterns(self):
         """Return capturing energy regex patterns.
         """
-        return [re.sub('@Energy', capture(float_), pattern) for pattern in
+        return [substitute('@Energy', capture(float_), pattern) for pattern in
                 self.patterns]
 
 
@@ -176,13 +185,13 @@ class GradientLineFinder(object):
     def get_pattern(self):
         """Return non-capturing gradient line regex.
         """
-        ret = re.sub('@.Grad', float_, self.pattern)
+        ret = substitute('@.Grad', float_, self.pattern)
         return ret
 
     def get_gradient_pattern(self):
         """Return capturing gradient line regex.
         """
-        ret = re.sub('@.Grad', capture(float_), self.pattern)
+        ret = substitute('@.Grad', capture(float_), self.pattern)
         return ret
 
 
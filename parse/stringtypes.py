@@ -2,6 +2,7 @@
 """
 import re
 import numpy as np
+from . import files
 from . import rehelper
 
 
@@ -69,7 +70,7 @@ class CoordinateString(object):
         """
         pattern = self.coord_finder.line_finder.get_coordinates_pattern()
         coordinates = np.array(re.findall(pattern, self._body))
-        return coordinates.astype(np.float)
+        return coordinates.astype(float)
 
     def replace_coordinates_with_placeholder(self, placeholder):
         """Replace coordinates in the body with a placeholder.
@@ -112,6 +113,12 @@ class EnergyString(object):
             raise ValueError("The 'energy_finder' argument must be an instance"
                              "of the class rehelper.EnergyFinder.")
 
+    @classmethod
+    def from_file(cls, path, energy_finder, success_pattern=None):
+        """Read the string from a file, which may be compressed or archived.
+        """
+        return cls(files.read_file(path), energy_finder, success_pattern)
+
     def extract_energy(self):
         """Extract the energy from `string`.
     
@@ -166,12 +173,42 @@ class GradientString(object):
         self._body = self.string[start:end]
         self._footer = self.string[end:]
 
+    @classmethod
+    def from_file(cls, path, grad_finder):
+        """Read the string from a file, which may be compressed or archived.
+        """
+        return cls(files.read_file(path), grad_finder)
+
     def extract_gradient(self):
         """Extract the gradient from the body.
         """
         pattern = self.grad_finder.line_finder.get_gradient_pattern()
         gradient = np.array(re.findall(pattern, self._body))
-        return gradient.astype(np.float)
+        return gradient.astype(float)
+
+
+def extract_energy_from_file(path, energy_finder, window=2 ** 20):
+    """Extract the energy from a file without reading all of it at once.
+
+    Like EnergyString.extract_energy, except that the file is streamed
+    through `files.search_last`, decompressing it on the fly if needed.
+
+    Args:
+        path: The path of the output file.
+        energy_finder: A rehelper.EnergyFinder object.
+        window: An upper bound on the length of a match.
+
+    Returns:
+        float: The sum of the energies found in the file.
+    """
+    energies = []
+    for pattern in energy_finder.get_energy_patterns():
+        match = files.search_last(pattern, path, window=window)
+        if match is None:
+            raise ValueError("Couldn't find a match for the following "
+                             "energy pattern: {:s}".format(repr(pattern)))
+        energies.append(float(match.group(1)))
+    return sum(energies)
 
 
 if __name__ == "__main__":
@@ -1,46 +1,177 @@
+import functools
+import hashlib
 import os
+import re
 import shutil
+import time
+import numpy as np
 from . import parse
+from .engine import array
+from .engine.archive import ARCHIVE_NAME, JobArchive
+from .engine.bulk import make_directories, run_bulk, write_file
+from .engine.database import CampaignDatabase
+from .engine.pipeline import Pipeline
+from .engine.process import Cancellation, CancelledError, Process
+from .engine.results import SharedResults
+from .engine.retry import FAILURE_PATTERNS, join_patterns
+from .engine.scheduler import Resources, Task
+from .engine.staging import STAGING_DIR_NAME, Stager
+from .engine.store import JobStore
+from .engine.tuning import get_template_hash
+from .engine.watch import CompletionWatcher
 
 
 class Submitter(object):
-    """A class for executing the submission script.    
+    """A class for executing the submission script.
+
+    With a wall-time limit, a cancellation, an output monitor or a scratch
+    manager, the submit function runs in a child process that leads its own
+    session, so that a timeout, a fatal error or a cancellation kills every
+    program it started, including MPI and OpenMP helpers.  Any exception it
+    raises is re-raised in the parent with its original type, and its return
+    value must be picklable.  Otherwise, it is simply called in the submit
+    directory, so that it may use and change the state of this process, as
+    running Psi4 through its Python API does.
+
+    Attributes:
+        submit_function: A callable executed in the submit directory.
+        submit_dir_abs_path: The absolute path of the submit directory.
+        timeout: The wall-time limit in seconds, or None.
+        cancellation: An engine.Cancellation object, or None.
+        monitor: An engine.OutputMonitor object, or None.
+        scratch: An engine.ScratchManager object giving the submission its
+            own scratch directory, or None.
     """
 
-    def __init__(self, submit_function, submit_dir_path):
+    def __init__(self, submit_function, submit_dir_path, timeout=None,
+                 cancellation=None, monitor=None, scratch=None):
         self.submit_function = submit_function
         self.submit_dir_abs_path = os.path.abspath(submit_dir_path)
+        self.timeout = timeout
+        self.cancellation = cancellation
+        self.monitor = monitor
+        self.scratch = scratch
         if not callable(self.submit_function):
             raise ValueError("This class requires a callable submit function.")
 
-    def submit(self):
+    def start(self, cancellation=None):
+        """Start the submit function without waiting for it.
+
+        Args:
+            cancellation: An engine.Cancellation object the process is
+                registered with besides `self.cancellation`, or None.
+
+        Returns:
+            An engine.Process object, which can be polled, waited on or
+            killed.
+        """
+        cancellations = self._get_cancellations(cancellation)
+        for cancellation in cancellations:
+            cancellation.check()
+        environ = None
+        if self.scratch is not None:
+            if not self.scratch.has_space():
+                raise RuntimeError("Not enough free scratch space to start "
+                                   "the job in {:s}."
+                                   .format(self.submit_dir_abs_path))
+            environ = self.scratch.allocate(self.submit_dir_abs_path)
+        process = Process(self.submit_function, self.submit_dir_abs_path,
+                          environ)
+        for cancellation in cancellations:
+            cancellation.register(process)
+        return process
+
+    def _get_cancellations(self, cancellation=None):
+        return [other for other in (self.cancellation, cancellation)
+                if other is not None]
+
+    def submit(self, isolate=False, cancellation=None):
         """Executes the submit function in the requested directory.
-        
+
+        Args:
+            isolate: Whether to run the submit function in a child process
+                even if nothing requires it, e.g. because several
+                submissions run at once from different threads.
+            cancellation: An engine.Cancellation object that can also kill
+                the child process, e.g. one for a single pipelined run.
+
         Returns:
             The output of the submit function.
         """
-        original_working_directory = os.getcwd()
-        os.chdir(self.submit_dir_abs_path)
-        submit_function_output = self.submit_function()
-        os.chdir(original_working_directory)
-        return submit_function_output
+        cancellations = self._get_cancellations(cancellation)
+        if not (isolate or self.timeout is not None or cancellations or
+                self.monitor is not None or self.scratch is not None):
+            original_working_directory = os.getcwd()
+            os.chdir(self.submit_dir_abs_path)
+            try:
+                return self.submit_function()
+            finally:
+                os.chdir(original_working_directory)
+        process = self.start(cancellation)
+        error = None
+        try:
+            while not process.poll():
+                step = None if self.monitor is None else self.monitor.interval
+                if self.timeout is not None:
+                    remaining = process.start_time + self.timeout - time.time()
+                    if remaining <= 0.:
+                        error = ("The job in {:s} exceeded its wall-time "
+                                 "limit of {:g} s.".format(
+                                     self.submit_dir_abs_path, self.timeout))
+                        break
+                    step = remaining if step is None else min(step, remaining)
+                if process.wait(step):
+                    break
+                if self.monitor is not None:
+                    match = self.monitor.check(self.submit_dir_abs_path)
+                    if match is not None:
+                        error = ("The job in {:s} failed with a fatal error: "
+                                 "{:s}".format(self.submit_dir_abs_path,
+                                               match))
+                        break
+            if error is not None:
+                process.kill()
+                process.wait()
+        finally:
+            for cancellation in cancellations:
+                cancellation.unregister(process)
+            if self.monitor is not None:
+                self.monitor.forget(self.submit_dir_abs_path)
+        for cancellation in cancellations:
+            cancellation.check()
+        if error is not None:
+            raise RuntimeError(error)
+        if isinstance(process.result, BaseException):
+            raise process.result
+        return process.result
 
 
 class Job(object):
     """Framework for an individual computation.
+
+    A Job is a cheap descriptor until it is sown.  The input is rendered, and
+    the job directory created, only when the input is written, and the
+    rendered string is released right afterwards.
     
     Attributes:
-        input_str: A string holding the contents of the job-input file.
+        molecule: The Molecule object placed in the input file.
+        input_template: The InputTemplate object defining the input file.
+        job_dir_path: The absolute path of the job directory.
         input_path: The absolute path of the job-input file.
         output_path: The absolute path of the job-output file.
+        job_file_paths: The absolute paths of the auxiliary job files.
+        stager: An engine.Stager object placing the auxiliary job files, or
+            None to copy them.
+        archive: An engine.JobArchive object the job's files are read from
+            once its directory has been packed, or None.
+        store: An engine.JobStore object in which the job directory is
+            placed by the hash of the job, or None.
     """
 
     def __init__(self, molecule, input_template, input_name, output_name,
-                 job_dir_path, job_file_paths):
+                 job_dir_path, job_file_paths, stager=None, archive=None,
+                 store=None):
         """Initialize Job object.
-       
-        In addition to setting the object's attributes, this creates the job
-        directory and copies the auxiliary job files into it.
         
         Args:
             molecule: A Molecule object to be placed in the input file.
@@ -50,26 +181,98 @@ class Job(object):
             job_dir_path: The path to the job directory.
             job_file_paths: Paths to additional job files, which will be copied
                 into the job directory.
+            stager: An optional engine.Stager object, which links the job
+                files into the job directory instead.
+            archive: An optional engine.JobArchive object holding the job's
+                files once packed.
+            store: An optional engine.JobStore object.  If given, the job
+                directory is made a link to the store directory of the job
+                when the input is written, and an input already in the store
+                is left untouched.
         """
-        self.input_str = input_template.fill(molecule)
-        # Create the job directory, unless it already exists
+        self.molecule = molecule
+        self.input_template = input_template
         job_dir_abs_path = os.path.abspath(job_dir_path)
-        if not os.path.exists(job_dir_abs_path):
-            os.makedirs(job_dir_abs_path)
+        self.job_dir_path = job_dir_abs_path
         self.input_path = os.path.join(job_dir_abs_path, input_name)
         self.output_path = os.path.join(job_dir_abs_path, output_name)
-        # Copy the job files into the job directory
-        if job_file_paths is not None:
-            for file_path in job_file_paths:
-                file_abs_path = os.path.abspath(file_path)
-                shutil.copy(file_abs_path, job_dir_abs_path)
+        self.job_file_paths = [os.path.abspath(file_path) for file_path
+                               in (job_file_paths or ())]
+        self.stager = stager
+        self.archive = archive
+        self.store = store
+        self._input_str = None
+
+    @property
+    def input_str(self):
+        """The contents of the job-input file.
+
+        Before the input is written, it is rendered from the template on
+        every access; afterwards, it is read back from the file.  Assigning a
+        string replaces it until the input is next written.
+        """
+        if self._input_str is not None:
+            return self._input_str
+        input_path = self.locate(self.input_path)
+        if parse.file_exists(input_path):
+            return parse.read_file(input_path)
+        return self.input_template.fill(self.molecule)
+
+    @input_str.setter
+    def input_str(self, input_str):
+        self._input_str = input_str
 
-    def write_input(self):
-        """Write the job input file.
+    def locate(self, path):
+        """Return the path of a job file, inside the archive once packed.
         """
-        input_file = open(self.input_path, 'w')
-        input_file.write(self.input_str)
-        input_file.close()
+        if self.archive is None or parse.file_exists(path):
+            return path
+        archived_path = self.archive.get_path(path)
+        return archived_path if parse.file_exists(archived_path) else path
+
+    def prepare(self):
+        """Create the job directory and copy the auxiliary job files into it.
+        """
+        if not os.path.exists(self.job_dir_path):
+            os.makedirs(self.job_dir_path)
+        for file_path in self.job_file_paths:
+            if self.stager is None:
+                shutil.copy(file_path, self.job_dir_path)
+            else:
+                self.stager.place(file_path, self.job_dir_path)
+
+    def write_input(self, durability="none"):
+        """Write the job input file, preparing the job directory first.
+
+        Args:
+            durability: The engine.bulk durability policy of the input file.
+        """
+        input_str = (self.input_template.fill(self.molecule)
+                     if self._input_str is None else self._input_str)
+        if self.store is not None:
+            self.store.link(self.job_dir_path, self.store.get_key(
+                input_str, self.job_file_paths))
+            if os.path.exists(self.input_path):
+                # The store directory already holds this very input, which
+                # another campaign may be running.
+                self._input_str = None
+                return
+        self.prepare()
+        write_file(self.input_path, input_str, durability)
+        self._input_str = None
+
+    def get_key(self):
+        """Identify what the job computes, without rendering its input.
+
+        Returns:
+            str: A hex digest of the template, the atoms and the geometry.
+        """
+        key = hashlib.sha256(get_template_hash(self.input_template).encode())
+        key.update(" ".join(self.molecule.labels).encode())
+        key.update(str(self.molecule.units).encode())
+        key.update(np.ascontiguousarray(self.molecule.coordinates,
+                                        dtype=float).tobytes())
+        return key.hexdigest()
 
     def read_output(self):
         """Read the job output file
@@ -77,7 +280,52 @@ class Job(object):
         Returns:
             str: The contents of the output file.
         """
-        return open(self.output_path).read()
+        return parse.read_file(self.locate(self.output_path))
+
+    def get_state(self, success_pattern):
+        """Determine how far this job has progressed.
+
+        Args:
+            success_pattern: A regex that matches the output only if the job
+                ran successfully.
+
+        Returns:
+            str: 'pending' if the input hasn't been written, 'sown' if there is
+                no output yet, 'incomplete' if the output doesn't match
+                `success_pattern`, and 'done' otherwise.
+        """
+        if not parse.file_exists(self.locate(self.input_path)):
+            return 'pending'
+        if not parse.file_exists(self.locate(self.output_path)):
+            return 'sown'
+        if not re.search(success_pattern, self.read_output()):
+            return 'incomplete'
+        return 'done'
+
+
+def extract_value(output_str, finder, success_pattern):
+    """Extract a result from the contents of an output file.
+
+    Args:
+        output_str: The contents of the output file.
+        finder: A parse.EnergyFinder or parse.GradientFinder object, or a
+            callable that takes `output_str` and returns the result.
+        success_pattern: A regex that matches the output only if the job ran
+            successfully.
+
+    Returns:
+        The energy, the gradient array, or the output of `finder`.
+    """
+    if not re.search(success_pattern, output_str):
+        raise RuntimeError("Success pattern not found in output.")
+    if isinstance(finder, parse.EnergyFinder):
+        return parse.EnergyString(output_str, finder).extract_energy()
+    elif isinstance(finder, parse.GradientFinder):
+        return parse.GradientString(output_str, finder).extract_gradient()
+    elif callable(finder):
+        return finder(output_str)
+    raise ValueError("'finder' must be a parse.EnergyFinder, a "
+                     "parse.GradientFinder, or a callable.")
 
 
 class EnergyRoutine(object):
@@ -122,6 +370,671 @@ class EnergyRoutine(object):
         return self.energy
 
 
+class DisplacementRoutine(object):
+    """Computes a property at every geometry of a displacement set.
+
+    Each displacement gets its own job directory, named by replacing the
+    placeholder '@Disp' in `disp_dir` with the displacement number.
+
+    With batch submission, the submit function is instead executed only once,
+    in `job_dir_path`, after a task map file listing the job directories has
+    been written there.  This allows a single array job to cover the whole
+    set of displacements.
+
+    Once reaped, the job directories can be packed into the archive
+    'jobs.zip' in `job_dir_path`, from which the inputs and outputs are then
+    read in place.
+    """
+
+    def __init__(self, displacements, input_template, finder, success_pattern,
+                 submit_function, input_name="input.dat",
+                 output_name="output.dat", job_dir_path=os.getcwd(),
+                 job_file_paths=None, disp_dir="@Disp",
+                 batch_submission=False, task_map_name=array.TASK_MAP_NAME,
+                 scheduler=None, timeout=None, cancellation=None,
+                 retry=None, monitor=None, staging=None, scratch=None,
+                 compression=None, store=None, database=None,
+                 result_shape=None):
+        """Initialize DisplacementRoutine object.
+
+        Args:
+            displacements: A findif.DisplacementSet object.
+            input_template: An InputTemplate object defining the input file.
+            finder: A parse.EnergyFinder or parse.GradientFinder object, or a
+                callable taking the output string, to extract each result.
+            success_pattern: A regex that matches the output only if the job
+                ran successfully.
+            submit_function: A callable executed in each job directory.
+            input_name: The name of the input file.
+            output_name: The name of the output file.
+            job_dir_path: The path to the directory holding the job
+                directories.
+            job_file_paths: Paths to additional job files, which will be
+                copied into each job directory.
+            disp_dir: The naming scheme of the job directories.
+            batch_submission: Whether to execute `submit_function` once for
+                all jobs instead of once per job.
+            task_map_name: The name of the task map file written for batch
+                submission.
+            scheduler: An optional engine.LocalScheduler object.  If given,
+                the jobs are run through it concurrently, each requesting the
+                memory given in its input file.
+            timeout: The wall-time limit of each submission, in seconds.
+            cancellation: An engine.Cancellation object for cancelling the
+                submissions.
+            retry: An optional engine.RetryManager object.  If given, failed
+                jobs are recorded and rerun according to its policies instead
+                of aborting the routine.
+            monitor: An optional engine.OutputMonitor object that kills jobs
+                as soon as a fatal error appears in their output.
+            staging: How to place the job files in the job directories:
+                'hardlink', 'symlink', 'reflink' or 'copy' from a single
+                staged copy in the 'staged' subdirectory of `job_dir_path`,
+                or an engine.Stager object.  By default, each job gets its
+                own copy.
+            scratch: An optional engine.ScratchManager object giving each
+                job its own scratch directory, which is deleted once the
+                job's result has been extracted.
+            compression: 'gz', 'bz2' or 'xz' to compress each output as soon
+                as its result has been extracted, or None to leave it.
+            store: The path of a directory of content-addressed job
+                directories, or an engine.JobStore object.  If given, each
+                job directory links to the store directory named by the hash
+                of its input and job files, and jobs whose store directory
+                already holds a successful output aren't run again.
+            database: The path of a campaign database, or an
+                engine.CampaignDatabase object, in which the state, attempts,
+                timings and result of each job are recorded.
+            result_shape: The shape of each result, e.g. () for energies or
+                (atoms, 3) for gradients.  If given, the scheduler's worker
+                processes parse their own outputs and write the results into
+                an engine.SharedResults array instead of the parent parsing
+                them.  The array is destroyed once every job is reaped, or
+                else when the routine is discarded or the process exits.
+        """
+        if "@Disp" not in disp_dir:
+            raise ValueError("'disp_dir' must contain the placeholder @Disp.")
+        if batch_submission and scheduler is not None:
+            raise ValueError("Batch submission can't be combined with a "
+                             "scheduler.")
+        self.displacements = displacements
+        self.input_template = input_template
+        self.finder = finder
+        self.success_pattern = success_pattern
+        if isinstance(staging, str):
+            staging = Stager(os.path.join(job_dir_path, STAGING_DIR_NAME),
+                             staging)
+        self.stager = staging
+        self.archive = JobArchive(os.path.join(job_dir_path, ARCHIVE_NAME))
+        if isinstance(store, str):
+            store = JobStore(store)
+        self.store = store
+        self.jobs = []
+        self.submitters = []
+        for index, molecule in enumerate(displacements):
+            disp_dir_path = os.path.join(job_dir_path,
+                                         disp_dir.replace("@Disp", str(index)))
+            self.jobs.append(Job(molecule, input_template, input_name,
+                                 output_name, disp_dir_path, job_file_paths,
+                                 staging, self.archive, store))
+            self.submitters.append(Submitter(submit_function, disp_dir_path,
+                                             timeout, cancellation, monitor,
+                                             scratch))
+        self.submit_function = submit_function
+        self.scheduler = scheduler
+        self.retry = retry
+        self.scratch = scratch
+        self.compression = compression
+        if isinstance(database, str):
+            database = CampaignDatabase(database)
+        self.database = database
+        if self.database is not None:
+            self.database.add_jobs([job.job_dir_path for job in self.jobs],
+                                   [job.get_key() for job in self.jobs])
+        self.result_shape = result_shape
+        self.shared_results = None
+        self.errors = {}
+        self._ended = set()
+        self._queued = set()
+        self.batch_submission = batch_submission
+        self.task_map_path = os.path.join(os.path.abspath(job_dir_path),
+                                          task_map_name)
+        if self.batch_submission:
+            self.submitters = [Submitter(submit_function, job_dir_path,
+                                         timeout, cancellation)]
+        self.values = None
+
+    def sow(self, workers=1, durability="none"):
+        """Write the inputs of all jobs.
+
+        The job directories are all created first, and the inputs are then
+        written by a pool of threads, which hides the latency of network
+        file systems.
+
+        Args:
+            workers: The number of threads writing inputs.
+            durability: How hard the inputs are pushed to stable storage:
+                'none', 'file', 'directory' or 'batch', as in engine.bulk.
+        """
+        self.values = None
+        self.errors = {}
+        if self.shared_results is not None:
+            self.shared_results.clear()
+        make_directories([job.job_dir_path for job in self.jobs
+                          if job.store is None])
+        run_bulk(lambda index: self._sow_job(index, durability),
+                 range(len(self.jobs)), workers, durability)
+        if self.database is not None:
+            self.database.flush()
+        if self.batch_submission:
+            array.write_task_map(self.task_map_path,
+                                 [job.job_dir_path for job in self.jobs])
+
+    def run(self, indices=None):
+        """Run the jobs.
+
+        With a store, each job is only run while holding the claim on its
+        store directory.  The jobs claimed by another campaign are run last,
+        one by one, once that campaign releases them, and only if it didn't
+        leave a successful output.  With batch submission, the claims are
+        held only while the submit function runs.
+
+        Args:
+            indices: The displacement numbers of the jobs to run, by default
+                all of them.
+        """
+        if indices is None:
+            indices = range(len(self.jobs))
+        indices = [index for index in indices if not self._is_stored(index)]
+        if not indices:
+            return
+        for index in indices:
+            self.errors.pop(index, None)
+            self._ended.discard(index)
+            self._queued.discard(index)
+        if (self.scheduler is not None and self.result_shape is not None and
+                self.shared_results is None):
+            self.shared_results = SharedResults(len(self.jobs),
+                                                self.result_shape)
+        if self.store is None:
+            self._run(indices)
+            return
+        claims = {}
+        try:
+            for index in indices:
+                claim = self.store.claim(self.jobs[index].job_dir_path)
+                if claim is not None:
+                    claims[index] = claim
+            # Another campaign may have finished a job before it was claimed.
+            self._run([index for index in sorted(claims)
+                       if not self._is_stored(index)])
+        finally:
+            for claim in claims.values():
+                self.store.release(claim)
+        for index in indices:
+            if index not in claims:
+                self._run_claimed(index, self._run, [index])
+
+    def _run(self, indices):
+        if not indices:
+            return
+        try:
+            self._submit(indices)
+        finally:
+            if self.database is not None:
+                self.database.flush()
+
+    def _run_claimed(self, index, function, *args):
+        """Wait for the claim on a job's store directory, then run it.
+
+        The job is skipped if the previous holder of the claim left a
+        successful output.
+        """
+        claim = self.store.claim(self.jobs[index].job_dir_path, block=True)
+        try:
+            if not self._is_stored(index):
+                function(*args)
+        finally:
+            self.store.release(claim)
+
+    def _submit(self, indices):
+        if self.scheduler is not None:
+            tasks = self.get_tasks()
+            self._record(indices, 'running', attempt=True,
+                         start_time=time.time())
+            for position, result in self.scheduler.iter_run(
+                    [tasks[index] for index in indices]):
+                self._record_end([indices[position]], result)
+                if isinstance(result, BaseException):
+                    # Kept so that the failure is classified by it.
+                    self.errors[indices[position]] = result
+            return
+        if self.batch_submission:
+            array.write_task_map(self.task_map_path,
+                                 [self.jobs[index].job_dir_path
+                                  for index in indices])
+            submitters = [(indices, self.submitters[0])]
+        else:
+            submitters = [([index], self.submitters[index])
+                          for index in indices]
+        for submitted, submitter in submitters:
+            self._record(submitted, 'running', attempt=True,
+                         start_time=time.time())
+            try:
+                result = submitter.submit()
+            except BaseException as error:
+                self._record_end(submitted, error)
+                # A job that timed out or crashed fails at reap time, which
+                # is where the retry policies are applied.
+                if (self.retry is None or not isinstance(error, Exception) or
+                        isinstance(error, CancelledError)):
+                    raise
+                for index in submitted:
+                    self.errors[index] = error
+                continue
+            if not self.batch_submission:
+                self._record_end(submitted, result)
+            elif isinstance(result, dict):
+                self._check_tasks(submitted, result)
+            else:
+                # The submit function only queued an array job, e.g. with
+                # sbatch, so the jobs stay running until their outputs
+                # are reaped.
+                self._queued.update(submitted)
+
+    def _check_tasks(self, indices, results):
+        """Record which array tasks have ended, and which of them raised.
+
+        Args:
+            indices: The displacement numbers of the jobs, in task order.
+            results: Maps task IDs to the result of each task, as returned
+                by an engine.LocalArrayScheduler.
+        """
+        self._ended.update(indices[task_id - 1] for task_id in results)
+        for task_id, result in sorted(results.items()):
+            self._record_end([indices[task_id - 1]], result)
+        failed = sorted((indices[task_id - 1], result)
+                        for task_id, result in results.items()
+                        if isinstance(result, BaseException))
+        for index, error in failed:
+            self.errors[index] = error
+        if failed and self.retry is None:
+            raise failed[0][1]
+
+    def get_tasks(self):
+        """Describe each job as a scheduler task.
+
+        The tasks are keyed by the template hash, and the reference geometry
+        is distinguished from the displaced ones, for the timing history.
+        With shared results, each task also parses its job's output.
+
+        Returns:
+            list: An engine.Task object for each job.
+        """
+        key = get_template_hash(self.input_template)
+        functions = [self.submit_function] * len(self.jobs)
+        if self.shared_results is not None:
+            functions = [functools.partial(self._run_and_share, index)
+                         for index in range(len(self.jobs))]
+        return [Task(function, job.job_dir_path,
+                     Resources.from_input(job.input_str), key,
+                     'reference' if label == () else 'displacement',
+                     self.scratch)
+                for function, label, job in zip(
+                    functions, self.displacements.labels, self.jobs)]
+
+    def _run_and_share(self, index):
+        """Run a job and write its result into the shared results.
+
+        This runs in the worker process, in the job directory or, for a
+        duplicate of a straggler, in a copy of it, so the output is read
+        from the working directory.
+        """
+        self.submit_function()
+        output_path = os.path.join(
+            os.getcwd(), os.path.basename(self.jobs[index].output_path))
+        self.shared_results.set(index, extract_value(
+            parse.read_file(output_path), self.finder, self.success_pattern))
+
+    def get_states(self):
+        """Check the progress of every job in a single pass.
+
+        Returns:
+            list: The Job.get_state value of each job, by displacement number.
+        """
+        return [job.get_state(self.success_pattern) for job in self.jobs]
+
+    def is_complete(self):
+        return all(state == 'done' for state in self.get_states())
+
+    def reap(self):
+        """Extract the result of every job that hasn't been reaped yet.
+
+        With a retry manager, jobs that fail are left unreaped and their
+        errors are stored in `errors`, by displacement number.  Otherwise the
+        first failure is raised.
+        """
+        try:
+            for index in self.get_unreaped():
+                try:
+                    self.reap_job(index)
+                except Exception as error:
+                    self._record([index], 'failed', error=str(error))
+                    self._release_scratch(index)
+                    if self.retry is None:
+                        raise
+                    # The error of a task that ended without an output says
+                    # more than the missing output does.
+                    self.errors.setdefault(index, error)
+            if self.shared_results is not None and not self.get_unreaped():
+                self.shared_results.unlink()
+                self.shared_results = None
+        finally:
+            if self.database is not None:
+                self.database.flush()
+
+    def get_unreaped(self):
+        """Return the displacement numbers of the jobs without a result.
+        """
+        return [index for index in range(len(self.jobs))
+                if self.values is None or self.values[index] is None]
+
+    def reap_job(self, index):
+        """Extract the result of a single job.
+
+        Args:
+            index: The displacement number of the job.
+        """
+        if self.values is None:
+            self.values = [None] * len(self.jobs)
+        value = None
+        if self.shared_results is not None:
+            value = self.shared_results.get(index)
+        if value is None:
+            value = extract_value(self.jobs[index].read_output(),
+                                  self.finder, self.success_pattern)
+        self.values[index] = value
+        self.errors.pop(index, None)
+        values = {}
+        if index in self._queued:
+            # The end of a queued job is first seen here.
+            self._queued.discard(index)
+            values['end_time'] = time.time()
+        self._record([index], 'done', result=self.values[index], error=None,
+                     **values)
+        self._clean_up(index)
+
+    def pack(self, remove=True):
+        """Pack the inputs and outputs of the reaped jobs into the archive.
+
+        Args:
+            remove: Whether to remove the job directories once packed.
+        """
+        unreaped = set(self.get_unreaped())
+        jobs = [job for index, job in enumerate(self.jobs)
+                if index not in unreaped and
+                os.path.isdir(job.job_dir_path)]
+        if not jobs:
+            return
+        output_name = os.path.basename(jobs[0].output_path)
+        self.archive.pack([job.job_dir_path for job in jobs],
+                          [os.path.basename(jobs[0].input_path), output_name] +
+                          [output_name + extension for extension
+                           in parse.files.COMPRESSED_EXTENSIONS], remove)
+
+    def wait(self, timeout=None, indices=None, **kwargs):
+        """Wait for the jobs to finish, reaping each one as it completes.
+
+        This is for submit functions that return before the jobs are done,
+        such as those handing an array job to a queueing system.
+
+        Args:
+            timeout: The longest time to wait, in seconds, or None to wait
+                indefinitely.
+            indices: The displacement numbers of the jobs to wait for, by
+                default all unreaped jobs.  Jobs whose task is known to have
+                failed, and so will never write an output, are skipped, and
+                those whose task ended without an output fail.
+            **kwargs: Options passed on to the CompletionWatcher.
+
+        Returns:
+            bool: Whether every job completed.
+        """
+        pending = [index for index in (self.get_unreaped() if indices is None
+                                       else indices)
+                   if index not in self.errors]
+        patterns = (FAILURE_PATTERNS if self.retry is None
+                    else self.retry.patterns)
+        kwargs.setdefault("failure_pattern", join_patterns(patterns))
+        kwargs.setdefault("exited",
+                          lambda position: pending[position] in self._ended)
+        watcher = CompletionWatcher(
+            [self.jobs[index].output_path for index in pending],
+            self.success_pattern,
+            callback=lambda position: self._reap_finished(pending[position]),
+            **kwargs)
+        return watcher.wait(timeout)
+
+    def _reap_finished(self, index):
+        try:
+            self.reap_job(index)
+        except Exception as error:
+            self._release_scratch(index)
+            if self.retry is None:
+                raise
+            self.errors[index] = error
+
+    def rerun_failures(self):
+        """Rerun failed jobs according to the retry policies.
+
+        Each failure is classified from the job output and its error, and
+        the job is rerun, possibly after modifying its input, waiting or,
+        with a scheduler, moving it to other cores, until it succeeds or its
+        policy gives up.  The jobs given up on are left without a value.
+
+        Returns:
+            dict: The engine.Failure object of each job given up on, by
+                displacement number.
+        """
+        if self.retry is None:
+            raise RuntimeError("Rerunning failures requires a retry manager.")
+        given_up = set()
+        while True:
+            indices = []
+            delay = 0.
+            for index in self.get_unreaped():
+                if index in given_up:
+                    continue
+                job = self.jobs[index]
+                output_str = None
+                if os.path.exists(job.output_path):
+                    output_str = job.read_output()
+                policy = self.retry.record_failure(
+                    index, output_str, self.errors.get(index, ""))
+                if policy is None:
+                    given_up.add(index)
+                    self._release_scratch(index)
+                    continue
+                if policy.action == "relocate" and self.scheduler is not None:
+                    self.scheduler.avoid(job.job_dir_path)
+                job.input_str = policy.modify(job.input_str)
+                if os.path.exists(job.output_path):
+                    os.remove(job.output_path)
+                job.write_input()
+                indices.append(index)
+                delay = max(delay,
+                            policy.get_delay(self.retry.attempts[index]))
+            if not indices:
+                return {index: self.retry.failures[index]
+                        for index in sorted(given_up)}
+            time.sleep(delay)
+            self.run(indices)
+            if self.batch_submission:
+                self.wait(indices=indices)
+            self.reap()
+            for index in indices:
+                if self.values[index] is not None:
+                    self.retry.record_success(index)
+
+    def execute(self, reap_only=False, pipelined=False):
+        if pipelined and not reap_only:
+            for index, value in self.iter_execute():
+                pass
+            return
+        if not reap_only:
+            self.sow()
+            self.run()
+            if self.batch_submission:
+                self.wait()
+        self.reap()
+        if self.retry is not None:
+            self.rerun_failures()
+
+    def iter_execute(self, workers=1, buffer_size=None):
+        """Sow, run and reap the jobs as a pipeline.
+
+        Inputs are written, jobs run and outputs parsed in separate stages
+        joined by bounded queues, so that writing the next inputs and parsing
+        finished outputs overlap with running jobs.
+
+        Args:
+            workers: The number of jobs run at once.
+            buffer_size: The capacity of each queue between the stages.
+
+        Yields:
+            tuple: The displacement number and value of each job, as soon as
+                it is reaped.
+        """
+        if self.batch_submission or self.scheduler is not None:
+            raise ValueError("Pipelined execution runs each job through its "
+                             "own submitter.")
+        self.values = [None] * len(self.jobs)
+        self.errors = {}
+        # If the routine stops early, the jobs still running are killed.
+        cancellation = Cancellation()
+        pipeline = Pipeline([self._sow_job,
+                             functools.partial(self._run_job,
+                                               cancellation=cancellation),
+                             self._reap_job],
+                            [1, workers, 1], buffer_size, cancellation.cancel)
+        try:
+            for index, value in pipeline.iter_run(range(len(self.jobs))):
+                if isinstance(value, Exception):
+                    self._record([index], 'failed', error=str(value))
+                    self._release_scratch(index)
+                    if self.retry is None:
+                        raise value
+                    self.errors[index] = value
+                    continue
+                self.values[index] = value
+                yield index, value
+        finally:
+            if self.database is not None:
+                self.database.flush()
+        if self.retry is not None:
+            failed = sorted(self.errors)
+            self.rerun_failures()
+            for index in failed:
+                if self.values[index] is not None:
+                    yield index, self.values[index]
+
+    def _sow_job(self, index, durability="none"):
+        self.jobs[index].write_input(durability)
+        self._record([index], 'sown', sow_time=time.time())
+        return index
+
+    def _run_job(self, index, cancellation=None):
+        if self.store is None:
+            self._submit_job(index, cancellation)
+        else:
+            self._run_claimed(index, self._submit_job, index, cancellation)
+        return index
+
+    def _submit_job(self, index, cancellation=None):
+        self._record([index], 'running', attempt=True, start_time=time.time())
+        try:
+            # The other stages run in threads at the same time, so the
+            # submit function mustn't change the working directory.
+            result = self.submitters[index].submit(isolate=True,
+                                                   cancellation=cancellation)
+        except BaseException as error:
+            self._record_end([index], error)
+            raise
+        self._record_end([index], result)
+
+    def _is_stored(self, index):
+        """Check whether a job has a successful output from the store.
+        """
+        return (self.store is not None and
+                self.jobs[index].get_state(self.success_pattern) == 'done')
+
+    def _reap_job(self, index):
+        value = extract_value(self.jobs[index].read_output(), self.finder,
+                              self.success_pattern)
+        self._record([index], 'done', result=value, error=None)
+        self._clean_up(index)
+        return value
+
+    def _record(self, indices, state, **values):
+        """Record a change of state of jobs in the campaign database.
+        """
+        if self.database is None:
+            return
+        for index in indices:
+            self.database.record(index, state, **values)
+
+    def _record_end(self, indices, result):
+        """Record that jobs have ended, as 'failed' if the result is an error.
+        """
+        if isinstance(result, BaseException):
+            self._record(indices, 'failed', end_time=time.time(),
+                         error=str(result) or repr(result))
+        else:
+            self._record(indices, 'finished', end_time=time.time())
+
+    def restore(self):
+        """Take the results of the finished jobs from the campaign database.
+
+        This restarts a campaign without reading any job output.  Only the
+        results of the very same jobs are taken: rows left by jobs with
+        another directory, template or geometry were reset when the jobs
+        were added to the database.
+
+        Returns:
+            list: The displacement numbers of the jobs still without a
+                result.
+        """
+        if self.database is None:
+            raise RuntimeError("Restoring results requires a campaign "
+                               "database.")
+        if self.values is None:
+            self.values = [None] * len(self.jobs)
+        for index, value in self.database.get_results().items():
+            self.values[index] = (np.array(value) if isinstance(value, list)
+                                  else value)
+        return self.get_unreaped()
+
+    def _clean_up(self, index):
+        """Release the scratch and compress the output of a reaped job.
+        """
+        job = self.jobs[index]
+        self._release_scratch(index)
+        if self.compression is not None and os.path.isfile(job.output_path):
+            parse.compress_file(job.output_path, self.compression)
+
+    def _release_scratch(self, index):
+        """Delete the scratch directory of a job, reaped or failed.
+
+        A failed job is rerun with a fresh scratch directory, so its old
+        one would only fill up the scratch file system.
+        """
+        if self.scratch is not None:
+            self.scratch.release(self.jobs[index].job_dir_path)
+
+    def get_values(self):
+        return self.values
+
+
 if __name__ == "__main__":
     import py
     import numpy as np
@@ -0,0 +1,372 @@
+"""Module for detecting the point-group symmetry of a molecule.
+"""
+import itertools
+
+import numpy as np
+
+
+def find_point_group(molecule, tol=1e-3):
+    """Determine the point group of a molecule.
+
+    Candidate rotation axes and mirror-plane normals are generated from the
+    principal axes of inertia and from sets of symmetry-equivalent atoms.  Any
+    candidate operation that maps the molecule onto itself within `tol` is
+    kept, and the resulting set is closed under multiplication.
+
+    Args:
+        molecule: A Molecule object.
+        tol: The largest displacement, in the units of the molecule, for which
+            two atoms are considered to coincide.
+
+    Returns:
+        PointGroup: The point group of the molecule.
+    """
+    center = molecule.get_center_of_mass()
+    coordinates = molecule.coordinates - center
+    labels = np.array([label.upper() for label in molecule.labels])
+    rank = np.linalg.matrix_rank(coordinates, tol=tol)
+    # The axis of a linear molecule has rotations of every order, so only a
+    # finite subgroup is generated for it.
+    orders = (2, 4) if rank < 2 else range(2, 9)
+    operations = []
+    atom_maps = []
+
+    def try_operation(matrix):
+        atom_map = _match_atoms(matrix, coordinates, labels, tol)
+        if atom_map is not None and not _contains(operations, matrix):
+            operations.append(matrix)
+            atom_maps.append(atom_map)
+
+    try_operation(np.eye(3))
+    try_operation(-np.eye(3))
+    for axis in _get_candidate_axes(molecule, coordinates, labels, tol):
+        try_operation(_reflection(axis))
+        for order in orders:
+            rotation = _rotation(axis, 2. * np.pi / order)
+            try_operation(rotation)
+            try_operation(np.dot(_reflection(axis), rotation))
+    # Close the set under multiplication, in case a generator was missed.
+    while True:
+        stack = np.array(operations)
+        products = np.einsum('aij,bjk->abik', stack, stack).reshape(-1, 3, 3)
+        differences = abs(products[:, None] - stack[None, :])
+        missing = products[np.all(differences.max(axis=(2, 3)) > 1e-6,
+                                  axis=1)]
+        if not len(missing):
+            break
+        count = len(operations)
+        for product in missing:
+            try_operation(product)
+        if len(operations) == count:
+            break
+    name = None
+    if rank == 0:
+        name = 'kh'
+    elif rank == 1:
+        name = 'dinfh' if _contains(operations, -np.eye(3)) else 'cinfv'
+    return PointGroup(operations, atom_maps, center, tol, name)
+
+
+class PointGroup(object):
+    """The symmetry operations of a molecule.
+
+    Attributes:
+        name (str): The Schoenflies symbol of the group, e.g. 'c2v' or 'd6h'.
+            Linear molecules are reported as 'cinfv' or 'dinfh', with
+            `operations` holding a finite subgroup.
+        operations (`list` of `np.ndarray`s): 3 x 3 orthogonal matrices acting
+            on coordinates relative to `center`.
+        atom_maps (`list` of `np.ndarray`s): For each operation, an integer
+            array mapping each atom index to the index of its image.
+        center (`np.ndarray`): The center of mass, which every operation leaves
+            fixed.
+        tol (float): The tolerance used to detect the operations.
+    """
+
+    def __init__(self, operations, atom_maps, center, tol, name=None):
+        self.operations = [np.array(op) for op in operations]
+        self.atom_maps = [np.array(atom_map, dtype=int)
+                          for atom_map in atom_maps]
+        self.center = np.array(center)
+        self.tol = tol
+        self.name = _classify(self.operations) if name is None else name
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return "PointGroup({:s}, order={:d})".format(self.name, len(self))
+
+    def get_subgroup(self, atoms):
+        """Return the subgroup that maps a set of atoms onto itself.
+
+        Args:
+            atoms: A sequence of atom indices.
+
+        Returns:
+            PointGroup: The subgroup leaving `atoms` invariant as a set.
+        """
+        atoms = set(atoms)
+        keep = [index for index, atom_map in enumerate(self.atom_maps)
+                if set(atom_map[list(atoms)]) == atoms]
+        return PointGroup([self.operations[index] for index in keep],
+                          [self.atom_maps[index] for index in keep],
+                          self.center, self.tol)
+
+    def get_unique_atoms(self, atoms=None):
+        """Pick one representative atom from each set of equivalent atoms.
+
+        Args:
+            atoms: An optional sequence of atom indices to restrict to.  It
+                must be closed under the operations of this group.
+
+        Returns:
+            dict: Maps each representative to the indices of the atoms
+                equivalent to it, in increasing order.
+        """
+        if atoms is None:
+            atoms = range(len(self.atom_maps[0]))
+        orbits = {}
+        seen = set()
+        for atom in sorted(atoms):
+            if atom not in seen:
+                orbit = sorted(set(int(atom_map[atom])
+                                   for atom_map in self.atom_maps))
+                orbits[atom] = orbit
+                seen.update(orbit)
+        return orbits
+
+    def get_site_operations(self, atom):
+        """Return the operations that leave an atom in place.
+
+        Args:
+            atom: An atom index.
+
+        Returns:
+            list: The 3 x 3 matrices of the site-symmetry group of `atom`.
+        """
+        return [op for op, atom_map in zip(self.operations, self.atom_maps)
+                if atom_map[atom] == atom]
+
+    def get_mapping_operation(self, source, target):
+        """Find an operation carrying one atom onto another.
+
+        Args:
+            source: The index of the atom to be moved.
+            target: The index of the atom it should land on.
+
+        Returns:
+            np.ndarray: The 3 x 3 matrix of the operation.
+        """
+        for op, atom_map in zip(self.operations, self.atom_maps):
+            if atom_map[source] == target:
+                return op
+        raise ValueError("Atoms {:d} and {:d} are not symmetry-equivalent."
+                         .format(source, target))
+
+    def get_cartesian_operation(self, index):
+        """Build the 3N x 3N matrix of an operation acting on displacements.
+
+        Args:
+            index: The position of the operation in `self.operations`.
+
+        Returns:
+            np.ndarray: A permutation-and-rotation matrix `G` such that
+                `G.dot(v)` is the image of the flattened displacement `v`.
+        """
+        op = self.operations[index]
+        atom_map = self.atom_maps[index]
+        natom = len(atom_map)
+        matrix = np.zeros((natom, 3, natom, 3))
+        matrix[atom_map, :, np.arange(natom), :] = op
+        return matrix.reshape(3 * natom, 3 * natom)
+
+    def symmetrize_gradient(self, gradient):
+        """Average a gradient over the operations of the group.
+
+        Args:
+            gradient: An natom x 3 array.
+
+        Returns:
+            np.ndarray: The totally symmetric part of `gradient`.
+        """
+        gradient = np.asarray(gradient)
+        ret = np.zeros_like(gradient, dtype=float)
+        for op, atom_map in zip(self.operations, self.atom_maps):
+            ret[atom_map] += np.dot(gradient, op.T)
+        return ret / len(self)
+
+    def symmetrize_hessian(self, hessian):
+        """Average a Cartesian Hessian over the operations of the group.
+
+        Args:
+            hessian: A 3N x 3N array.
+
+        Returns:
+            np.ndarray: The totally symmetric part of `hessian`.
+        """
+        hessian = np.asarray(hessian)
+        ret = np.zeros_like(hessian, dtype=float)
+        for index in range(len(self)):
+            matrix = self.get_cartesian_operation(index)
+            ret += np.linalg.multi_dot([matrix, hessian, matrix.T])
+        return ret / len(self)
+
+
+def _match_atoms(matrix, coordinates, labels, tol):
+    """Return the atom map of an operation, or None if it isn't a symmetry.
+    """
+    images = np.dot(coordinates, matrix.T)
+    distances = np.linalg.norm(images[:, None, :] - coordinates[None, :, :],
+                               axis=2)
+    distances[labels[:, None] != labels[None, :]] = np.inf
+    atom_map = np.argmin(distances, axis=1)
+    if np.all(distances[np.arange(len(labels)), atom_map] < tol):
+        if len(set(atom_map)) == len(atom_map):
+            return atom_map
+    return None
+
+
+def _contains(operations, matrix):
+    return any(np.allclose(op, matrix, atol=1e-6) for op in operations)
+
+
+def _rotation(axis, angle):
+    x, y, z = axis
+    cross = np.array([[0., -z, y], [z, 0., -x], [-y, x, 0.]])
+    return (np.eye(3) + np.sin(angle) * cross +
+            (1. - np.cos(angle)) * np.dot(cross, cross))
+
+
+def _reflection(axis):
+    return np.eye(3) - 2. * np.outer(axis, axis)
+
+
+def _get_candidate_axes(molecule, coordinates, labels, tol):
+    """Generate unit vectors that may be rotation axes or plane normals.
+    """
+    masses = np.array(molecule.masses)
+    inertia = (np.sum(masses * np.sum(coordinates ** 2, axis=1)) * np.eye(3) -
+               np.einsum('a,ai,aj->ij', masses, coordinates, coordinates))
+    vectors = list(np.linalg.eigh(inertia)[1].T)
+    vectors.extend(coordinates)
+    # Group atoms into sets that could be symmetry-equivalent: same element,
+    # same distance from the center.
+    radii = np.linalg.norm(coordinates, axis=1)
+    sets = {}
+    for index, (label, radius) in enumerate(zip(labels, radii)):
+        key = (label, int(round(radius / (10. * tol))))
+        sets.setdefault(key, []).append(index)
+    sets = [indices for indices in sets.values() if len(indices) > 1]
+    for indices in sets:
+        for i, j in itertools.combinations(indices, 2):
+            vectors.append(coordinates[i] + coordinates[j])
+            vectors.append(coordinates[i] - coordinates[j])
+            vectors.append(np.cross(coordinates[i], coordinates[j]))
+    if sets:
+        # Normals of triangles within the smallest set catch C3 axes of cubic
+        # groups that don't pass through atoms or bond midpoints.
+        indices = min(sets, key=len)
+        for i, j, k in itertools.combinations(indices, 3):
+            vectors.append(np.cross(coordinates[j] - coordinates[i],
+                                    coordinates[k] - coordinates[i]))
+    axes = []
+    for vector in vectors:
+        norm = np.linalg.norm(vector)
+        if norm > tol:
+            axis = vector / norm
+            if not any(abs(np.dot(axis, other)) > 1. - 1e-6 for other in axes):
+                axes.append(axis)
+    return axes
+
+
+def _classify(operations):
+    """Determine the Schoenflies symbol from a list of operations.
+    """
+    proper_axes = {}
+    improper_axes = {}
+    mirrors = []
+    has_inversion = False
+    for op in operations:
+        trace = np.trace(op)
+        if np.allclose(op, np.eye(3), atol=1e-6):
+            continue
+        if np.allclose(op, -np.eye(3), atol=1e-6):
+            has_inversion = True
+        elif np.linalg.det(op) > 0.:
+            angle = np.arccos(np.clip((trace - 1.) / 2., -1., 1.))
+            _add_axis(proper_axes, _get_axis(op, 1.), 2. * np.pi / angle)
+        elif np.isclose(trace, 1., atol=1e-6):
+            mirrors.append(_get_axis(op, -1.))
+        else:
+            angle = np.arccos(np.clip((trace + 1.) / 2., -1., 1.))
+            _add_axis(improper_axes, _get_axis(op, -1.), 2. * np.pi / angle)
+    max_order = max(list(proper_axes.values()) + [1])
+    if max_order == 1:
+        if mirrors:
+            return 'cs'
+        return 'ci' if has_inversion else 'c1'
+    if sum(1 for order in proper_axes.values() if order % 3 == 0) > 1:
+        if max_order == 5:
+            return 'ih' if has_inversion else 'i'
+        if max_order == 4:
+            return 'oh' if has_inversion else 'o'
+        if has_inversion:
+            return 'th'
+        return 'td' if mirrors else 't'
+    # Prefer an axis that is also an S2n axis, which singles out the principal
+    # axis of D2d and S4.
+    candidates = [axis for axis, order in proper_axes.items()
+                  if order == max_order]
+    principal = max(candidates, key=lambda axis: _get_order(
+        improper_axes, axis) == 2 * max_order)
+    n_perp_c2 = sum(1 for axis, order in proper_axes.items()
+                    if order % 2 == 0 and abs(np.dot(axis, principal)) < 1e-6)
+    has_sigma_h = any(abs(np.dot(normal, principal)) > 1. - 1e-6
+                      for normal in mirrors)
+    has_sigma_v = any(abs(np.dot(normal, principal)) < 1e-6
+                      for normal in mirrors)
+    order = str(max_order)
+    if n_perp_c2 >= max_order:
+        if has_sigma_h:
+            return 'd' + order + 'h'
+        return 'd' + order + 'd' if has_sigma_v else 'd' + order
+    if has_sigma_h:
+        return 'c' + order + 'h'
+    if has_sigma_v:
+        return 'c' + order + 'v'
+    if _get_order(improper_axes, principal) == 2 * max_order:
+        return 's' + str(2 * max_order)
+    return 'c' + order
+
+
+def _get_axis(op, eigenvalue):
+    """Return the unit axis of an operation with the given eigenvalue.
+    """
+    values, vectors = np.linalg.eig(op)
+    axis = np.real(vectors[:, np.argmin(abs(values - eigenvalue))])
+    return axis / np.linalg.norm(axis)
+
+
+def _add_axis(axes, axis, order):
+    """Record the highest operation order found about an axis.
+
+    Powers of an n-fold operation have non-integer `order` values, so only
+    the integral ones are kept; the generator itself is always integral.
+    """
+    order = int(round(order)) if np.isclose(order, round(order)) else 1
+    for other in list(axes):
+        if abs(np.dot(axis, other)) > 1. - 1e-6:
+            axes[other] = max(axes[other], order)
+            return
+    axes[tuple(axis)] = order
+
+
+def _get_order(axes, axis):
+    for other, order in axes.items():
+        if abs(np.dot(axis, other)) > 1. - 1e-6:
+            return order
+    return 1
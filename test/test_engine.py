@@ -0,0 +1,651 @@
+from psider.engine import array
+import pytest
+import os
+
+
+def test__task_map(tmpdir):
+    task_map_path = str(tmpdir.join("tasks.dat"))
+    job_dir_paths = [str(tmpdir.join("jobs", str(index)))
+                     for index in range(3)]
+    array.write_task_map(task_map_path, job_dir_paths)
+    assert (tmpdir.join("tasks.dat").read() ==
+            "1 jobs/0\n2 jobs/1\n3 jobs/2\n")
+    task_map = array.read_task_map(task_map_path)
+    assert (task_map == {1: job_dir_paths[0], 2: job_dir_paths[1],
+                         3: job_dir_paths[2]})
+    assert (array.get_task_id({'SGE_TASK_ID': '2'}) == 2)
+    assert (array.get_task_directory(task_map_path, 3) == job_dir_paths[2])
+
+
+def test__local_array_scheduler(tmpdir):
+    job_dir_paths = []
+    for index in range(5):
+        job_dir_paths.append(str(tmpdir.mkdir(str(index))))
+    array.write_task_map(str(tmpdir.join("tasks.dat")), job_dir_paths)
+
+    def task():
+        with open("task_id", "w") as task_file:
+            task_file.write(os.environ["PSIDER_TASK_ID"])
+        if os.environ["PSIDER_TASK_ID"] == "4":
+            raise ValueError("Task failed.")
+        return os.path.basename(os.getcwd())
+
+    original_working_directory = os.getcwd()
+    os.chdir(str(tmpdir))
+    try:
+        results = array.LocalArrayScheduler(task, processes=2)()
+    finally:
+        os.chdir(original_working_directory)
+    assert (sorted(results) == [1, 2, 3, 4, 5])
+    assert (results[1] == "0")
+    assert (isinstance(results[4], Exception))
+    assert (tmpdir.join("2", "task_id").read() == "3")
+
+
+def test__local_array_scheduler_dead_worker(tmpdir):
+    import sys
+    job_dir_paths = [str(tmpdir.mkdir(str(index))) for index in range(4)]
+    array.write_task_map(str(tmpdir.join("tasks.dat")), job_dir_paths)
+
+    def task():
+        if os.environ["PSIDER_TASK_ID"] == "2":
+            os._exit(9)
+        if os.environ["PSIDER_TASK_ID"] == "3":
+            sys.exit("Task exited.")
+        return 0
+
+    original_working_directory = os.getcwd()
+    os.chdir(str(tmpdir))
+    try:
+        results = array.LocalArrayScheduler(task, processes=2)()
+    finally:
+        os.chdir(original_working_directory)
+    assert (results[1] == 0 and results[4] == 0)
+    assert (isinstance(results[2], RuntimeError))
+    assert ("code 9" in str(results[2]))
+    assert (isinstance(results[3], SystemExit))
+
+
+def test__completion_watcher(tmpdir):
+    import threading
+    from psider.engine.watch import CompletionWatcher
+
+    for use_inotify in (True, False):
+        root = tmpdir.mkdir(str(use_inotify))
+        output_paths = [str(root.mkdir(str(index)).join("output.dat"))
+                        for index in range(4)]
+        with open(output_paths[0], "w") as output_file:
+            output_file.write("Done\n")
+
+        def finish():
+            for output_path in output_paths[1:]:
+                with open(output_path, "w") as output_file:
+                    output_file.write("Running\n")
+                    output_file.flush()
+                    output_file.write("Done\n")
+
+        completed = []
+        watcher = CompletionWatcher(output_paths, "Done",
+                                    callback=completed.append,
+                                    use_inotify=use_inotify,
+                                    min_interval=0.01, max_interval=0.1)
+        thread = threading.Timer(0.05, finish)
+        thread.start()
+        assert (watcher.wait(timeout=10.))
+        thread.join()
+        assert (completed[0] == 0)
+        assert (sorted(completed) == [0, 1, 2, 3])
+        watcher = CompletionWatcher([str(root.join("missing.dat"))], "Done")
+        assert (not watcher.wait(timeout=0.05))
+        # A job whose process has exited without an output fails, even
+        # without a timeout.
+        exited = threading.Event()
+        watcher = CompletionWatcher(
+            [str(root.join("missing.dat")), output_paths[1]], "Done",
+            callback=completed.append, use_inotify=use_inotify,
+            min_interval=0.01, exited=lambda index: exited.is_set())
+        thread = threading.Timer(0.05, exited.set)
+        thread.start()
+        assert (watcher.wait())
+        thread.join()
+        assert (watcher.failed == {0})
+        assert (sorted(completed[4:]) == [0, 1])
+
+
+def test__completion_watcher_backstop(tmpdir, monkeypatch):
+    import threading
+    import time
+    from psider.engine import watch
+
+    def read_events(inotify, timeout):
+        # Like an output written on another host of a network file system.
+        time.sleep(timeout)
+        return []
+
+    monkeypatch.setattr(watch._Inotify, "read_events", read_events)
+    output_path = str(tmpdir.join("output.dat"))
+    watcher = watch.CompletionWatcher([output_path], "Done",
+                                      max_interval=0.1)
+    thread = threading.Timer(0.05, tmpdir.join("output.dat").write,
+                             ["Done\n"])
+    thread.start()
+    assert (watcher.wait(timeout=10.))
+    thread.join()
+
+
+def test__parse_memory():
+    from psider.engine import scheduler
+    assert (scheduler.parse_memory("\nmemory 270 mb\n") == 270000000)
+    assert (scheduler.parse_memory("  Memory 2 GiB\n") == 2 * 2 ** 30)
+    assert (scheduler.parse_memory("set basis sto-3g\n") is None)
+    resources = scheduler.Resources.from_input("memory 1.5 kb\n", cores=2)
+    assert ((resources.cores, resources.memory) == (2, 1500))
+
+
+def test__local_scheduler(tmpdir):
+    from psider.engine.scheduler import LocalScheduler, Resources, Task
+
+    def task():
+        if os.path.basename(os.getcwd()) == "3":
+            raise ValueError("Task failed.")
+        return (os.path.basename(os.getcwd()),
+                os.environ["OMP_NUM_THREADS"],
+                len(os.sched_getaffinity(0)))
+
+    tasks = [Task(task, str(tmpdir.mkdir(str(index))),
+                  Resources(cores=1 + index % 2, memory=100))
+             for index in range(5)]
+    local_scheduler = LocalScheduler(Resources(cores=2, memory=300))
+    results = local_scheduler.run(tasks)
+    assert (isinstance(results[3], ValueError))
+    cpus = min(2, len(os.sched_getaffinity(0)))
+    assert (results[:3] == [('0', '1', 1), ('1', '2', cpus), ('2', '1', 1)])
+    with pytest.raises(ValueError):
+        local_scheduler.run([Task(task, str(tmpdir), Resources(3))])
+
+
+def test__local_scheduler_avoid(tmpdir):
+    from psider.engine.scheduler import LocalScheduler, Resources, Task
+    job_dir_path = str(tmpdir)
+    local_scheduler = LocalScheduler(Resources(cores=2))
+    assert (not local_scheduler.avoid(job_dir_path))
+    local_scheduler.run([Task(os.getcwd, job_dir_path)])
+    first_cpus = local_scheduler.placements[job_dir_path]
+    assert (local_scheduler.avoid(job_dir_path))
+    local_scheduler.run([Task(os.getcwd, job_dir_path)])
+    second_cpus = local_scheduler.placements[job_dir_path]
+    assert (len(second_cpus) == 1 and second_cpus != first_cpus)
+    # With every CPU avoided, any will do.
+    assert (local_scheduler.avoid(job_dir_path))
+    assert (local_scheduler.run([Task(os.getcwd, job_dir_path)]) ==
+            [job_dir_path])
+
+
+def test__auto_tuner(tmpdir):
+    from psider.engine.scheduler import LocalScheduler, Resources, Task
+    from psider.engine.tuning import AutoTuner, get_splits, get_template_hash
+    assert (get_splits(4) == [(4, 1), (2, 2), (1, 4)])
+
+    def task():
+        return int(os.environ["OMP_NUM_THREADS"])
+
+    tasks = [Task(task, str(tmpdir)) for index in range(6)]
+    cache_path = str(tmpdir.join("tuning.json"))
+    key = get_template_hash("memory 270 mb\n")
+    tuner = AutoTuner(LocalScheduler(Resources(cores=2)), key, cache_path)
+    results = tuner.run(tasks)
+    assert (results[:3] == [1, 1, 2])
+    assert (sorted(tuner.throughputs) == [1, 2])
+    best = max(tuner.throughputs, key=tuner.throughputs.get)
+    assert (results[3:] == [best] * 3)
+    tuner = AutoTuner(LocalScheduler(Resources(cores=2)), key, cache_path)
+    assert (tuner.get_cores_per_task() == best)
+    assert (tuner.run(tasks) == [best] * 6)
+    assert (tuner.scheduler.cores_per_task == 1)
+
+
+def test__timing_history(tmpdir):
+    from psider.engine.scheduler import LocalScheduler, Resources, Task
+    from psider.engine.timing import TimingHistory
+    history_path = str(tmpdir.join("timings.json"))
+    history = TimingHistory(history_path)
+    history.record("abc", "displacement", 1.)
+    history.record("abc", "displacement", 3.)
+    history.record("abc", "reference", 5.)
+    assert (history.get_expected("abc", "displacement") == 2.)
+    assert (history.get_expected("abc", "gradient") is None)
+    local_scheduler = LocalScheduler(Resources(cores=1), history=history)
+    tasks = [Task(os.getpid, str(tmpdir), key="abc", kind=kind)
+             for kind in ("displacement", "reference", "gradient")]
+    assert (local_scheduler.get_order(tasks) == [2, 1, 0])
+    local_scheduler.run(tasks)
+    history = TimingHistory(history_path)
+    assert (history.data["abc"]["displacement"][0] == 3)
+    assert (history.data["abc"]["gradient"][0] == 1)
+
+
+def test__local_scheduler_stragglers(tmpdir):
+    import subprocess
+    import time
+    from psider.engine.scheduler import LocalScheduler, Resources, Task
+
+    def task():
+        name = os.path.basename(os.getcwd())
+        if name == "3":
+            child = subprocess.Popen(["sleep", "30"])
+            with open("child.pid", "w") as pid_file:
+                pid_file.write(str(child.pid))
+            time.sleep(30)
+        assert (open("input.dat").read() == name[0])
+        with open("output.dat", "w") as output_file:
+            output_file.write(name)
+        return name
+
+    tasks = []
+    for index in range(4):
+        tmpdir.mkdir(str(index)).join("input.dat").write(str(index))
+        tasks.append(Task(task, str(tmpdir.join(str(index)))))
+    local_scheduler = LocalScheduler(Resources(cores=2), straggler_factor=2.,
+                                     min_completed=2)
+    start = time.time()
+    results = local_scheduler.run(tasks)
+    assert (time.time() - start < 20.)
+    assert (results == ['0', '1', '2', '3.duplicate'])
+    assert (tmpdir.join("3", "output.dat").read() == "3.duplicate")
+    assert (not tmpdir.join("3.duplicate").check())
+    time.sleep(0.1)
+    child_pid = int(tmpdir.join("3", "child.pid").read())
+    assert (not os.path.exists("/proc/{:d}".format(child_pid)) or
+            open("/proc/{:d}/stat".format(child_pid)).read().split()[2] ==
+            'Z')
+
+
+def test__local_scheduler_cancellation(tmpdir):
+    import threading
+    import time
+    from psider.engine.process import Cancellation, CancelledError
+    from psider.engine.scheduler import LocalScheduler, Resources, Task
+    tasks = [Task(lambda: time.sleep(30), str(tmpdir)) for index in range(4)]
+    local_scheduler = LocalScheduler(Resources(cores=2), timeout=0.2)
+    start = time.time()
+    results = local_scheduler.run(tasks)
+    assert (all(isinstance(result, RuntimeError) for result in results))
+    assert (time.time() - start < 10.)
+    cancellation = Cancellation()
+    local_scheduler = LocalScheduler(Resources(cores=2),
+                                     cancellation=cancellation)
+    threading.Timer(0.2, cancellation.cancel).start()
+    with pytest.raises(CancelledError):
+        local_scheduler.run(tasks)
+    assert (time.time() - start < 20.)
+
+
+def test__retry_manager():
+    import re
+    from psider.engine.retry import RetryManager, RetryPolicy
+    from psider.engine.retry import FAILURE_PATTERNS, classify_failure
+    from psider.engine.retry import join_patterns
+    assert (classify_failure(None) == 'node_crash')
+    failure_pattern = join_patterns(FAILURE_PATTERNS)
+    assert (re.search(failure_pattern, "Total Energy = -1.0\n") is None)
+    assert (re.search(failure_pattern, "BUS ERROR\n") is not None)
+    assert (classify_failure("Could not converge SCF iterations") ==
+            'scf_convergence')
+    assert (classify_failure("write failed: No space left on device") ==
+            'scratch_full')
+    assert (classify_failure(None, message="Not enough free scratch space "
+                             "to start the job in disp4.") == 'scratch_full')
+    assert (classify_failure("SCF iteration 3\n", message="The job in disp4 "
+                             "exceeded its wall-time limit of 60 s.") ==
+            'timeout')
+    assert (classify_failure("SCF iteration 3\n", message="Odd.") ==
+            'unknown')
+    policy = RetryPolicy("backoff", delay=1., backoff=3.)
+    assert (policy.get_delay(1) == 1. and policy.get_delay(3) == 9.)
+    assert (RetryManager().record_failure(2, None).action == "relocate")
+    policy = RetryManager().record_failure(
+        2, None, "The job in disp2 needs 10 bytes of free scratch space.")
+    assert (policy.action == "backoff")
+    retry = RetryManager()
+    policy = retry.record_failure(0, "memory 2 gb\nMemoryError\n")
+    assert (policy.modify("memory 2 gb\nenergy('scf')\n") ==
+            "memory 4 gb\nenergy('scf')\n")
+    policy = retry.record_failure(1, "SCF did not converge\n")
+    assert (policy.modify("memory 2 gb\nenergy('scf')\n") ==
+            "memory 2 gb\nset maxiter 200\nset damping_percentage 20\n"
+            "energy('scf')\n")
+    assert (retry.record_failure(1, "SCF did not converge\n") is None)
+    retry.record_success(0)
+    assert (list(retry.failures) == [1])
+    assert (retry.failures[1].attempts == 2)
+
+
+def test__output_monitor(tmpdir):
+    import time
+    from psider.engine.monitor import OutputMonitor
+    from psider.engine.scheduler import LocalScheduler, Resources, Task
+    monitor = OutputMonitor(interval=0.05)
+    output = tmpdir.join("output.dat")
+    output.write("SCF iteration 1\nSCF iter")
+    assert (monitor.check(str(tmpdir)) is None)
+    output.write("ations diverged\n", mode="a")
+    assert (monitor.check(str(output)) == "SCF iterations diverged")
+    assert (monitor.check(str(output)) is None)
+    output.write("all fine\n")
+    assert (monitor.check(str(output)) is None)
+
+    def task():
+        with open("output.dat", "w") as output_file:
+            output_file.write("Starting\n")
+            output_file.flush()
+            if os.path.basename(os.getcwd()) == "1":
+                output_file.write("Fatal Error: SCF exploded\n")
+                output_file.flush()
+            time.sleep(30)
+
+    tasks = [Task(task, str(tmpdir.mkdir(str(index)))) for index in range(2)]
+    local_scheduler = LocalScheduler(Resources(cores=2), monitor=monitor,
+                                     timeout=20.)
+    start = time.time()
+    for index, result in local_scheduler.iter_run(tasks):
+        assert (index == 1)
+        assert ("Fatal Error" in str(result))
+        assert (time.time() - start < 10.)
+        break
+
+
+def test__pipeline():
+    import threading
+    import time
+    from psider.engine.pipeline import Pipeline
+    active = []
+    reaped = []
+    leads = []
+    lock = threading.Lock()
+
+    def items():
+        for index in range(20):
+            # The feeder may only run a bounded distance ahead.
+            with lock:
+                active.append(index)
+            yield index
+
+    def reap(value):
+        with lock:
+            reaped.append(value)
+            leads.append(len(active) - len(reaped))
+        if value == 13:
+            raise ValueError("Bad output.")
+        return value + 100
+
+    pipeline = Pipeline([lambda value: value * 2, lambda value: value // 2,
+                         reap], workers=[1, 3, 1], buffer_size=2)
+    results = pipeline.run(items())
+    assert (results[:13] == list(range(100, 113)))
+    assert (isinstance(results[13], ValueError))
+    assert (results[19] == 119)
+    # At most two items per queue, plus one per worker and the feeder.
+    assert (max(leads) <= 4 * 2 + 5 + 1)
+
+    # A consumer stopping early cancels the items in progress.
+    cancelled = threading.Event()
+    pipeline = Pipeline([lambda value: value or cancelled.wait(30.)],
+                        workers=[2], cancel=cancelled.set)
+    results = pipeline.iter_run(range(4))
+    assert (next(results) == (1, 1))
+    start = time.time()
+    results.close()
+    assert (cancelled.is_set() and time.time() - start < 10.)
+
+
+def test__stager(tmpdir):
+    from psider.engine.staging import Stager
+    source = tmpdir.join("basis.gbs")
+    source.write("basis")
+    job_dir_paths = [str(tmpdir.mkdir(str(index))) for index in range(3)]
+    for strategy in ("hardlink", "symlink", "reflink", "copy"):
+        stager = Stager(str(tmpdir.join("staged")), strategy)
+        paths = [stager.place(str(source), job_dir_path)
+                 for job_dir_path in job_dir_paths]
+        assert (all(open(path).read() == "basis" for path in paths))
+        assert (len(stager.manifest) == 1)
+        if strategy == "hardlink":
+            assert (os.stat(paths[0]).st_nlink == 4)
+        if strategy == "symlink":
+            assert (os.path.islink(paths[0]))
+        if strategy == "copy":
+            assert (os.stat(paths[0]).st_nlink == 1)
+    # A changed source is staged again.
+    source.write("new basis")
+    stager.place(str(source), job_dir_paths[0])
+    assert (len(Stager(str(tmpdir.join("staged"))).manifest) == 2)
+    assert (open(paths[0]).read() == "new basis")
+
+
+def test__scratch_manager(tmpdir):
+    from psider.engine.scheduler import LocalScheduler, Resources, Task
+    from psider.engine.scratch import ScratchManager
+    scratch = ScratchManager(str(tmpdir.join("scratch")))
+
+    def task():
+        path = os.environ["PSI_SCRATCH"]
+        assert (os.environ["TMPDIR"] == path)
+        open(os.path.join(path, "psi.32"), 'w').close()
+        return path, os.path.isdir(path)
+
+    job_dir_paths = [str(tmpdir.mkdir(str(index))) for index in range(3)]
+    tasks = [Task(task, job_dir_path) for job_dir_path in job_dir_paths]
+    results = LocalScheduler(Resources(cores=2),
+                             scratch=scratch).run(tasks)
+    assert (all(exists for path, exists in results))
+    assert (len(set(path for path, exists in results)) == 3)
+    assert (results[0][0] == scratch.get_path(job_dir_paths[0]))
+    scratch.release(job_dir_paths[0])
+    assert (not os.path.exists(results[0][0]))
+    assert (os.path.exists(results[1][0]))
+    # Tasks fail if none can ever be started.
+    full = ScratchManager(str(tmpdir.join("scratch")), min_free=2 ** 62)
+    with pytest.raises(RuntimeError, match="scratch space"):
+        LocalScheduler(Resources(cores=2), scratch=full).run(tasks)
+
+
+def test__scratch_manager_wait(tmpdir):
+    import shutil
+    import time
+    from psider.engine.scheduler import LocalScheduler, Resources, Task
+    from psider.engine.scratch import ScratchManager
+
+    class SingleScratchManager(ScratchManager):
+        # Has room for a single scratch directory.
+        def has_space(self):
+            return (not os.path.exists(self.root_path) or
+                    not os.listdir(self.root_path))
+
+    def task():
+        start = time.time()
+        time.sleep(0.1)
+        shutil.rmtree(os.environ["PSI_SCRATCH"])
+        return start, time.time()
+
+    scratch = SingleScratchManager(str(tmpdir.join("scratch")))
+    tasks = [Task(task, str(tmpdir.mkdir(str(index)))) for index in range(3)]
+    results = sorted(LocalScheduler(Resources(cores=3),
+                                    scratch=scratch).run(tasks))
+    # The tasks waited for each other's scratch space to be freed.
+    assert (all(results[index][1] <= results[index + 1][0]
+                for index in range(2)))
+
+
+def test__job_archive(tmpdir):
+    from psider.engine.archive import JobArchive
+    from psider.parse import file_exists, read_file
+    job_dir_paths = []
+    for index in range(3):
+        job_dir = tmpdir.mkdir("disp{:d}".format(index))
+        job_dir.join("output.dat").write("Energy = {:d}\n".format(index))
+        job_dir.join("psi.32").write("leftover")
+        job_dir_paths.append(str(job_dir))
+    archive = JobArchive(str(tmpdir.join("jobs.zip")))
+    archive.pack(job_dir_paths[:2], ["output.dat"])
+    assert (not tmpdir.join("disp0").check())
+    assert (archive.get_names() == ["disp0/output.dat", "disp1/output.dat"])
+    path = archive.get_path(os.path.join(job_dir_paths[1], "output.dat"))
+    assert (path == str(tmpdir.join("jobs.zip", "disp1", "output.dat")))
+    assert (read_file(path) == "Energy = 1\n")
+    assert (not file_exists(str(tmpdir.join("jobs.zip", "disp1", "psi.32"))))
+    # Packing more directories appends to the archive in place.
+    inode = os.stat(archive.archive_path).st_ino
+    archive.pack(job_dir_paths[2:], remove=False)
+    assert (os.stat(archive.archive_path).st_ino == inode)
+    assert (tmpdir.join("disp2").check())
+    assert (len(archive.get_names()) == 4)
+    assert (read_file(str(tmpdir.join("jobs.zip", "disp2", "psi.32"))) ==
+            "leftover")
+    # Packing a directory again replaces its members.
+    tmpdir.join("disp2", "psi.32").write("replaced")
+    archive.pack(job_dir_paths[2:])
+    assert (len(archive.get_names()) == 4)
+    assert (read_file(str(tmpdir.join("jobs.zip", "disp2", "psi.32"))) ==
+            "replaced")
+    assert (read_file(path) == "Energy = 1\n")
+    with pytest.raises(IOError):
+        read_file(str(tmpdir.join("jobs.zip", "disp5", "output.dat")))
+
+
+def test__job_store(tmpdir):
+    from psider.engine.store import JobStore
+    store = JobStore(str(tmpdir.join("store")))
+    tmpdir.join("basis.gbs").write("basis")
+    tmpdir.mkdir("other").join("basis.gbs").write("basis")
+    file_path = str(tmpdir.join("basis.gbs"))
+    key = store.get_key("input", [file_path])
+    assert (key == store.get_key("input",
+                                 [str(tmpdir.join("other", "basis.gbs"))]))
+    assert (key != store.get_key("input"))
+    assert (key != store.get_key("other input", [file_path]))
+    job_dir_path = str(tmpdir.join("jobs", "0"))
+    store_dir_path = store.link(job_dir_path, key)
+    assert (store_dir_path == store.get_path(key))
+    assert (os.path.realpath(job_dir_path) == store_dir_path)
+    store.link(job_dir_path, store.get_key("other input"))
+    assert (os.path.realpath(job_dir_path) != store_dir_path)
+    with pytest.raises(RuntimeError):
+        store.link(str(tmpdir.join("other")), key)
+    # Only one holder at a time may claim a store directory.
+    claim = store.claim(job_dir_path)
+    assert (claim is not None)
+    assert (store.claim(job_dir_path) is None)
+    store.release(claim)
+    store.release(store.claim(job_dir_path, block=True))
+
+
+def test__campaign_database(tmpdir):
+    import numpy as np
+    from psider.engine.database import CampaignDatabase
+    path = str(tmpdir.join("campaign.db"))
+    database = CampaignDatabase(path, batch_size=2)
+    database.add_jobs(["disp0", "disp1", "disp2"])
+    assert (database.count_states() == {'pending': 3, 'sown': 0,
+                                        'running': 0, 'finished': 0,
+                                        'done': 0, 'failed': 0})
+    database.record(0, 'running', attempt=True, start_time=1.)
+    database.record(0, 'done', result=np.array([1., 2.]), end_time=2.)
+    database.record(1, 'running', attempt=True)
+    database.record(1, 'failed', error="No output.")
+    assert (database.get_indices('failed') == [1])
+    job = database.get_job(0)
+    assert (job['state'] == 'done' and job['attempts'] == 1)
+    assert (job['result'] == [1., 2.] and job['end_time'] == 2.)
+    with pytest.raises(ValueError):
+        database.record(2, 'lost')
+    database.close()
+    # The records persist, and adding the jobs again keeps them.
+    database = CampaignDatabase(path)
+    database.add_jobs(["disp0", "disp1", "disp2"])
+    assert (database.get_results() == {0: [1., 2.]})
+    assert (database.get_job(1)['error'] == "No output.")
+    assert (database.count_states()['pending'] == 1)
+    # Rows of other jobs, by directory or key, are reset or removed.
+    database.add_jobs(["disp0", "other1"], ["key0", None])
+    assert (database.get_results() == {})
+    assert (database.count_states()['pending'] == 2)
+    database.record(0, 'done', result=1.)
+    database.add_jobs(["disp0", "other1"], ["key0", None])
+    assert (database.get_results() == {0: 1.})
+    database.add_jobs(["disp0", "other1"], ["key1", None])
+    assert (database.get_job(0)['result'] is None)
+    database.close()
+
+
+def test__bulk(tmpdir, monkeypatch):
+    from psider.engine import bulk
+    dir_paths = [str(tmpdir.join("jobs", str(index // 10), str(index)))
+                 for index in range(30)]
+    bulk.make_directories(dir_paths + dir_paths[:5])
+    assert (all(os.path.isdir(dir_path) for dir_path in dir_paths))
+    for durability in bulk.DURABILITY_POLICIES:
+        paths = bulk.run_bulk(
+            lambda dir_path: bulk.write_file(
+                os.path.join(dir_path, durability), durability, durability)
+            or os.path.join(dir_path, durability),
+            dir_paths, workers=4, durability=durability)
+        assert (all(open(path).read() == durability for path in paths))
+    with pytest.raises(ValueError):
+        bulk.run_bulk(len, dir_paths, durability="always")
+    with pytest.raises(IOError):
+        bulk.run_bulk(lambda name: bulk.write_file(name, ""),
+                      [str(tmpdir.join("missing", "input.dat"))], workers=2)
+    assert (bulk.measure_throughput(str(tmpdir), count=50) > 0.)
+    # The 'batch' policy syncs each file, then each directory, just once.
+    synced = []
+    monkeypatch.setattr(bulk, "_fsync_path", synced.append)
+    paths = [os.path.join(dir_path, "input.dat") for dir_path in dir_paths]
+    bulk.run_bulk(lambda path: bulk.write_file(path, "", "batch"), paths,
+                  workers=4, durability="batch")
+    assert (sorted(synced[:30]) == sorted(paths))
+    assert (synced[30:] == sorted(dir_paths))
+    bulk.sync_batch()
+    assert (len(synced) == 60)
+
+
+def test__process_kill(monkeypatch):
+    import time
+    from psider.engine.process import Process
+    process = Process(lambda: time.sleep(30))
+    start = time.time()
+
+    def killpg(pid, signal_number):
+        # As if the child hadn't called os.setsid yet.
+        raise ProcessLookupError(pid)
+
+    monkeypatch.setattr(os, "killpg", killpg)
+    process.kill()
+    assert (process.wait(10.))
+    assert (isinstance(process.result, RuntimeError))
+    assert (time.time() - start < 10.)
+
+
+def test__shared_results():
+    import numpy as np
+    from psider.engine.process import Process
+    from psider.engine.results import SharedResults
+    shared_results = SharedResults(5, (2, 3))
+    try:
+        processes = [Process(lambda index=index: shared_results.set(
+            index, np.full((2, 3), index))) for index in (0, 2, 3)]
+        for process in processes:
+            process.wait()
+        assert (shared_results.get_completed() == [0, 2, 3])
+        assert (not shared_results.is_complete())
+        assert (np.allclose(shared_results.get(2), 2.))
+        assert (shared_results.get(1) is None)
+        with pytest.raises(ValueError):
+            shared_results.set(1, [1., 2.])
+        # Another process can inspect the results by name.
+        inspector = SharedResults.attach(shared_results.name, 5, (2, 3))
+        assert (np.allclose(inspector.get(3), 3.))
+        inspector.close()
+        shared_results.clear()
+        assert (shared_results.get_completed() == [])
+    finally:
+        shared_results.unlink()
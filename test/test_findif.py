@@ -0,0 +1,159 @@
+from psider.molecule import Molecule
+from psider.findif import (
+    GradientDisplacements, HessianDisplacements, NormalModeDisplacements,
+    InternalCoordinateDisplacements
+)
+import numpy as np
+
+
+def pair_energy(molecule):
+    """A model energy: Morse-like pair terms weighted by atomic masses.
+    """
+    masses = np.array(molecule.masses)
+    distances = np.linalg.norm(molecule.coordinates[:, None] -
+                               molecule.coordinates[None, :], axis=2)
+    upper = np.triu_indices(molecule.natom, 1)
+    weights = np.outer(masses, masses)[upper]
+    return np.sum(weights * (1. - np.exp(-(distances[upper] - 1.8))) ** 2)
+
+
+def pair_gradient(molecule, step=1e-4):
+    displacements = GradientDisplacements(molecule, step_size=step, points=5)
+    return displacements.assemble([pair_energy(mol) for mol in displacements])
+
+
+def make_ammonia():
+    angles = np.arange(3) * 2. * np.pi / 3.
+    hydrogens = np.transpose([1.77 * np.cos(angles), 1.77 * np.sin(angles),
+                              [-0.5] * 3])
+    return Molecule(['N', 'H', 'H', 'H'],
+                    np.concatenate([[[0., 0., 0.2]], hydrogens]), 'bohr')
+
+
+def test__gradient_displacements():
+    mol = make_ammonia()
+    full = GradientDisplacements(mol, points=5)
+    assert (len(full) == 48)
+    gradient = full.assemble([pair_energy(disp) for disp in full])
+    reduced = GradientDisplacements(mol, points=5,
+                                    point_group=mol.get_point_group())
+    assert (len(reduced) < len(full))
+    assert (np.allclose(reduced.assemble([pair_energy(disp)
+                                          for disp in reduced]),
+                        gradient, atol=1e-5))
+    assert (np.allclose(gradient.sum(axis=0), 0., atol=1e-8))
+
+
+def test__hessian_displacements():
+    mol = make_ammonia()
+    full = HessianDisplacements(mol, points=5)
+    hessian = full.assemble([pair_gradient(disp) for disp in full])
+    reduced = HessianDisplacements(mol, points=5,
+                                   point_group=mol.get_point_group())
+    assert (len(reduced) < len(full))
+    assert (np.allclose(reduced.assemble([pair_gradient(disp)
+                                          for disp in reduced]),
+                        hessian, atol=1e-5))
+    assert (np.allclose(hessian, hessian.T))
+
+
+def test__normal_mode_displacements():
+    mol = make_ammonia()
+    cartesian = HessianDisplacements(mol, points=5)
+    hessian = cartesian.assemble([pair_gradient(disp) for disp in cartesian])
+    normal = NormalModeDisplacements(mol, hessian, points=5)
+    assert (len(normal) == 4 * 6)
+    normal_hessian = normal.assemble_hessian([pair_gradient(disp)
+                                              for disp in normal])
+    assert (np.allclose(normal.get_frequencies(normal_hessian),
+                        normal.frequencies, rtol=1e-4))
+    highest = NormalModeDisplacements(mol, hessian, modes=[5])
+    assert (len(highest) == 2)
+    assert (np.isclose(highest.frequencies[0], normal.frequencies[5]))
+
+
+def test__internal_coordinate_displacements():
+    mol = make_ammonia()
+    internal = InternalCoordinateDisplacements(mol, points=5)
+    assert (internal.directions.shape == (6, 12))
+    gradient = internal.assemble_gradient([pair_energy(disp)
+                                           for disp in internal])
+    assert (np.allclose(gradient, pair_gradient(mol), atol=1e-6))
+
+
+def test__active_region_displacements():
+    mol = make_ammonia()
+    full = HessianDisplacements(mol, points=5)
+    hessian = full.assemble([pair_gradient(disp) for disp in full])
+    hydrogens = HessianDisplacements(mol, points=5,
+                                     atoms=lambda label, xyz: label == 'H')
+    assert (list(hydrogens.atoms) == [1, 2, 3])
+    assert (len(hydrogens) == 36)
+    block = hydrogens.assemble([pair_gradient(disp) for disp in hydrogens])
+    assert (np.allclose(block, hessian[3:, 3:], atol=1e-6))
+    reduced = HessianDisplacements(mol, points=5, atoms=[1, 2, 3],
+                                   point_group=mol.get_point_group())
+    assert (len(reduced) < len(hydrogens))
+    assert (np.allclose(reduced.assemble([pair_gradient(disp)
+                                          for disp in reduced]),
+                        block, atol=1e-6))
+    nitrogen = GradientDisplacements(mol, points=5, atoms=[0])
+    gradient = nitrogen.assemble([pair_energy(disp) for disp in nitrogen])
+    assert (np.allclose(gradient, pair_gradient(mol)[:1], atol=1e-6))
+
+
+def test__incremental_assembler():
+    from psider.findif import IncrementalAssembler
+    mol = make_ammonia()
+    displacements = GradientDisplacements(mol)
+    energies = [pair_energy(disp) for disp in displacements]
+    assembler = IncrementalAssembler(displacements)
+    # Before any result, every entry is missing.
+    gradient, mask = assembler.get_gradient()
+    assert (gradient.shape == mask.shape == (4, 3))
+    assert (np.isnan(gradient).all() and not mask.any())
+    # The stencil of the first direction completes the N x component.
+    stencil = [displacements.get_index([(0, step)]) for step in (-1, 1)]
+    assert (assembler.add(stencil[0], energies[stencil[0]]) == [])
+    assert (assembler.add(stencil[1], energies[stencil[1]]) == [0])
+    gradient, mask = assembler.get_gradient()
+    assert (mask.sum() == 1 and mask[0, 0])
+    assert (np.isnan(gradient[1, 0]))
+    for index in reversed(range(len(displacements))):
+        assembler.add(index, energies[index])
+    assert (assembler.is_complete())
+    gradient, mask = assembler.get_gradient()
+    assert (mask.all())
+    assert (np.allclose(gradient, displacements.assemble(energies)))
+
+
+def test__incremental_assembler_hessian():
+    import pytest
+    from psider.findif import IncrementalAssembler
+    mol = make_ammonia()
+    displacements = HessianDisplacements(mol,
+                                         point_group=mol.get_point_group())
+    gradients = [pair_gradient(disp) for disp in displacements]
+    hessian = displacements.assemble(gradients)
+    assembler = IncrementalAssembler(displacements)
+    partial, mask = assembler.get_hessian()
+    assert (partial.shape == mask.shape == hessian.shape)
+    assert (np.isnan(partial).all() and not mask.any())
+    with pytest.raises(ValueError):
+        assembler.add(0, 0.)
+    # The nitrogen is alone in its orbit, so its rows finish on their own.
+    directions = np.flatnonzero(~displacements.directions[:, 3:].any(axis=1))
+    nitrogen = [index for index, label in enumerate(displacements.labels)
+                if all(direction in directions for direction, step in label)]
+    for index in nitrogen:
+        assembler.add(index, gradients[index])
+    partial, mask = assembler.get_hessian()
+    assert (mask[:3].all() and mask[:, :3].all() and not mask[3:, 3:].any())
+    # Until the other rows arrive, these are not averaged with them.
+    assert (np.allclose(partial[:3], hessian[:3], atol=1e-3))
+    assert (np.allclose(partial[:, :3], hessian[:, :3], atol=1e-3))
+    for index, gradient in enumerate(gradients):
+        assembler.add(index, gradient)
+    partial, mask = assembler.get_hessian()
+    assert (mask.all())
+    assert (np.allclose(partial, hessian))
@@ -0,0 +1,54 @@
+from psider.molecule import Molecule
+from psider.forcefield import ForceFieldDisplacements, SparseForceConstants
+import itertools
+import numpy as np
+
+
+def test__sparse_force_constants():
+    cubic = SparseForceConstants.from_estimates(
+        3, [[0, 1, 2], [2, 1, 0], [1, 1, 0]], [1., 3., 1e-14], 1e-12)
+    assert (len(cubic) == 1)
+    assert (cubic[1, 2, 0] == 2.)
+    assert (cubic[0, 1, 1] == 0.)
+    assert (cubic.to_dense(3)[2, 0, 1] == 2.)
+
+
+def test__force_field_displacements():
+    mol = Molecule(['O', 'H', 'H'],
+                   [[0.0000000000, 0.0000000000, -0.1222963033],
+                    [0.0000000000, -1.4154951186, 0.9704680348],
+                    [0.0000000000, 1.4154951186, 0.9704680348]], 'bohr')
+    # Any Hessian defines a set of normal coordinates; the model energy below
+    # is a quartic polynomial in them.
+    reference_hessian = np.diag(np.arange(1., 10.)) / 10.
+    quadratic = np.diag([0.1, 0.3, 0.5])
+    cubic = np.zeros((3, 3, 3))
+    for indices in itertools.permutations((0, 1, 2)):
+        cubic[indices] = 0.02
+    quartic = np.zeros((3, 3, 3, 3))
+    for indices in itertools.permutations((1, 1, 2, 2)):
+        quartic[indices] = 0.012
+    for derivative in ('hessian', 'gradient'):
+        displacements = ForceFieldDisplacements(mol, reference_hessian,
+                                                derivative)
+        back = np.linalg.pinv(displacements.directions)
+        values = []
+        for molecule in displacements:
+            shift = (molecule.coordinates -
+                     displacements.molecule.coordinates).ravel()
+            q = np.dot(back.T, shift)
+            if derivative == 'hessian':
+                value = (quadratic + np.einsum('ijk,k->ij', cubic, q) +
+                         np.einsum('ijkl,k,l->ij', quartic, q, q) / 2.)
+                values.append(np.linalg.multi_dot([back, value, back.T]))
+            else:
+                value = (np.dot(quadratic, q) +
+                         np.einsum('ijk,j,k->i', cubic, q, q) / 2. +
+                         np.einsum('ijkl,j,k,l->i', quartic, q, q, q) / 6.)
+                values.append(np.dot(back, value).reshape(-1, 3))
+        force_field = displacements.assemble(values)
+        assert (np.allclose(force_field.quadratic, quadratic, atol=1e-6))
+        assert (np.allclose(force_field.cubic.to_dense(3), cubic))
+        assert (len(force_field.cubic) == 1)
+        assert (np.isclose(force_field.quartic[2, 1, 2, 1], 0.012))
+        assert (len(force_field.quartic) == 1)
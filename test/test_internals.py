@@ -0,0 +1,55 @@
+from psider.molecule import Molecule
+from psider.internals import InternalCoordinates
+import numpy as np
+
+
+def make_ethanol():
+    return Molecule(['C', 'C', 'O', 'H', 'H', 'H', 'H', 'H', 'H'],
+                    [[-1.1850, -0.4056, 0.0000],
+                     [0.0000, 0.5364, 0.0000],
+                     [1.2132, -0.2035, 0.0000],
+                     [-2.1222, 0.1588, 0.0000],
+                     [-1.1412, -1.0436, 0.8862],
+                     [-1.1412, -1.0436, -0.8862],
+                     [-0.0486, 1.1822, 0.8834],
+                     [-0.0486, 1.1822, -0.8834],
+                     [1.9802, 0.3746, 0.0000]])
+
+
+def test__from_molecule():
+    internals = InternalCoordinates.from_molecule(make_ethanol())
+    assert (len(internals.bonds) == 8)
+    assert (len(internals.angles) == 13)
+    assert (len(internals.dihedrals) == 12)
+
+
+def test__b_matrix():
+    mol = make_ethanol()
+    mol.set_units('bohr')
+    internals = InternalCoordinates.from_molecule(mol)
+    x = mol.coordinates.flatten()
+    numerical = np.zeros((len(internals), len(x)))
+    for index in range(len(x)):
+        step = np.zeros(len(x))
+        step[index] = 1e-6
+        plus = internals.get_values((x + step).reshape(-1, 3))
+        minus = internals.get_values((x - step).reshape(-1, 3))
+        numerical[:, index] = internals.get_difference(plus, minus) / 2e-6
+    assert (np.allclose(internals.get_b_matrix(mol.coordinates), numerical,
+                        atol=1e-6))
+    basis = internals.get_delocalized_coordinates(mol.coordinates)
+    assert (basis.shape[1] == 3 * 9 - 6)
+
+
+def test__to_cartesian():
+    mol = make_ethanol()
+    mol.set_units('bohr')
+    internals = InternalCoordinates.from_molecule(mol)
+    basis = internals.get_delocalized_coordinates(mol.coordinates)
+    target = np.dot(basis.T, internals.get_values(mol.coordinates))
+    target[0] += 0.05
+    coordinates = internals.to_cartesian(mol.coordinates, target, basis)
+    reference = internals.get_values(mol.coordinates)
+    values = reference + internals.get_difference(
+        internals.get_values(coordinates), reference)
+    assert (np.allclose(np.dot(basis.T, values), target))
@@ -202,3 +202,37 @@ def test__gradient_string_with_psi_output_str():
                         [[0., 0., 0.08075016],
                          [-0., 0.03690303, -0.04037508],
                          [0., -0.03690303, -0.04037508]]))
+
+
+def test__compressed_files(tmpdir):
+    import gzip
+    from psider.parse import compress_file, read_file, search_last
+    output_str = "".join("  Total Energy = {:.10f}\n".format(-float(index))
+                         for index in range(2000)) + "Done\n"
+    for compression in ("gz", "bz2", "xz"):
+        path = str(tmpdir.join(compression, "output.dat"))
+        tmpdir.mkdir(compression).join("output.dat").write(output_str)
+        assert (compress_file(path, compression) == path + "." + compression)
+        assert (not tmpdir.join(compression, "output.dat").check())
+        assert (read_file(path) == output_str)
+        # Small chunks and windows put matches across chunk boundaries.
+        match = search_last(r"^ *Total Energy = +(\S+)\n", path, re.MULTILINE,
+                            window=64, chunk_size=100)
+        assert (match.group(1) == "-1999.0000000000")
+        assert (search_last(r"Failed", path) is None)
+    # Compression is also recognized by its magic bytes.
+    with gzip.open(str(tmpdir.join("output.dat")), 'wb') as output_file:
+        output_file.write(output_str.encode())
+    assert (read_file(str(tmpdir.join("output.dat"))) == output_str)
+
+
+def test__extract_energy_from_file(tmpdir):
+    from psider.parse import compress_file, extract_energy_from_file
+    tmpdir.join("output.dat").write("  Total Energy = -1.5\n"
+                                    "  Total Energy = -2.5\nDone\n")
+    path = compress_file(str(tmpdir.join("output.dat")))
+    energy_finder = EnergyFinder(r"Total Energy = +@Energy")
+    assert (np.isclose(extract_energy_from_file(path, energy_finder), -2.5))
+    energy_string = EnergyString.from_file(path, energy_finder, "Done")
+    assert (energy_string.was_successful())
+    assert (np.isclose(energy_string.extract_energy(), -2.5))
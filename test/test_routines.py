@@ -1,5 +1,6 @@
 from psider.routines import EnergyRoutine
 import numpy as np
+import os
 
 
 def test__energy_routine(tmpdir):
@@ -37,3 +38,548 @@ energy('mp2')
                                    job_file_paths=None)
     energy_routine.execute()
     assert(np.isclose(energy_routine.energy, -74.9956618520565144))
+
+
+def model_energy(coordinates):
+    return np.sum((coordinates[1:] - coordinates[0]) ** 2)
+
+
+def run_model_program():
+    """Stand in for a QC program: read input.dat and write output.dat.
+    """
+    import re
+    input_str = open("input.dat").read()
+    coordinates = np.array(re.findall(r"H +(\S+) +(\S+) +(\S+)", input_str),
+                           dtype=float)
+    with open("output.dat", "w") as output_file:
+        output_file.write("Energy = {:.15f}\nDone\n"
+                          .format(model_energy(coordinates)))
+    return 0
+
+
+def find_model_energy(output_str):
+    import re
+    return float(re.search(r"Energy = (\S+)", output_str).group(1))
+
+
+def make_model_routine(tmpdir, header="", **kwargs):
+    from psider.molecule import Molecule
+    from psider.template import InputTemplate
+    from psider.findif import GradientDisplacements
+    from psider.routines import DisplacementRoutine
+    molecule = Molecule(['H', 'H', 'H'],
+                        [[0., 0., 0.], [0., 0., 1.], [0., 1., 1.]], 'bohr')
+    input_template = InputTemplate(
+        header + "units bohr\n" + "H {:.12f} {:.12f} {:.12f}\n" * 3, 'bohr')
+    displacements = GradientDisplacements(molecule)
+    kwargs.setdefault("submit_function", run_model_program)
+    return DisplacementRoutine(displacements, input_template,
+                               finder=find_model_energy,
+                               success_pattern="Done",
+                               job_dir_path=str(tmpdir), disp_dir="disp@Disp",
+                               **kwargs)
+
+
+MODEL_GRADIENT = [[0., -2., -4.], [0., 0., 2.], [0., 2., 2.]]
+
+
+def test__displacement_routine(tmpdir):
+    routine = make_model_routine(tmpdir)
+    routine.execute()
+    assert (tmpdir.join("disp17", "output.dat").check())
+    gradient = routine.displacements.assemble(routine.get_values())
+    assert (np.allclose(gradient, MODEL_GRADIENT))
+
+
+def test__displacement_routine_batch_submission(tmpdir):
+    from psider.engine import LocalArrayScheduler
+    routine = make_model_routine(
+        tmpdir, batch_submission=True,
+        submit_function=LocalArrayScheduler(run_model_program, processes=3))
+    routine.sow()
+    assert (set(routine.get_states()) == {'sown'})
+    assert (tmpdir.join("tasks.dat").readlines()[17] == "18 disp17\n")
+    routine.run()
+    assert (routine.is_complete())
+    routine.reap()
+    gradient = routine.displacements.assemble(routine.get_values())
+    assert (np.allclose(gradient, MODEL_GRADIENT))
+
+
+def test__displacement_routine_batch_queued(tmpdir):
+    def queue_array_job():
+        # Like sbatch, this returns its exit code as soon as the array job
+        # is queued.
+        return 0
+
+    routine = make_model_routine(tmpdir, batch_submission=True,
+                                 submit_function=queue_array_job,
+                                 database=str(tmpdir.join("campaign.db")))
+    routine.sow()
+    routine.run()
+    assert (routine.database.count_states()['running'] == len(routine.jobs))
+    assert (routine.database.get_job(0)['end_time'] is None)
+    # The array job then runs on the cluster.
+    original_working_directory = os.getcwd()
+    try:
+        for job in routine.jobs:
+            os.chdir(job.job_dir_path)
+            run_model_program()
+    finally:
+        os.chdir(original_working_directory)
+    assert (routine.wait(timeout=10.))
+    job = routine.database.get_job(0)
+    assert (job['state'] == 'done' and job['end_time'] >= job['start_time'])
+
+
+def test__displacement_routine_batch_failures(tmpdir):
+    import pytest
+    from psider.engine import LocalArrayScheduler, RetryManager
+
+    def run_failing_program():
+        # One task raises and another one's worker dies, before either
+        # writes an output, and a third one ends without writing one.
+        name = os.path.basename(os.getcwd())
+        if name == "disp2":
+            return 0
+        if name == "disp4":
+            raise ValueError("Bad input.")
+        if name == "disp6":
+            os._exit(9)
+        return run_model_program()
+
+    routine = make_model_routine(
+        tmpdir.mkdir("plain"), batch_submission=True,
+        submit_function=LocalArrayScheduler(run_failing_program, processes=3))
+    with pytest.raises(ValueError):
+        routine.execute()
+    retry = RetryManager()
+    routine = make_model_routine(
+        tmpdir.mkdir("retry"), batch_submission=True, retry=retry,
+        submit_function=LocalArrayScheduler(run_failing_program, processes=3))
+    routine.execute()
+    values = routine.get_values()
+    assert (values[2] is None and values[4] is None and values[6] is None)
+    assert (sum(value is None for value in values) == 3)
+    assert (sorted(retry.failures) == [2, 4, 6])
+    assert (retry.failures[4].message == "Bad input.")
+    assert ("code 9" in retry.failures[6].message)
+    assert (retry.attempts[4] == 3)
+
+
+def test__displacement_routine_scheduler(tmpdir):
+    from psider.engine import LocalScheduler, Resources
+    routine = make_model_routine(
+        tmpdir, scheduler=LocalScheduler(Resources(cores=2)))
+    routine.execute()
+    gradient = routine.displacements.assemble(routine.get_values())
+    assert (np.allclose(gradient, MODEL_GRADIENT))
+
+
+def test__displacement_routine_shared_results(tmpdir):
+    import gc
+    from psider.engine import LocalScheduler, Resources
+    routine = make_model_routine(
+        tmpdir, scheduler=LocalScheduler(Resources(cores=2)),
+        result_shape=())
+    routine.sow()
+    routine.run()
+    assert (routine.shared_results.is_complete())
+    # The results are reaped from shared memory, not from the outputs.
+    for job in routine.jobs:
+        os.remove(job.output_path)
+    routine.reap()
+    assert (routine.shared_results is None)
+    gradient = routine.displacements.assemble(routine.get_values())
+    assert (np.allclose(gradient, MODEL_GRADIENT))
+    # An unreaped array is destroyed along with its routine.
+    routine.sow()
+    routine.run()
+    name = routine.shared_results.name
+    del routine
+    gc.collect()
+    assert (not os.path.exists(os.path.join("/dev/shm", name)))
+
+
+def test__displacement_routine_shared_results_stragglers(tmpdir):
+    import time
+    from psider.engine import LocalScheduler, Resources
+
+    def run_slow_program():
+        # The duplicate of the straggler runs in a copy of its directory.
+        if os.path.basename(os.getcwd()) == "disp3":
+            time.sleep(30)
+        return run_model_program()
+
+    routine = make_model_routine(
+        tmpdir, submit_function=run_slow_program, result_shape=(),
+        scheduler=LocalScheduler(Resources(cores=2), straggler_factor=2.))
+    start = time.time()
+    routine.execute()
+    assert (time.time() - start < 20.)
+    gradient = routine.displacements.assemble(routine.get_values())
+    assert (np.allclose(gradient, MODEL_GRADIENT))
+
+
+def test__submitter_timeout(tmpdir):
+    import subprocess
+    import time
+    import pytest
+    from psider.routines import Submitter
+
+    def submit_function():
+        child = subprocess.Popen(["sleep", "30"])
+        with open("child.pid", "w") as pid_file:
+            pid_file.write(str(child.pid))
+        return child.wait()
+
+    submitter = Submitter(submit_function, str(tmpdir), timeout=0.5)
+    start = time.time()
+    with pytest.raises(RuntimeError):
+        submitter.submit()
+    assert (time.time() - start < 10.)
+    time.sleep(0.1)
+    stat_path = "/proc/{:s}/stat".format(tmpdir.join("child.pid").read())
+    assert (not os.path.exists(stat_path) or
+            open(stat_path).read().split()[2] == 'Z')
+    assert (Submitter(os.getcwd, str(tmpdir)).submit() == str(tmpdir))
+
+
+def test__submitter_in_process(tmpdir):
+    import threading
+    import pytest
+    from psider.engine import Cancellation
+    from psider.routines import Submitter
+    calls = []
+    lock = threading.Lock()
+
+    def submit_function():
+        calls.append(os.getcwd())
+        raise KeyError("x")
+
+    # Without a reason to fork, the function runs in this process.
+    with pytest.raises(KeyError):
+        Submitter(submit_function, str(tmpdir)).submit()
+    assert (calls == [str(tmpdir)])
+    assert (os.getcwd() != str(tmpdir))
+    # Return values needn't be picklable.
+    assert (Submitter(lambda: lock, str(tmpdir)).submit() is lock)
+    # In a child process, the exception keeps its type.
+    with pytest.raises(KeyError):
+        Submitter(submit_function, str(tmpdir),
+                  cancellation=Cancellation()).submit()
+    assert (calls == [str(tmpdir)])
+
+
+def test__displacement_routine_retry(tmpdir):
+    from psider.engine import RetryManager
+
+    def run_flaky_program():
+        # Runs out of memory in two jobs unless the memory is doubled, and
+        # fails for an unknown reason in a third.
+        name = os.path.basename(os.getcwd())
+        failures = {"disp3": "std::bad_alloc\n", "disp5": "std::bad_alloc\n",
+                    "disp7": "Something odd happened.\n"}
+        if ("memory 540 mb" not in open("input.dat").read() and
+                name in failures):
+            with open("output.dat", "w") as output_file:
+                output_file.write(failures[name])
+            return 1
+        return run_model_program()
+
+    retry = RetryManager()
+    routine = make_model_routine(tmpdir, header="memory 270 mb\n",
+                                 submit_function=run_flaky_program,
+                                 retry=retry)
+    routine.execute()
+    values = routine.get_values()
+    assert (values[7] is None)
+    assert (all(value is not None for index, value in enumerate(values)
+                if index != 7))
+    assert (list(retry.failures) == [7])
+    assert (retry.failures[7].failure_class == 'unknown')
+    assert (retry.attempts[3] == 2 and retry.attempts[7] == 1)
+    assert ("memory 540 mb" in tmpdir.join("disp3", "input.dat").read())
+
+
+def test__displacement_routine_relocate(tmpdir):
+    from psider.engine import LocalScheduler, Resources, RetryManager
+    from psider.engine.tuning import AutoTuner
+
+    def run_crashing_program():
+        # The first run of one job dies without an output.
+        if (os.path.basename(os.getcwd()) == "disp4" and
+                not os.path.exists("crashed")):
+            open("crashed", "w").close()
+            return 1
+        return run_model_program()
+
+    retry = RetryManager()
+    scheduler = AutoTuner(LocalScheduler(Resources(cores=2)), "model",
+                          str(tmpdir.join("tuning.json")))
+    routine = make_model_routine(tmpdir.mkdir("jobs"), retry=retry,
+                                 submit_function=run_crashing_program,
+                                 scheduler=scheduler)
+    routine.execute()
+    assert (None not in routine.get_values())
+    assert (retry.history[0].failure_class == 'node_crash')
+    assert (retry.attempts[4] == 2)
+    job_dir_path = routine.jobs[4].job_dir_path
+    assert (scheduler.scheduler.avoided[job_dir_path])
+
+
+def test__displacement_routine_retry_timeout(tmpdir):
+    import time
+    from psider.engine import RetryManager
+
+    def run_hanging_program():
+        # The first run of one job hangs past the wall-time limit.
+        if (os.path.basename(os.getcwd()) == "disp4" and
+                not os.path.exists("hung")):
+            open("hung", "w").close()
+            time.sleep(30)
+        return run_model_program()
+
+    retry = RetryManager()
+    routine = make_model_routine(tmpdir, retry=retry, timeout=1.,
+                                 submit_function=run_hanging_program)
+    routine.execute()
+    assert (None not in routine.get_values())
+    assert (retry.history[0].failure_class == 'timeout')
+
+
+def test__displacement_routine_bulk_sow(tmpdir):
+    routine = make_model_routine(tmpdir)
+    routine.sow(workers=4, durability="directory")
+    assert (set(routine.get_states()) == {'sown'})
+    routine.run()
+    routine.reap()
+    gradient = routine.displacements.assemble(routine.get_values())
+    assert (np.allclose(gradient, MODEL_GRADIENT))
+
+
+def test__displacement_routine_pipelined(tmpdir):
+    routine = make_model_routine(tmpdir)
+    reaped = [index for index, value in routine.iter_execute(workers=3)]
+    assert (sorted(reaped) == list(range(len(routine.jobs))))
+    gradient = routine.displacements.assemble(routine.get_values())
+    assert (np.allclose(gradient, MODEL_GRADIENT))
+
+
+def test__displacement_routine_pipelined_abort(tmpdir):
+    import time
+    import pytest
+
+    def run_slow_program():
+        if os.path.basename(os.getcwd()) == "disp1":
+            raise ValueError("Bad input.")
+        time.sleep(30)
+        return run_model_program()
+
+    routine = make_model_routine(tmpdir, submit_function=run_slow_program)
+    start = time.time()
+    with pytest.raises(ValueError):
+        for index, value in routine.iter_execute(workers=3):
+            pass
+    # The jobs still running were killed rather than waited for.
+    assert (time.time() - start < 10.)
+
+
+def test__displacement_routine_scratch(tmpdir):
+    from psider.engine import ScratchManager
+
+    def submit_function():
+        open(os.path.join(os.environ["PSI_SCRATCH"], "psi.32"), 'w').close()
+        return run_model_program()
+
+    scratch = ScratchManager(str(tmpdir.join("scratch")))
+    routine = make_model_routine(tmpdir.mkdir("jobs"), scratch=scratch,
+                                 submit_function=submit_function)
+    routine.sow()
+    routine.run([0, 1])
+    assert (len(tmpdir.join("scratch").listdir()) == 2)
+    routine.execute()
+    assert (tmpdir.join("scratch").listdir() == [])
+    gradient = routine.displacements.assemble(routine.get_values())
+    assert (np.allclose(gradient, MODEL_GRADIENT))
+
+
+def test__displacement_routine_scratch_failures(tmpdir):
+    from psider.engine import RetryManager, ScratchManager
+
+    def submit_function():
+        open(os.path.join(os.environ["PSI_SCRATCH"], "psi.32"), 'w').close()
+        if os.path.basename(os.getcwd()) == "disp4":
+            with open("output.dat", "w") as output_file:
+                output_file.write("Something odd happened.\n")
+            return 1
+        return run_model_program()
+
+    for pipelined in (False, True):
+        scratch = ScratchManager(str(tmpdir.join("scratch", str(pipelined))))
+        retry = RetryManager()
+        routine = make_model_routine(tmpdir.mkdir(str(pipelined)),
+                                     scratch=scratch, retry=retry,
+                                     submit_function=submit_function)
+        routine.execute(pipelined=pipelined)
+        assert (list(retry.failures) == [4])
+        assert (os.listdir(scratch.root_path) == [])
+
+
+def test__displacement_routine_pack(tmpdir):
+    routine = make_model_routine(tmpdir)
+    routine.execute()
+    values = routine.get_values()
+    routine.pack()
+    assert (not tmpdir.join("disp17").check())
+    assert (tmpdir.join("jobs.zip").check())
+    assert (set(routine.get_states()) == {'done'})
+    assert ("H " in routine.jobs[3].input_str)
+    routine.values = None
+    routine.reap()
+    assert (routine.get_values() == values)
+
+
+def test__displacement_routine_compression(tmpdir):
+    routine = make_model_routine(tmpdir, compression="xz")
+    routine.execute()
+    assert (tmpdir.join("disp17", "output.dat.xz").check())
+    assert (not tmpdir.join("disp17", "output.dat").check())
+    assert (set(routine.get_states()) == {'done'})
+    values = routine.get_values()
+    routine.pack()
+    routine.values = None
+    routine.reap()
+    assert (routine.get_values() == values)
+
+
+def test__displacement_routine_store(tmpdir):
+    store_path = str(tmpdir.join("store"))
+    routine = make_model_routine(tmpdir.mkdir("first"), store=store_path)
+    routine.execute()
+    assert (tmpdir.join("first", "disp3").islink())
+
+    def submit_function():
+        raise RuntimeError("Job ran again.")
+
+    # The same jobs in another campaign reuse the stored outputs.
+    other = make_model_routine(tmpdir.mkdir("second"), store=store_path,
+                               submit_function=submit_function)
+    other.execute()
+    assert (other.get_values() == routine.get_values())
+    other.pack()
+    assert (not tmpdir.join("second", "disp3").check())
+    assert (tmpdir.join("first", "disp3", "output.dat").check())
+
+
+def test__displacement_routine_store_concurrent(tmpdir):
+    import threading
+    import time
+    store_path = str(tmpdir.join("store"))
+
+    def run_counted_program():
+        with open("runs", "a") as runs_file:
+            runs_file.write("run\n")
+        time.sleep(0.01)
+        return run_model_program()
+
+    # Two campaigns with the same jobs run at once, one through a scheduler
+    # and the other pipelined, and a timeout runs each job in a child.
+    from psider.engine import LocalScheduler, Resources
+    routines = [
+        make_model_routine(tmpdir.mkdir("first"), store=store_path,
+                           submit_function=run_counted_program,
+                           scheduler=LocalScheduler(Resources(cores=2))),
+        make_model_routine(tmpdir.mkdir("second"), store=store_path,
+                           submit_function=run_counted_program,
+                           timeout=60.)]
+    threads = [threading.Thread(target=routines[0].execute),
+               threading.Thread(target=routines[1].execute,
+                                kwargs={'pipelined': True})]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (routines[0].get_values() == routines[1].get_values())
+    assert (None not in routines[0].get_values())
+    for job in routines[0].jobs:
+        store_dir = os.path.realpath(job.job_dir_path)
+        assert (open(os.path.join(store_dir, "runs")).read() == "run\n")
+
+
+def test__displacement_routine_database(tmpdir):
+    database_path = str(tmpdir.join("campaign.db"))
+    routine = make_model_routine(tmpdir, database=database_path)
+    routine.execute()
+    counts = routine.database.count_states()
+    assert (counts['done'] == len(routine.jobs))
+    job = routine.database.get_job(3)
+    assert (job['attempts'] == 1)
+    assert (job['sow_time'] <= job['start_time'] <= job['end_time'])
+    # A restarted campaign takes the results from the database.
+    restarted = make_model_routine(tmpdir, database=database_path)
+    assert (restarted.restore() == [])
+    assert (restarted.get_values() == routine.get_values())
+    # A campaign at another geometry takes none of them.
+    from psider.molecule import Molecule
+    from psider.findif import GradientDisplacements
+    from psider.routines import DisplacementRoutine
+    molecule = Molecule(['H', 'H', 'H'],
+                        [[0., 0., 0.], [0., 0., 1.1], [0., 1., 1.]], 'bohr')
+    moved = DisplacementRoutine(
+        GradientDisplacements(molecule), routine.input_template,
+        submit_function=run_model_program, finder=find_model_energy,
+        success_pattern="Done", job_dir_path=str(tmpdir),
+        disp_dir="disp@Disp", database=database_path)
+    assert (len(moved.restore()) == len(moved.jobs))
+
+
+def test__displacement_routine_database_failures(tmpdir):
+    import pytest
+
+    def run_failing_program():
+        if os.path.basename(os.getcwd()) == "disp4":
+            raise ValueError("Bad input.")
+        return run_model_program()
+
+    from psider.engine import LocalScheduler, Resources
+    routine = make_model_routine(
+        tmpdir.mkdir("plain"), submit_function=run_failing_program,
+        database=str(tmpdir.join("plain.db")))
+    routine.sow()
+    with pytest.raises(ValueError):
+        routine.run()
+    assert (routine.database.get_job(3)['state'] == 'finished')
+    assert (routine.database.get_job(4)['state'] == 'failed')
+    assert (routine.database.get_job(5)['state'] == 'sown')
+    routine = make_model_routine(
+        tmpdir.mkdir("scheduler"), submit_function=run_failing_program,
+        database=str(tmpdir.join("scheduler.db")),
+        scheduler=LocalScheduler(Resources(cores=2)))
+    routine.sow()
+    routine.run()
+    assert (routine.database.count_states()['finished'] ==
+            len(routine.jobs) - 1)
+    job = routine.database.get_job(4)
+    assert (job['state'] == 'failed' and job['error'] == "Bad input.")
+    assert (job['start_time'] <= job['end_time'])
+
+
+def test__job(tmpdir):
+    from psider.molecule import Molecule
+    from psider.template import InputTemplate
+    from psider.routines import Job
+    tmpdir.join("basis.gbs").write("basis")
+    molecule = Molecule(['H'], [[0., 0., 1.]], 'bohr')
+    input_template = InputTemplate("H {:.1f} {:.1f} {:.1f}\n", 'bohr')
+    job = Job(molecule, input_template, "input.dat", "output.dat",
+              str(tmpdir.join("job")), [str(tmpdir.join("basis.gbs"))])
+    assert (not tmpdir.join("job").check())
+    assert (job.input_str == "H 0.0 0.0 1.0\n")
+    job.write_input()
+    assert (tmpdir.join("job", "basis.gbs").read() == "basis")
+    job.input_str = "H 0.0 0.0 2.0\n"
+    assert (tmpdir.join("job", "input.dat").read() == "H 0.0 0.0 1.0\n")
+    job.write_input()
+    assert (job.input_str == tmpdir.join("job", "input.dat").read() ==
+            "H 0.0 0.0 2.0\n")
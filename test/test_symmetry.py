@@ -0,0 +1,38 @@
+from psider.molecule import Molecule
+import numpy as np
+
+
+def test__point_group_water():
+    mol = Molecule(['O', 'H', 'H'],
+                   [[0.0000000000, 0.0000000000, -0.0647162893],
+                    [0.0000000000, -0.7490459967, 0.5135472375],
+                    [0.0000000000, 0.7490459967, 0.5135472375]])
+    point_group = mol.get_point_group()
+    assert (point_group.name == 'c2v')
+    assert (len(point_group) == 4)
+    assert (point_group.get_unique_atoms() == {0: [0], 1: [1, 2]})
+
+
+def test__point_group_benzene():
+    angles = np.arange(6) * np.pi / 3.
+    carbons = np.transpose([1.39 * np.cos(angles), 1.39 * np.sin(angles),
+                            np.zeros(6)])
+    hydrogens = np.transpose([2.47 * np.cos(angles), 2.47 * np.sin(angles),
+                              np.zeros(6)])
+    rotation = np.linalg.qr(np.arange(9.).reshape(3, 3) ** 2 + 1.)[0]
+    coordinates = np.dot(np.concatenate([carbons, hydrogens]), rotation) + 1.
+    mol = Molecule(['C'] * 6 + ['H'] * 6, coordinates)
+    point_group = mol.get_point_group()
+    assert (point_group.name == 'd6h')
+    assert (len(point_group) == 24)
+    for op, atom_map in zip(point_group.operations, point_group.atom_maps):
+        images = np.dot(coordinates - point_group.center, op.T)
+        assert (np.allclose(images, coordinates[atom_map] -
+                            point_group.center))
+
+
+def test__point_group_sf6():
+    coordinates = np.concatenate([[[0., 0., 0.]], 1.56 * np.eye(3),
+                                  -1.56 * np.eye(3)])
+    mol = Molecule(['S'] + ['F'] * 6, coordinates)
+    assert (mol.get_point_group().name == 'oh')
@@ -0,0 +1,46 @@
+from psider.molecule import Molecule
+from psider.internals import InternalCoordinates
+from psider.vibrations import analyze, analyze_isotopologues
+from psider.util import physconst
+import numpy as np
+
+
+def test__analyze_diatomic():
+    mol = Molecule(['H', 'H'], [[0., 0., 0.], [0., 0., 1.4]], 'bohr')
+    projector = np.diag([0., 0., 1.])
+    hessian = 0.37 * np.block([[projector, -projector],
+                               [-projector, projector]])
+    analysis = analyze(mol, hessian)
+    frequency = np.sqrt(0.37 / (mol.masses[0] / 2.)) * physconst.au2wavenumber
+    assert (len(analysis) == 1)
+    assert (np.isclose(analysis.frequencies[0], frequency))
+    assert (np.isclose(analysis.reduced_masses[0], mol.masses[0]))
+    assert (np.isclose(analysis.zero_point_energy,
+                       frequency / 2. / physconst.hartree2wavenumber))
+
+
+def test__analyze_isotopologues():
+    mol = Molecule(['O', 'H', 'H'],
+                   [[0.0000000000, 0.0000000000, -0.0647162893],
+                    [0.0000000000, -0.7490459967, 0.5135472375],
+                    [0.0000000000, 0.7490459967, 0.5135472375]])
+    internals = InternalCoordinates.from_molecule(mol)
+    mol_bohr = mol.copy()
+    mol_bohr.set_units('bohr')
+    b_matrix = internals.get_b_matrix(mol_bohr.coordinates)
+    force_constants = np.array([[0.5, 0.01, 0.02],
+                                [0.01, 0.5, 0.02],
+                                [0.02, 0.02, 0.16]])
+    hessian = np.linalg.multi_dot([b_matrix.T, force_constants, b_matrix])
+    isotopologues = [('O', 'H', 'H'), ('O', 'H2', 'H'), ('O18', 'H2', 'H2')]
+    analyses = analyze_isotopologues(mol, hessian, isotopologues)
+    for isotopologue, analysis in zip(isotopologues, analyses):
+        assert (len(analysis) == 3)
+        single = analyze(mol, hessian, isotopologue)
+        assert (np.allclose(single.frequencies, analysis.frequencies))
+        # Without rigid-body motion in the Hessian, projection changes nothing.
+        weights = np.repeat(np.array(analysis.masses) ** -0.5, 3)
+        values = np.linalg.eigvalsh(hessian * np.outer(weights, weights))
+        assert (np.allclose(values[-3:], analysis.force_constants))
+    assert (np.all(analyses[1].frequencies < analyses[0].frequencies))
+    assert (analyses[2].zero_point_energy < analyses[1].zero_point_energy)
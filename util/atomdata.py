@@ -17,6 +17,21 @@ def get_mass(isotope_symbol):
                          .format(isotope_symbol))
 
 
+def get_covalent_radius(isotope_symbol):
+    """Determine the covalent radius, in angstroms, from an isotope label.
+
+    Args:
+      isotope_symbol: A string containing an atomic symbol, followed by an
+        optional mass number identifying the isotope.
+    """
+    try:
+        atomic_symbol = isotope_symbol.upper().rstrip("0123456789")
+        return covalent_radii[atomic_symbols.index(atomic_symbol)]
+    except:
+        raise ValueError("Label {:s} does not identify an atom with a known "
+                         "covalent radius".format(isotope_symbol))
+
+
 atomic_symbols = ["X", "H", "HE", "LI", "BE", "B", "C", "N", "O", "F", "NE",
                   "NA", "MG", "AL", "SI", "P", "S", "CL", "AR", "K", "CA", "SC",
                   "TI", "V", "CR", "MN", "FE", "CO", "NI", "CU", "ZN", "GA",
@@ -1305,3 +1320,15 @@ isotope_masses = [0.0, 1.00782503207, 1.00782503207, 2.01410177785,
                   291.194384, 292.199786, 289.198862, 290.198590, 291.200011,
                   292.199786, 291.206564, 291.206564, 292.207549, 293.214670,
                   293.214670]
+
+# Covalent radii in angstroms, indexed by atomic number.  Cordero et al.,
+# Dalton Trans. 2832 (2008).
+covalent_radii = [0.00, 0.31, 0.28, 1.28, 0.96, 0.84, 0.76, 0.71, 0.66, 0.57,
+                  0.58, 1.66, 1.41, 1.21, 1.11, 1.07, 1.05, 1.02, 1.06, 2.03,
+                  1.76, 1.70, 1.60, 1.53, 1.39, 1.39, 1.32, 1.26, 1.24, 1.32,
+                  1.22, 1.22, 1.20, 1.19, 1.20, 1.20, 1.16, 2.20, 1.95, 1.90,
+                  1.75, 1.64, 1.54, 1.47, 1.46, 1.42, 1.39, 1.45, 1.44, 1.42,
+                  1.39, 1.39, 1.38, 1.39, 1.40, 2.44, 2.15, 2.07, 2.04, 2.03,
+                  2.01, 1.99, 1.98, 1.98, 1.96, 1.94, 1.92, 1.92, 1.89, 1.90,
+                  1.87, 1.87, 1.75, 1.70, 1.62, 1.51, 1.44, 1.41, 1.36, 1.36,
+                  1.32, 1.45, 1.46, 1.48, 1.40, 1.50, 1.50]
@@ -2,3 +2,12 @@
 """
 
 bohr2angstrom = 0.52917721067
+hartree2joule = 4.359744650e-18
+amu2kilogram = 1.660539040e-27
+speed_of_light = 2.99792458e10  # in cm/s
+hartree2wavenumber = 219474.6313702
+# Converts the square root of a mass-weighted force constant, in
+# hartree/(bohr^2 amu), into a harmonic wavenumber in cm^-1.
+au2wavenumber = ((hartree2joule / amu2kilogram) ** 0.5 /
+                 (bohr2angstrom * 1e-10) / (2. * 3.141592653589793 *
+                                            speed_of_light))
@@ -0,0 +1,140 @@
+"""Module for harmonic vibrational analysis.
+"""
+import numpy as np
+
+from .util import atomdata, physconst
+
+
+def analyze(molecule, hessian, masses=None):
+    """Perform a harmonic vibrational analysis.
+
+    Args:
+        molecule: A Molecule object.
+        hessian: A 3N x 3N Cartesian Hessian, in hartree/bohr^2.
+        masses: Optional isotope labels or atomic masses (in amu) replacing
+            `molecule.masses`.
+
+    Returns:
+        VibrationalAnalysis: The frequencies and normal modes.
+    """
+    if masses is None:
+        masses = molecule.masses
+    return analyze_isotopologues(molecule, hessian, [masses])[0]
+
+
+def analyze_isotopologues(molecule, hessian, isotopologues):
+    """Perform harmonic vibrational analyses for many sets of masses at once.
+
+    The Hessian is shared, so the mass-weighting, projection and
+    diagonalization of all isotopologues are carried out as single batched
+    array operations.
+
+    Args:
+        molecule: A Molecule object.
+        hessian: A 3N x 3N Cartesian Hessian, in hartree/bohr^2.
+        isotopologues: A sequence of isotopologues, each given as a sequence
+            of isotope labels (e.g. ('O', 'H2', 'H')) or of masses in amu.
+
+    Returns:
+        list: A VibrationalAnalysis object for each isotopologue.
+    """
+    masses = np.array([[atomdata.get_mass(mass) if isinstance(mass, str)
+                        else float(mass) for mass in isotopologue]
+                       for isotopologue in isotopologues])
+    natom = molecule.natom
+    if masses.shape[1] != natom:
+        raise ValueError("Each isotopologue needs one mass per atom.")
+    hessian = np.asarray(hessian, dtype=float).reshape(3 * natom, 3 * natom)
+    coordinates = molecule.copy()
+    coordinates.set_units("bohr")
+    coordinates = coordinates.coordinates
+    inverse_root_masses = np.repeat(masses ** -0.5, 3, axis=1)
+    weighted = (hessian[None, :, :] * inverse_root_masses[:, :, None] *
+                inverse_root_masses[:, None, :])
+    # Rotate into the space orthogonal to the mass-weighted rigid-body
+    # motions, which removes them exactly instead of relying on their
+    # eigenvalues being small.
+    rigid = _get_rigid_body_vectors(coordinates, masses)
+    u, s, vt = np.linalg.svd(rigid, full_matrices=True)
+    nrigid = np.sum(s[0] > 1e-6 * s[0, 0])
+    internal = u[:, :, nrigid:]
+    projected = np.einsum('kia,kij,kjb->kab', internal, weighted, internal)
+    values, vectors = np.linalg.eigh(projected)
+    modes = np.einsum('kia,kab->kbi', internal, vectors)
+    return [VibrationalAnalysis(molecule, mass, value, mode)
+            for mass, value, mode in zip(masses, values, modes)]
+
+
+class VibrationalAnalysis(object):
+    """The harmonic vibrations of one isotopologue.
+
+    Attributes:
+        molecule: The Molecule object that was analyzed.
+        masses (`np.ndarray`): The atomic masses, in amu.
+        force_constants (`np.ndarray`): The eigenvalues of the projected,
+            mass-weighted Hessian, in hartree/(amu bohr^2).
+        frequencies (`np.ndarray`): The harmonic wavenumbers, in cm^-1, in
+            increasing order.  Imaginary frequencies are negative.
+        mass_weighted_modes (`np.ndarray`): A k x 3N array of orthonormal
+            mass-weighted normal modes.
+        normal_modes (`np.ndarray`): A k x natom x 3 array of normalized
+            Cartesian displacements for each mode.
+        reduced_masses (`np.ndarray`): The reduced masses, in amu.
+        zero_point_energy (float): Half the sum of the real frequencies, in
+            hartree.
+    """
+
+    def __init__(self, molecule, masses, force_constants, mass_weighted_modes):
+        self.molecule = molecule
+        self.masses = np.asarray(masses, dtype=float)
+        self.force_constants = np.asarray(force_constants)
+        self.mass_weighted_modes = np.asarray(mass_weighted_modes)
+        self.frequencies = (np.sign(self.force_constants) *
+                            np.sqrt(abs(self.force_constants)) *
+                            physconst.au2wavenumber)
+        displacements = self.get_cartesian_displacements()
+        self.reduced_masses = 1. / np.sum(displacements ** 2, axis=1)
+        self.normal_modes = (displacements *
+                             np.sqrt(self.reduced_masses)[:, None]).reshape(
+                                 len(displacements), -1, 3)
+        real = self.frequencies[self.frequencies > 0.]
+        self.zero_point_energy = (np.sum(real) / 2. /
+                                  physconst.hartree2wavenumber)
+
+    def __len__(self):
+        return len(self.frequencies)
+
+    def get_cartesian_displacements(self):
+        """Return the Cartesian displacements of the mass-weighted modes.
+
+        Returns:
+            np.ndarray: A k x 3N array, in bohr, of the displacement produced
+                by a unit step (1 amu^1/2 bohr) along each normal coordinate.
+        """
+        inverse_root_masses = np.repeat(self.masses ** -0.5, 3)
+        return self.mass_weighted_modes * inverse_root_masses[None, :]
+
+
+def _get_rigid_body_vectors(coordinates, masses):
+    """Build the mass-weighted translation and rotation vectors.
+
+    Args:
+        coordinates: An natom x 3 array of Cartesian coordinates.
+        masses: A k x natom array of masses.
+
+    Returns:
+        np.ndarray: A k x 3N x 6 array of (not orthonormalized) vectors.
+    """
+    nmass, natom = masses.shape
+    root_masses = np.sqrt(masses)
+    centers = (np.dot(masses, coordinates) /
+               np.sum(masses, axis=1)[:, None])
+    relative = coordinates[None, :, :] - centers[:, None, :]
+    vectors = np.zeros((nmass, natom, 3, 6))
+    for axis in range(3):
+        vectors[:, :, axis, axis] = root_masses
+        unit = np.zeros(3)
+        unit[axis] = 1.
+        vectors[:, :, :, 3 + axis] = (np.cross(unit, relative) *
+                                      root_masses[:, :, None])
+    return vectors.reshape(nmass, 3 * natom, 6)